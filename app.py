@@ -1,28 +1,55 @@
+import itertools
+import json
 import os
-from datetime import date, datetime
-from typing import List, Tuple
+from datetime import datetime
 
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify
-from flask_mail import Mail, Message
+import click
+from flask import Flask, Response, abort, render_template, request, redirect, url_for, flash, jsonify, stream_with_context
+from flask_mail import Mail
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from sqlalchemy import and_, or_
+from sqlalchemy.orm import contains_eager, joinedload
 from dotenv import load_dotenv
 
-from models import db, Customer, MessageLog, Event, Tenant, User, Watch, Template
+from models import db, Customer, MessageLog, Event, EventRun, User, Watch, Template
+from auth import load_user, login_password
+from dispatcher import Dispatcher, run_progress
+from engines import init_engines, read_replica
+from export import DEFAULT_EXPORT_BATCH_SIZE, csv_chunks, export_query, gzip_chunks, has_rows, iter_rows, ndjson_chunks
+from importer import DEFAULT_IMPORT_CHUNK_SIZE, ImportFileError, run_import, start_job
+from message_templates import PLACEHOLDERS, invalidate_template, unknown_placeholders
+from metrics import init_metrics
+from migrations import MIGRATIONS, applied_versions, backfill_derived_columns, check_schema, init_db, upgrade
+from pagecache import bump_versions, cached_fragment, conditional_page, init_page_cache, page_versions
+from pagination import Page, keyset_page, page_size_arg
+from queryplans import check_query_plans
+from querystats import init_query_stats, query_budget
+from reporting import cached_message_counts, report_query
+from retention import TABLES, apply_retention, archived_export_rows, partitions, read_archive
+from rules import rules_description
+from runner import execute_run, launch_run, start_run
+from search import fts_available, search_customers
+from stats import bump_counters, default_tenant_id, reconcile_stats, tenant_stats
+from transport import get_smtp_pool
 from config import Config
-import pandas as pd
 
 
 # Load environment variables from a .env file if present
 load_dotenv()
 
+# Data the dashboard's ETag and statistics are versioned by
+DASHBOARD_SCOPES = ("customers", "watches", "messages")
+
 
 def create_app() -> Flask:
     app = Flask(__name__)
     app.config.from_object(Config)
 
     db.init_app(app)
+    init_engines(app)
     mail = Mail(app)
+    init_query_stats(app)
+    init_metrics(app)
+    init_page_cache(app)
     
     # Initialize Flask-Login
     login_manager = LoginManager()
@@ -30,49 +57,164 @@ def create_app() -> Flask:
     login_manager.login_view = 'login'
     login_manager.login_message = 'Please log in to access this page.'
 
-    @login_manager.user_loader
-    def load_user(user_id):
-        return User.query.get(int(user_id))
+    login_manager.user_loader(load_user)
 
+    # Schema and demo data are set up by `flask init-db`; booting a worker
+    # only checks the schema version, and looks up the search index once
+    # rather than in the first search request.
     with app.app_context():
-        db.create_all()
-        # Ensure a default tenant exists for demo
-        default_tenant = Tenant.query.filter_by(name="Default Watch Shop").first()
-        if not default_tenant:
-            default_tenant = Tenant(name="Default Watch Shop", email="owner@example.com", mobile="9999999999")
-            db.session.add(default_tenant)
-            db.session.commit()
-        
-        # Create default admin user if not exists
-        admin_user = User.query.filter_by(email="admin@example.com").first()
-        if not admin_user:
-            admin_user = User(
-                tenant_id=default_tenant.tenant_id,
-                email="admin@example.com",
-                role="owner"
-            )
-            admin_user.set_password("admin123")
-            db.session.add(admin_user)
+        problem = check_schema()
+        if problem:
+            app.logger.warning(problem)
+        else:
+            fts_available()
+
+    @app.cli.command("init-db")
+    @click.option("--admin-email", default="admin@example.com", show_default=True)
+    @click.option("--admin-password", default="admin123", show_default=True)
+    def init_db_command(admin_email, admin_password):
+        """Apply pending migrations and create the demo shop and admin user."""
+        applied = init_db(echo=click.echo, admin_email=admin_email, admin_password=admin_password)
+        click.echo(f"Applied {len(applied)} migrations; schema is at version {max(applied_versions(), default=0)}.")
+
+    @app.cli.command("db-upgrade")
+    @click.option("--to", "target", type=int, default=None, help="Stop after this schema version.")
+    def db_upgrade_command(target):
+        """Apply pending schema migrations."""
+        applied = upgrade(target, echo=click.echo)
+        click.echo(f"Applied {len(applied)} migrations; schema is at version {max(applied_versions(), default=0)}.")
+
+    @app.cli.command("db-status")
+    def db_status_command():
+        """List schema migrations and whether each has been applied."""
+        applied = set(applied_versions())
+        for migration in MIGRATIONS:
+            mark = "applied" if migration.version in applied else "pending"
+            click.echo(f"{migration.version:>3}  {mark:<8} {migration.name}")
+
+    @app.cli.command("check-query-plans")
+    @click.option("--verbose", is_flag=True, help="Print every plan, not just full scans.")
+    def check_query_plans_command(verbose):
+        """Fail if a hot query's SQLite plan reads a whole table, or a range query walks a whole index."""
+        failures = 0
+        for name, plan, scans in check_query_plans():
+            failures += bool(scans)
+            if scans or verbose:
+                click.echo(f"{'SCAN' if scans else 'ok'}: {name}")
+                for line in plan:
+                    click.echo(f"    {line}")
+        if failures:
+            raise click.ClickException(f"{failures} hot queries scan a whole table or index.")
+        click.echo("All hot queries use an index, and range queries search it.")
+
+    @app.cli.command("backfill-derived-columns")
+    @click.option("--chunk-size", default=1000, show_default=True, help="Rows updated per commit.")
+    def backfill_derived_columns_command(chunk_size):
+        """Recompute derived columns (due dates, normalized mobiles), e.g. after rows were written with raw SQL."""
+        updated = backfill_derived_columns(chunk_size)
+        click.echo(f"Backfilled derived columns for {updated} rows.")
+
+    @app.cli.command("run-events")
+    @click.option("--tenant-id", type=int, default=None, help="Only this tenant (default: every tenant).")
+    @click.option("--workers", type=int, default=None, help="Worker processes (default: EVENT_WORKERS).")
+    @click.option("--date", "today", type=click.DateTime(formats=["%Y-%m-%d"]), default=None,
+                  help="Evaluate rules as of this day.")
+    def run_events_command(tenant_id, workers, today):
+        """Run the event check now and queue its messages in the outbox."""
+        run = start_run(tenant_id)
+        counts = execute_run(run.run_id, today.date() if today else None, workers=workers)
+        run = db.session.get(EventRun, run.run_id)
+        scanned = run_progress(run)["scanned"]
+        for key, count in counts.items():
+            click.echo(f"{key}: {count} messages from {scanned.get(key, 0)} candidates scanned")
+        for shard in run.shards:
+            ids = f"{shard.first_id or ''}..{shard.end_id or ''}"
+            click.echo(f"shard {shard.shard_id} tenant {shard.tenant_id} ids {ids}: {shard.status}, "
+                       f"{shard.messages} messages in {shard.seconds:.2f}s (pid {shard.worker_pid})")
+        click.echo(f"Run #{run.run_id} {run.status}: {run.messages} messages from {len(run.shards)} shards.")
+
+    def import_command(kind):
+        @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+        @click.option("--tenant-id", type=int, default=None, help="Shop to import into (default: the demo shop).")
+        @click.option("--chunk-size", default=DEFAULT_IMPORT_CHUNK_SIZE, show_default=True,
+                      help="Rows read, upserted and committed at a time.")
+        @click.option("--date-format", default="%Y-%m-%d", show_default=True, help="strptime format of date cells.")
+        @click.option("--rejects", "rejects_path", type=click.Path(dir_okay=False), default=None,
+                      help="Append rejected rows, with the reason, to this CSV file.")
+        @click.option("--restart", is_flag=True, help="Start from the top instead of resuming an unfinished import.")
+        def command(path, tenant_id, chunk_size, date_format, rejects_path, restart):
+            tenant_id = tenant_id or default_tenant_id()
+            job = start_job(kind, path, tenant_id, resume=not restart)
+            if job.rows_done:
+                click.echo(f"Resuming import #{job.job_id} after row {job.rows_done}.")
+
+            def progress(job, rows_per_second):
+                click.echo(f"{job.rows_done} rows: {job.inserted} inserted, {job.updated} updated, "
+                           f"{job.rejected} rejected ({rows_per_second:,.0f} rows/s)")
+
+            try:
+                job = run_import(job, chunk_size, date_format, rejects_path, progress)
+            except ImportFileError as exc:
+                raise click.ClickException(str(exc))
+            click.echo(f"Import #{job.job_id} completed: {job.inserted} inserted, {job.updated} updated, "
+                       f"{job.rejected} rejected.")
+
+        command.__doc__ = f"Upsert {kind} from a CSV or XLSX file, resuming an unfinished import of the same file."
+        return app.cli.command(f"import-{kind}")(command)
+
+    import_command("customers")
+    import_command("watches")
+
+    @app.cli.command("dispatch-outbox")
+    @click.option("--once", is_flag=True, help="Drain what is due now and exit instead of polling.")
+    @click.option("--poll-interval", default=1.0, show_default=True, help="Seconds between polls.")
+    def dispatch_outbox_command(once, poll_interval):
+        """Deliver queued event messages from the outbox."""
+        dispatcher = Dispatcher(app)
+        if once:
+            totals = dispatcher.drain(wait_for_retries=False)
+            click.echo(f"Sent {totals['sent']}, retrying {totals['retry']}, failed {totals['failed']}.")
+            smtp = get_smtp_pool(app).stats()
+            click.echo(f"SMTP: {smtp['messages_sent']} emails over {smtp['handshakes']} handshakes, "
+                       f"{smtp['messages_per_second']:.1f} emails/s.")
+        else:
+            dispatcher.run_forever(poll_interval)
+
+    @app.cli.command("reconcile-stats")
+    def reconcile_stats_command():
+        """Recount dashboard statistics and repair any drift in the counter rows."""
+        drift = reconcile_stats()
+        if drift:
+            # Dashboards cached by browsers and other processes show the old counts.
+            bump_versions(None, *DASHBOARD_SCOPES)
             db.session.commit()
-
-    def add_months(start_date: date, months: int) -> date:
-        if start_date is None:
-            return None
-        month = start_date.month - 1 + months
-        year = start_date.year + month // 12
-        month = month % 12 + 1
-        day = min(start_date.day, [31,
-                                   29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28,
-                                   31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month - 1])
-        return date(year, month, day)
-
-    def rules_description() -> List[Tuple[str, str]]:
-        return [
-            ("battery_replacement", "Battery replacement reminder (18 months after purchase)"),
-            ("birthday_wishes", "Birthday wishes"),
-            ("extended_warranty", "Extended warranty upsell"),
-            ("bundling_offers", "Bundling offers"),
-        ]
+        for tenant_id, counter, stored, actual in drift:
+            click.echo(f"tenant {tenant_id} {counter}: {stored} -> {actual}")
+        click.echo(f"Reconciled statistics ({len(drift)} counters corrected).")
+
+    @app.cli.command("apply-retention")
+    @click.option("--days", type=int, default=None, help="Keep this many days in the database (default: RETENTION_DAYS).")
+    @click.option("--chunk-size", type=int, default=None, help="Rows per transaction (default: RETENTION_CHUNK_SIZE).")
+    def apply_retention_command(days, chunk_size):
+        """Move old events and message logs to the archive, keeping their daily counts, and purge settled outbox rows."""
+        days = app.config["RETENTION_DAYS"] if days is None else days
+        moved = apply_retention(days, app.config["ARCHIVE_DIR"], chunk_size or app.config["RETENTION_CHUNK_SIZE"],
+                                echo=click.echo)
+        for table, count in moved.items():
+            click.echo(f"{table}: {count} rows {'archived' if table in TABLES else 'purged'}")
+        click.echo(f"Kept the last {days} days; archive is in {app.config['ARCHIVE_DIR']}.")
+
+    @app.cli.command("read-archive")
+    @click.argument("table", type=click.Choice(["message_logs", "events"]))
+    @click.option("--start", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="First day.")
+    @click.option("--end", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Last day.")
+    @click.option("--event-type", default=None)
+    @click.option("--status", default=None)
+    def read_archive_command(table, start, end, event_type, status):
+        """Print archived rows as NDJSON, newest first."""
+        for row in read_archive(app.config["ARCHIVE_DIR"], table, start and start.date(), end and end.date(),
+                                event_type=event_type, status=status):
+            click.echo(json.dumps(row, ensure_ascii=False))
 
     @app.route("/")
     def index():
@@ -85,7 +227,8 @@ def create_app() -> Flask:
             password = request.form.get("password")
             user = User.query.filter_by(email=email).first()
             
-            if user and user.check_password(password):
+            if user and login_password(user, password):
+                db.session.commit()  # keeps a rehashed password
                 login_user(user)
                 flash("Login successful!", "success")
                 return redirect(url_for("dashboard"))
@@ -101,32 +244,45 @@ def create_app() -> Flask:
         flash("You have been logged out.", "info")
         return redirect(url_for("login"))
 
+    def customers_page(search: str) -> Page:
+        if search:
+            # Search results are ranked by relevance, so they come back as one bounded page.
+            page_size = page_size_arg()
+            return Page(items=search_customers(search, limit=page_size), page_size=page_size)
+        return keyset_page(Customer.query, [Customer.id], lambda c: [c.id])
+
+    def watches_page() -> Page:
+        return keyset_page(Watch.query.join(Customer).options(contains_eager(Watch.customer)),
+                           [Watch.watch_id], lambda w: [w.watch_id])
+
+    def logs_page() -> Page:
+        return keyset_page(MessageLog.query.options(joinedload(MessageLog.customer)),
+                           [MessageLog.sent_at, MessageLog.id], lambda log: [log.sent_at, log.id])
+
     @app.route("/dashboard")
+    @query_budget(6)
+    @read_replica
+    @conditional_page(*DASHBOARD_SCOPES)
     @login_required
     def dashboard():
         # Get search query
         search = request.args.get('search', '')
-        customers_query = Customer.query
-        
-        if search:
-            customers_query = customers_query.filter(
-                or_(
-                    Customer.name.contains(search),
-                    Customer.email.contains(search),
-                    Customer.mobile.contains(search)
-                )
-            )
-        
-        customers = customers_query.order_by(Customer.id.desc()).all()
-        
-        # Get statistics
-        total_customers = Customer.query.count()
-        total_watches = Watch.query.count()
-        total_events = Event.query.count()
-        recent_events = Event.query.order_by(Event.sent_at.desc()).limit(5).all()
+
+        def customers_table():
+            page = customers_page(search)
+            next_url, prev_url = page.urls("dashboard", search=search)
+            return render_template("customers_table.html", customers=page.items, next_url=next_url, prev_url=prev_url)
+
+        # Get statistics, in step with the page's ETag
+        stats = tenant_stats(current_user.tenant_id, page_versions(*DASHBOARD_SCOPES))
+        total_customers = stats["customers"]
+        total_watches = stats["watches"]
+        total_events = stats["events"]
+        recent_events = (Event.query.options(joinedload(Event.customer))
+                         .order_by(Event.sent_at.desc()).limit(5).all())
         
         return render_template("dashboard.html", 
-                             customers=customers, 
+                             customers_table=cached_fragment("customers", ("customers",), customers_table),
                              search=search,
                              total_customers=total_customers,
                              total_watches=total_watches,
@@ -155,8 +311,10 @@ def create_app() -> Flask:
                 model=model,
                 mobile=mobile,
                 email=email,
+                tenant_id=current_user.tenant_id,
             )
             db.session.add(customer)
+            bump_counters(current_user.tenant_id, customers=1)
             db.session.commit()
             flash("Customer added successfully.", "success")
             return redirect(url_for("dashboard"))
@@ -164,10 +322,17 @@ def create_app() -> Flask:
         return render_template("add_customer.html")
 
     @app.route("/watches")
+    @query_budget(3)
+    @conditional_page("watches", "customers")
     @login_required
     def watches():
-        watches = Watch.query.join(Customer).order_by(Watch.watch_id.desc()).all()
-        return render_template("watches.html", watches=watches)
+        def watches_table():
+            page = watches_page()
+            next_url, prev_url = page.urls("watches")
+            return render_template("watches_table.html", watches=page.items, next_url=next_url, prev_url=prev_url)
+
+        return render_template("watches.html",
+                               watches_table=cached_fragment("watches", ("watches", "customers"), watches_table))
 
     @app.route("/add_watch", methods=["GET", "POST"])
     @login_required
@@ -192,6 +357,7 @@ def create_app() -> Flask:
                 notes=notes
             )
             db.session.add(watch)
+            bump_counters(current_user.tenant_id, watches=1)
             db.session.commit()
             flash("Watch added successfully.", "success")
             return redirect(url_for("watches"))
@@ -201,10 +367,22 @@ def create_app() -> Flask:
         return render_template("add_watch.html", customers=customers, selected_customer_id=customer_id)
 
     @app.route("/templates")
+    @query_budget(3)
+    @conditional_page("templates", per_tenant=True)
     @login_required
     def templates():
-        templates = Template.query.filter_by(tenant_id=current_user.tenant_id).all()
-        return render_template("templates.html", templates=templates)
+        def templates_table():
+            templates = Template.query.filter_by(tenant_id=current_user.tenant_id).all()
+            return render_template("templates_table.html", templates=templates)
+
+        return render_template("templates.html", templates_table=cached_fragment(
+            "templates", ("templates",), templates_table, per_tenant=True))
+
+    def warn_unknown_placeholders(content: str) -> None:
+        unknown = unknown_placeholders(content or "")
+        if unknown:
+            names = ", ".join("{" + name + "}" for name in unknown)
+            flash(f"Unknown placeholders will be sent as written: {names}", "warning")
 
     @app.route("/add_template", methods=["GET", "POST"])
     @login_required
@@ -216,14 +394,16 @@ def create_app() -> Flask:
             template = Template(
                 tenant_id=current_user.tenant_id,
                 name=name,
-                content=content
+                content=content,
+                event_type=request.form.get("event_type") or None,
             )
             db.session.add(template)
             db.session.commit()
             flash("Template added successfully.", "success")
+            warn_unknown_placeholders(content)
             return redirect(url_for("templates"))
 
-        return render_template("add_template.html")
+        return render_template("add_template.html", rules=rules_description(), placeholders=PLACEHOLDERS)
 
     @app.route("/edit_template/<int:template_id>", methods=["GET", "POST"])
     @login_required
@@ -231,155 +411,182 @@ def create_app() -> Flask:
         template = Template.query.filter_by(template_id=template_id, tenant_id=current_user.tenant_id).first_or_404()
         
         if request.method == "POST":
+            content = request.form.get("content")
             template.name = request.form.get("name")
-            template.content = request.form.get("content")
+            template.event_type = request.form.get("event_type") or None
+            if content != template.content:
+                template.content = content
+                template.version += 1
             db.session.commit()
+            invalidate_template(template.template_id)
             flash("Template updated successfully.", "success")
+            warn_unknown_placeholders(content)
             return redirect(url_for("templates"))
 
-        return render_template("edit_template.html", template=template)
+        return render_template("edit_template.html", template=template, rules=rules_description(),
+                               placeholders=PLACEHOLDERS)
 
     @app.route("/events", methods=["GET", "POST"])
     @login_required
     def events():
         if request.method == "POST":
-            sent_messages = 0
-            now_date = date.today()
-            customers = Customer.query.all()
-
-            # Use default tenant for demo purposes
-            tenant = Tenant.query.filter_by(name="Default Watch Shop").first()
-
-            for customer in customers:
-                # Rule: Battery replacement reminder
-                if customer.purchase_date:
-                    due_date = add_months(customer.purchase_date, 18)
-                    if due_date and now_date >= due_date:
-                        text = f"Hi {customer.name}, it's been 18 months since your {customer.model} purchase. Time for a battery check!"
-                        db.session.add(MessageLog(
-                            customer_id=customer.id,
-                            event_type="battery_replacement",
-                            message=text,
-                            status="sent",
-                        ))
-                        db.session.add(Event(
-                            tenant_id=tenant.tenant_id if tenant else None,
-                            customer_id=customer.id,
-                            event_type="battery_replacement",
-                            channel="whatsapp",
-                            sent_at=datetime.utcnow(),
-                            status="sent",
-                        ))
-                        sent_messages += 1
-                        flash(f"Message sent to {customer.name} via WhatsApp (mock).", "success")
-
-                # Rule: Birthday wishes
-                if customer.dob:
-                    if customer.dob.month == now_date.month and customer.dob.day == now_date.day:
-                        text = f"Happy Birthday, {customer.name}! Wishing you a wonderful year ahead. – Your Watch Retailer"
-                        email_status = "sent"
-                        if customer.email and app.config.get("MAIL_USERNAME"):
-                            try:
-                                msg = Message("Happy Birthday!", recipients=[customer.email])
-                                msg.body = text
-                                Mail(app).send(msg)
-                                email_status = "email_sent"
-                            except Exception:
-                                email_status = "email_failed"
-                        db.session.add(MessageLog(
-                            customer_id=customer.id,
-                            event_type="birthday_wishes",
-                            message=text,
-                            status=email_status,
-                        ))
-                        db.session.add(Event(
-                            tenant_id=tenant.tenant_id if tenant else None,
-                            customer_id=customer.id,
-                            event_type="birthday_wishes",
-                            channel="email" if email_status == "email_sent" else "whatsapp",
-                            sent_at=datetime.utcnow(),
-                            status="sent" if email_status != "email_failed" else "failed",
-                        ))
-                        sent_messages += 1
-                        flash(f"Birthday message sent to {customer.name} via {'Email' if email_status=='email_sent' else 'mock' }.", "success")
-
-                # Rule: Extended warranty upsell (e.g., 11 months after purchase)
-                if customer.purchase_date:
-                    warranty_offer_date = add_months(customer.purchase_date, 11)
-                    if warranty_offer_date and now_date >= warranty_offer_date:
-                        text = f"Hi {customer.name}, extend your warranty for {customer.model} before it expires!"
-                        db.session.add(MessageLog(
-                            customer_id=customer.id,
-                            event_type="extended_warranty",
-                            message=text,
-                            status="sent",
-                        ))
-                        db.session.add(Event(
-                            tenant_id=tenant.tenant_id if tenant else None,
-                            customer_id=customer.id,
-                            event_type="extended_warranty",
-                            channel="whatsapp",
-                            sent_at=datetime.utcnow(),
-                            status="sent",
-                        ))
-                        sent_messages += 1
-
-                # Rule: Bundling offers (always available as periodic promotion)
-                text = f"Exclusive offer for you, {customer.name}: Save on straps and accessories when you visit us this week!"
-                db.session.add(MessageLog(
-                    customer_id=customer.id,
-                    event_type="bundling_offers",
-                    message=text,
-                    status="sent",
-                ))
-                db.session.add(Event(
-                    tenant_id=tenant.tenant_id if tenant else None,
-                    customer_id=customer.id,
-                    event_type="bundling_offers",
-                    channel="whatsapp",
-                    sent_at=datetime.utcnow(),
-                    status="sent",
-                ))
-                sent_messages += 1
+            run = start_run(current_user.tenant_id)
+            launch_run(app, run.run_id)
 
-            db.session.commit()
-            flash(f"Event check completed. {sent_messages} messages logged.", "info")
+            progress_url = url_for("event_run_progress", run_id=run.run_id)
+            if request.accept_mimetypes.best == "application/json":
+                return jsonify({"run_id": run.run_id, "progress_url": progress_url}), 202
+            flash(f"Event run #{run.run_id} started.", "info")
             return redirect(url_for("events"))
 
-        return render_template("events.html", rules=rules_description())
+        runs = (EventRun.query.filter_by(tenant_id=current_user.tenant_id)
+                .order_by(EventRun.run_id.desc()).limit(5).all())
+        return render_template("events.html", rules=rules_description(), runs=runs)
+
+    @app.route("/events/runs/<int:run_id>")
+    @query_budget(4)
+    @login_required
+    def event_run_progress(run_id):
+        run = EventRun.query.filter_by(run_id=run_id, tenant_id=current_user.tenant_id).first_or_404()
+        return jsonify(run_progress(run))
 
     @app.route("/reports")
+    @query_budget(3)
+    @read_replica
+    @conditional_page("messages", "customers")
     @login_required
     def reports():
-        logs = MessageLog.query.order_by(MessageLog.sent_at.desc()).all()
-        return render_template("reports.html", logs=logs)
+        def logs_table():
+            page = logs_page()
+            next_url, prev_url = page.urls("reports")
+            return render_template("logs_table.html", logs=page.items, next_url=next_url, prev_url=prev_url)
+
+        return render_template("reports.html",
+                               logs_table=cached_fragment("logs", ("messages", "customers"), logs_table))
+
+    @app.route("/api/customers")
+    @query_budget(5)
+    @read_replica
+    @login_required
+    def api_customers():
+        page = customers_page(request.args.get("search", ""))
+        return jsonify({
+            "items": [
+                {
+                    "id": c.id,
+                    "name": c.name,
+                    "dob": c.dob.isoformat() if c.dob else None,
+                    "purchase_date": c.purchase_date.isoformat() if c.purchase_date else None,
+                    "model": c.model,
+                    "mobile": c.mobile,
+                    "email": c.email,
+                }
+                for c in page.items
+            ],
+            "page_size": page.page_size,
+            "next_cursor": page.next_cursor,
+            "prev_cursor": page.prev_cursor,
+        })
+
+    @app.route("/api/watches")
+    @query_budget(3)
+    @login_required
+    def api_watches():
+        page = watches_page()
+        return jsonify({
+            "items": [
+                {
+                    "watch_id": w.watch_id,
+                    "customer_id": w.customer_id,
+                    "brand": w.brand,
+                    "model_no": w.model_no,
+                    "serial_no": w.serial_no,
+                    "purchase_date": w.purchase_date.isoformat() if w.purchase_date else None,
+                    "notes": w.notes,
+                }
+                for w in page.items
+            ],
+            "page_size": page.page_size,
+            "next_cursor": page.next_cursor,
+            "prev_cursor": page.prev_cursor,
+        })
+
+    @app.route("/api/reports")
+    @query_budget(3)
+    @read_replica
+    @login_required
+    def api_reports():
+        page = logs_page()
+        return jsonify({
+            "items": [
+                {
+                    "id": log.id,
+                    "customer_id": log.customer_id,
+                    "event_type": log.event_type,
+                    "message": log.message,
+                    "sent_at": log.sent_at.isoformat(timespec="seconds"),
+                    "status": log.status,
+                }
+                for log in page.items
+            ],
+            "page_size": page.page_size,
+            "next_cursor": page.next_cursor,
+            "prev_cursor": page.prev_cursor,
+        })
+
+    @app.route("/api/reports/summary")
+    @query_budget(5)
+    @read_replica
+    @login_required
+    def api_reports_summary():
+        # e.g. ?start=2024-05-01&end=2024-05-31&group_by=event_type,status&period=week
+        query = report_query(request.args)
+        result = cached_message_counts(current_user.tenant_id, query)
+        return jsonify({
+            "start": query.start.isoformat(),
+            "end": query.end.isoformat(),
+            "group_by": list(query.group_by),
+            "period": query.period,
+            "total": result["total"],
+            "rows": result["rows"],
+        })
 
     @app.route("/reports/download")
+    @read_replica
     @login_required
     def download_reports():
-        logs = MessageLog.query.order_by(MessageLog.sent_at.desc()).all()
-        if not logs:
+        stmt = export_query(request.args)
+        # archived=1 adds matching rows from the retention archive after the live ones.
+        archived = request.args.get("archived") in ("1", "true")
+        if not has_rows(stmt) and not (archived and partitions(app.config["ARCHIVE_DIR"], "message_logs")):
             flash("No logs to export.", "warning")
             return redirect(url_for("reports"))
-        df = pd.DataFrame([
-            {
-                "id": log.id,
-                "customer_id": log.customer_id,
-                "customer_name": log.customer.name if log.customer else None,
-                "event_type": log.event_type,
-                "message": log.message,
-                "sent_at": log.sent_at.isoformat(timespec="seconds"),
-                "status": log.status,
-            }
-            for log in logs
-        ])
-        csv_path = os.path.join(os.path.dirname(__file__), "message_logs.csv")
-        df.to_csv(csv_path, index=False)
-        return send_file(csv_path, as_attachment=True, download_name="message_logs.csv")
+
+        fmt = request.args.get("format", "csv")
+        if fmt not in ("csv", "ndjson"):
+            abort(400, "format must be csv or ndjson.")
+        rows = iter_rows(stmt, app.config.get("EXPORT_BATCH_SIZE", DEFAULT_EXPORT_BATCH_SIZE))
+        if archived:
+            rows = itertools.chain(rows, archived_export_rows(app.config["ARCHIVE_DIR"], request.args))
+        chunks = csv_chunks(rows) if fmt == "csv" else ndjson_chunks(rows)
+        filename = f"message_logs.{fmt}"
+        mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+        if request.args.get("gzip") in ("1", "true"):
+            chunks = gzip_chunks(chunks)
+            filename += ".gz"
+            mimetype = "application/gzip"
+        return Response(
+            stream_with_context(chunks),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f"attachment; filename={filename}"},
+        )
 
     return app
 
 
 if __name__ == "__main__":
     app = create_app()
+    # The development server sets the database up itself.
+    with app.app_context():
+        init_db(echo=app.logger.info)
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)), debug=True)
@@ -0,0 +1,55 @@
+from typing import Optional
+
+from flask import current_app
+from sqlalchemy import event
+
+from cache import TTLCache
+from models import db, User
+
+
+user_cache = TTLCache()
+
+
+def load_user(user_id: str) -> Optional[User]:
+    """Flask-Login user loader, served from the in-process cache for USER_CACHE_TTL seconds.
+
+    The cache holds detached users; each request gets its own copy merged
+    into its session without a query, so relationships still lazy-load and
+    a commit in the request expires the copy as usual.
+    """
+    ttl = current_app.config.get("USER_CACHE_TTL", 60)
+    if not ttl:
+        return db.session.get(User, int(user_id))
+
+    def load():
+        user = db.session.get(User, int(user_id))
+        if user is not None:
+            db.session.expunge(user)
+        return user
+
+    user = user_cache.get(int(user_id), load, ttl=ttl)
+    return db.session.merge(user, load=False) if user is not None else None
+
+
+def invalidate_user(user_id: Optional[int] = None) -> None:
+    """Drop ``user_id`` (every user if None) from this process's cache."""
+    user_cache.invalidate(user_id)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, user):
+    # Password, role and tenant changes; other processes catch up within the TTL.
+    invalidate_user(user.user_id)
+
+
+def login_password(user: User, password: str) -> bool:
+    """Check ``password``, upgrading the stored hash if the hashing parameters changed.
+
+    The caller commits.
+    """
+    if not user.check_password(password):
+        return False
+    if user.password_needs_rehash():
+        user.set_password(password)
+    return True
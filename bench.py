@@ -0,0 +1,317 @@
+"""Benchmark suite: the main pages and the event check, timed through the Flask test client
+on a synthetic shop built by datagen.py.
+
+``python bench.py --size 100k`` builds (once per day) and benchmarks a 100k
+customer shop, then compares p95 latency, peak memory and query counts with
+the stored baseline for that size in bench_baseline.json; it exits with
+status 1 when a case regressed. Every view with a ``query_budget`` is also
+requested (first and later pages, cold and warm caches) with
+QUERY_BUDGET_STRICT on, and any overrun fails the run; a baseline is not
+saved over one. ``--save-baseline`` records the run as the
+new baseline instead. Timings depend on the machine, so re-baseline when
+moving the suite to a different one.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote, urlsplit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(HERE, "bench_baseline.json")
+
+# A case regresses when its p95 (or peak memory) grows by more than this
+# fraction and by more than NOISE_FLOOR_MS, or when it runs more queries.
+DEFAULT_TOLERANCE = 0.25
+NOISE_FLOOR_MS = 5.0
+
+SEARCH_TERMS = ["Sharma", "priya na", "90000012", "ananya.re", "Kh"]
+# Where reports_deep starts paging, as a fraction of the message history.
+DEEP_PAGE_DEPTHS = [0.3, 0.6, 0.99]
+
+
+class Case(NamedTuple):
+    name: str
+    method: str
+    url: Callable[[int], str]
+    heavy: bool = False
+    # Called before every iteration (outside the timing), e.g. to reset the database.
+    setup: Optional[Callable[[], None]] = None
+    # Run once untimed first, to warm compiled templates and the first connection.
+    warm: bool = True
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def copy_database(source: str, target: str) -> None:
+    """Copy a SQLite database, including any changes still in its WAL file."""
+    for path in (target, target + "-wal", target + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+    src.close()
+    dst.close()
+
+
+def dataset(size: str, seed: int, data_dir: str) -> str:
+    """Path of the generated dataset for ``size``, building it if needed."""
+    path = os.path.join(data_dir, f"shop-{size}-seed{seed}-{date.today():%Y%m%d}.db")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        subprocess.run([sys.executable, os.path.join(HERE, "datagen.py"), "--customers", size,
+                        "--seed", str(seed), "--db", path], check=True)
+    return path
+
+
+def run_suite(source: str, repeat: int, heavy_repeat: int,
+              only: Optional[List[str]] = None) -> Tuple[Dict[str, dict], List[str]]:
+    scratch = source.replace(".db", ".run.db")
+    copy_database(source, scratch)
+    # Config reads these at import time.
+    os.environ["DATABASE_URL"] = "sqlite:///" + scratch
+    os.environ["EVENT_RUN_ASYNC"] = "false"
+    os.environ["OUTBOX_DISPATCH_IN_APP"] = "false"
+    from jinja2 import FileSystemLoader
+    from sqlalchemy import func, select
+
+    from app import create_app
+    from auth import user_cache
+    from models import db, EventRun, MessageLog
+    from pagecache import fragment_cache, version_cache
+    from pagination import encode_cursor
+    from querystats import count_queries
+    from reporting import invalidate_reports, report_cache
+    from stats import stats_cache
+
+    app = create_app()
+    # Page templates live next to the modules in this checkout.
+    app.jinja_loader = FileSystemLoader(HERE)
+    client = app.test_client()
+    response = client.post("/login", data={"email": "admin@example.com", "password": "admin123"})
+    assert response.status_code == 302, "login failed"
+
+    def fresh_database():
+        with app.app_context():
+            db.engine.dispose()
+        copy_database(source, scratch)
+
+    # Page cases render their tables every time: served from the fragment
+    # cache they would not run the list queries they are meant to time.
+    uncached = fragment_cache.invalidate
+
+    # Cursors spread over the whole message history, paged in both directions.
+    with app.app_context():
+        total = MessageLog.query.count()
+        newest_first = MessageLog.query.order_by(MessageLog.sent_at.desc(), MessageLog.id.desc())
+        deep_cursors = [
+            f"{direction}={encode_cursor([log.sent_at, log.id])}"
+            for depth in DEEP_PAGE_DEPTHS
+            for log in newest_first.offset(int(depth * max(total - 1, 0))).limit(1)
+            for direction in ("after", "before")
+        ]
+
+    cases = [
+        Case("dashboard", "GET", lambda i: "/dashboard", setup=uncached),
+        Case("search", "GET", lambda i: f"/dashboard?search={SEARCH_TERMS[i % len(SEARCH_TERMS)]}",
+             setup=uncached),
+        Case("watches", "GET", lambda i: "/watches", setup=uncached),
+        Case("reports", "GET", lambda i: "/reports", setup=uncached),
+        Case("reports_deep", "GET", lambda i: f"/reports?{deep_cursors[i % len(deep_cursors)]}", setup=uncached),
+        Case("report_api", "GET", lambda i: "/api/reports/summary?group_by=event_type,status,channel&period=week"),
+        Case("report_cold", "GET", lambda i: "/api/reports/summary?group_by=event_type,status,channel&period=week",
+             setup=invalidate_reports),
+        Case("export_csv", "GET", lambda i: "/reports/download?format=csv", heavy=True),
+        Case("event_check", "POST", lambda i: "/events", heavy=True, setup=fresh_database, warm=False),
+    ]
+    results = {}
+    for case in cases:
+        if only and case.name not in only:
+            continue
+
+        def request(i: int) -> int:
+            # Streamed chunk by chunk, as a real client would read the export.
+            response = client.open(case.url(i), method=case.method)
+            try:
+                assert response.status_code < 400, f"{case.name}: HTTP {response.status_code}"
+                return sum(len(chunk) for chunk in response.response)
+            finally:
+                response.close()
+
+        if case.warm:
+            if case.setup:
+                case.setup()
+            request(0)
+        timings, queries, size = [], 0, 0
+        for i in range(heavy_repeat if case.heavy else repeat):
+            if case.setup:
+                case.setup()
+            with count_queries() as counter:
+                started = time.perf_counter()
+                size = request(i)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries = max(queries, counter.count)
+        # Memory on a separate pass: tracemalloc slows the code it watches.
+        if case.setup:
+            case.setup()
+        tracemalloc.start()
+        try:
+            request(0)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        results[case.name] = {
+            "n": len(timings),
+            "p50_ms": round(percentile(timings, 50), 2),
+            "p95_ms": round(percentile(timings, 95), 2),
+            "peak_kib": round(peak / 1024),
+            "queries": queries,
+            "bytes": size,
+        }
+
+    # Every budgeted view, first pages and deeper ones, against the shop's data.
+    with app.app_context():
+        run_id = db.session.scalar(select(func.max(EventRun.run_id)))
+    if run_id is None:
+        assert client.post("/events").status_code == 302, "event run failed"
+        with app.app_context():
+            run_id = db.session.scalar(select(func.max(EventRun.run_id)))
+    urls = ["/dashboard", "/watches", "/templates", "/reports", f"/events/runs/{run_id}",
+            "/api/reports/summary?group_by=event_type,status,channel&period=week"]
+    urls += [f"/dashboard?search={quote(term)}" for term in SEARCH_TERMS]
+    urls += [f"/api/customers?search={quote(term)}" for term in SEARCH_TERMS]
+    urls += [f"/reports?{cursor}" for cursor in deep_cursors]
+    for api, page in (("/api/customers", "/dashboard"), ("/api/watches", "/watches"), ("/api/reports", "/reports")):
+        cursor = client.get(api).get_json()["next_cursor"]
+        urls += [api] + ([f"{api}?after={cursor}", f"{page}?after={cursor}"] if cursor else [])
+
+    def cold_caches():
+        for cache in (fragment_cache, version_cache, stats_cache, report_cache, user_cache):
+            cache.invalidate()
+
+    return results, check_query_budgets(app, client, urls, cold=cold_caches)
+
+
+def check_query_budgets(app, client, urls: List[str], cold: Callable[[], None]) -> List[str]:
+    """Request each URL with cold caches and again warm, with QUERY_BUDGET_STRICT on.
+
+    Returns the requests that went over their view's ``query_budget``, and
+    the budgeted endpoints none of ``urls`` reaches.
+    """
+    from querystats import QueryBudgetExceeded, count_queries
+
+    budgets = {endpoint: view.query_budget for endpoint, view in app.view_functions.items()
+               if getattr(view, "query_budget", None) is not None}
+    adapter = app.url_map.bind("localhost")
+    requested = set()
+    overruns = []
+    saved = {key: app.config.get(key) for key in ("QUERY_BUDGET_STRICT", "PROPAGATE_EXCEPTIONS")}
+    app.config.update(QUERY_BUDGET_STRICT=True, PROPAGATE_EXCEPTIONS=True)
+    try:
+        for url in urls:
+            requested.add(adapter.match(urlsplit(url).path)[0])
+            cold()
+            for state in ("cold", "warm"):
+                with count_queries() as counter:
+                    try:
+                        response = client.get(url)
+                    except QueryBudgetExceeded as exc:
+                        overruns.append(f"{url} ({state}): {exc}\n    " + "\n    ".join(counter.statements))
+                        continue
+                assert response.status_code < 400, f"{url}: HTTP {response.status_code}"
+    finally:
+        app.config.update(saved)
+    overruns += [f"{endpoint}: budget of {budget} queries, but no request reached it"
+                 for endpoint, budget in sorted(budgets.items()) if endpoint not in requested]
+    return overruns
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        p95, base_p95 = result["p95_ms"], base["p95_ms"]
+        if p95 > base_p95 * (1 + tolerance) and p95 - base_p95 > NOISE_FLOOR_MS:
+            regressions.append(f"{name}: p95 {base_p95:.1f} -> {p95:.1f} ms")
+        if result["peak_kib"] > base["peak_kib"] * (1 + tolerance) and result["peak_kib"] - base["peak_kib"] > 1024:
+            regressions.append(f"{name}: peak memory {base['peak_kib']} -> {result['peak_kib']} KiB")
+        if result["queries"] > base["queries"]:
+            regressions.append(f"{name}: queries {base['queries']} -> {result['queries']}")
+    return regressions
+
+
+def report(results: Dict[str, dict], baseline: Dict[str, dict]) -> None:
+    print(f"{'case':<12} {'n':>3} {'p50 ms':>9} {'p95 ms':>9} {'base p95':>9} {'peak KiB':>9} {'queries':>7}")
+    for name, r in results.items():
+        base = baseline.get(name, {}).get("p95_ms")
+        base = f"{base:9.1f}" if base is not None else f"{'-':>9}"
+        print(f"{name:<12} {r['n']:>3} {r['p50_ms']:9.1f} {r['p95_ms']:9.1f} {base} {r['peak_kib']:>9} {r['queries']:>7}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the app on a synthetic shop.")
+    parser.add_argument("--size", default="10k", help="dataset size: 10k, 100k, 1m or a customer count")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=20, help="requests per page case")
+    parser.add_argument("--heavy-repeat", type=int, default=3, help="runs of the export and event check")
+    parser.add_argument("--case", action="append", help="only run these cases")
+    parser.add_argument("--data-dir", default=os.path.join(HERE, "bench-data"))
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--output", help="also write the results as JSON here")
+    args = parser.parse_args(argv)
+
+    size = args.size.lower()
+    results, overruns = run_suite(dataset(size, args.seed, args.data_dir), args.repeat, args.heavy_repeat, args.case)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as handle:
+            baselines = json.load(handle)
+    baseline = baselines.get(size, {}).get("cases", {})
+    report(results, baseline)
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+    for line in overruns:
+        print("OVER BUDGET", line)
+    if overruns:
+        sys.exit(1)
+    print("Every budgeted view stayed within its query budget, cold and warm.")
+
+    if args.save_baseline:
+        baselines[size] = {
+            "machine": f"{platform.machine()} {platform.processor() or ''} {os.cpu_count()} cpu, "
+                       f"Python {platform.python_version()}".replace("  ", " "),
+            "cases": {**baseline, **results},
+        }
+        with open(args.baseline, "w") as handle:
+            json.dump(baselines, handle, indent=2, sort_keys=True)
+            handle.write("\n")
+        print(f"Saved baseline for {size} to {args.baseline}")
+        return
+    if not baseline:
+        print(f"No baseline for {size}; record one with --save-baseline.")
+        return
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print("REGRESSION", line)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Authenticated-request overhead with and without the user cache, and login cost per hashing method.
+
+Run with ``python bench_auth.py [requests]``; uses a throwaway SQLite database.
+First asserts that a shop cannot list or read another shop's event runs.
+"""
+import os
+import sys
+import tempfile
+import time
+
+METHODS = ["scrypt:32768:8:1", "scrypt:16384:8:1", "pbkdf2:sha256:600000", "pbkdf2:sha256:100000"]
+
+
+def check_tenant_isolation(app) -> None:
+    from jinja2 import FileSystemLoader
+
+    from models import db, EventRun, Tenant, User
+    from stats import default_tenant_id
+
+    other = Tenant(name="Other shop")
+    db.session.add(other)
+    db.session.flush()
+    user = User(tenant_id=other.tenant_id, email="other@example.com")
+    user.set_password("other123")
+    own, foreign = EventRun(tenant_id=default_tenant_id()), EventRun(tenant_id=other.tenant_id)
+    db.session.add_all([user, own, foreign])
+    db.session.commit()
+
+    # Page templates live next to the modules in this checkout.
+    app.jinja_loader = FileSystemLoader(os.path.dirname(os.path.abspath(__file__)))
+    client = app.test_client()
+    client.post("/login", data={"email": "admin@example.com", "password": "admin123"})
+    assert client.get(f"/events/runs/{own.run_id}").status_code == 200
+    assert client.get(f"/events/runs/{foreign.run_id}").status_code == 404, "another shop's run is readable"
+    response = client.get("/events")
+    assert response.status_code == 200, response.status_code
+    page = response.get_data(as_text=True)
+    assert f"#{own.run_id}<" in page and f"#{foreign.run_id}<" not in page, "another shop's run is listed"
+    print("event runs are only visible to their own shop")
+
+
+def main(count: int = 2000, logins: int = 10) -> None:
+    workdir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "bench_auth.db")
+    from app import create_app
+    from migrations import init_db
+    from querystats import count_queries
+
+    app = create_app()
+    with app.app_context():
+        init_db()
+        check_tenant_isolation(app)
+    client = app.test_client()
+    client.post("/login", data={"email": "admin@example.com", "password": "admin123"})
+
+    print(f"{count} requests to /api/customers?per_page=1")
+    for ttl in (0, 60):
+        app.config["USER_CACHE_TTL"] = ttl
+        client.get("/api/customers?per_page=1")
+        with count_queries() as counter:
+            started = time.perf_counter()
+            for _ in range(count):
+                client.get("/api/customers?per_page=1")
+            elapsed = time.perf_counter() - started
+        label = "cache off" if not ttl else "cache on"
+        print(f"  {label:<10} {elapsed * 1e6 / count:8.1f} us/request  {counter.count / count:.1f} queries/request")
+
+    print(f"{logins} logins per hashing method (the first one after a change rehashes)")
+    for method in METHODS:
+        app.config["PASSWORD_HASH_METHOD"] = method
+        timings = []
+        for _ in range(logins):
+            started = time.perf_counter()
+            client.post("/login", data={"email": "admin@example.com", "password": "admin123"})
+            timings.append(time.perf_counter() - started)
+        steady = sorted(timings[1:])[len(timings[1:]) // 2]
+        print(f"  {method:<22} {steady * 1000:8.1f} ms/login  ({1 / steady:6.1f} logins/s per core)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,128 @@
+"""Read latency while an event run writes, per database engine profile.
+
+``python bench_db.py --size 10k`` runs a full event run on a copy of the
+synthetic shop while reader threads keep loading the dashboard and reports
+through the test client, once per profile:
+
+- none: SQLite's rollback journal and SQLAlchemy defaults
+- sqlite: WAL, synchronous=NORMAL, busy_timeout, mmap and cache size
+- sqlite+read: the same, with read-only views on a separate query_only engine
+
+Each profile runs in its own interpreter, since Config is read at import.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from typing import List, Optional
+
+from bench import copy_database, dataset, percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROFILES = ["none", "sqlite", "sqlite+read"]
+READ_URLS = ["/dashboard", "/reports", "/api/reports", "/api/customers"]
+
+WRITER = """
+from app import create_app
+from runner import execute_run, start_run
+with create_app().app_context():
+    print(sum(execute_run(start_run(None).run_id).values()))
+"""
+
+
+def child(profile: str, source: str, readers: int) -> dict:
+    scratch = source.replace(".db", f".{profile.replace('+', '-')}.db")
+    copy_database(source, scratch)
+    with sqlite3.connect(scratch) as connection:
+        connection.execute("PRAGMA journal_mode=" + ("DELETE" if profile == "none" else "WAL"))
+    connection.close()
+    os.environ.update(DATABASE_URL="sqlite:///" + scratch, DB_PROFILE=profile.split("+")[0],
+                      EVENT_WORKERS="1", OUTBOX_DISPATCH_IN_APP="false")
+    if profile.endswith("+read"):
+        os.environ["DATABASE_READ_URL"] = "sqlite:///" + scratch
+    from jinja2 import FileSystemLoader
+
+    from app import create_app
+
+    app = create_app()
+    app.jinja_loader = FileSystemLoader(HERE)
+    done = threading.Event()
+    latencies: List[float] = []
+    errors: List[str] = []
+    writer = {}
+
+    def write():
+        # In its own process, like `flask run-events` or the shard pool workers.
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", WRITER], cwd=HERE, check=True, capture_output=True,
+                                text=True).stdout
+        writer["messages"] = int(output.strip().splitlines()[-1])
+        writer["seconds"] = time.perf_counter() - started
+        done.set()
+
+    def read():
+        client = app.test_client()
+        client.post("/login", data={"email": "admin@example.com", "password": "admin123"})
+        i = 0
+        while not done.is_set():
+            started = time.perf_counter()
+            try:
+                response = client.get(READ_URLS[i % len(READ_URLS)])
+                if response.status_code != 200:
+                    errors.append(f"HTTP {response.status_code}")
+            except Exception as exc:
+                errors.append(f"{type(exc).__name__}: {exc}")
+            latencies.append((time.perf_counter() - started) * 1000)
+            i += 1
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)  # readers logged in and warm
+    write()
+    for thread in threads:
+        thread.join()
+    return {
+        "reads": len(latencies),
+        "read_p50_ms": round(percentile(latencies, 50), 1),
+        "read_p95_ms": round(percentile(latencies, 95), 1),
+        "read_max_ms": round(max(latencies), 1),
+        "read_errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "write_seconds": round(writer["seconds"], 2),
+        "messages": writer["messages"],
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Read latency during an event run, per engine profile.")
+    parser.add_argument("--size", default="10k")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--profile", action="append", choices=PROFILES, help="default: all")
+    parser.add_argument("--data-dir", default=os.path.join(HERE, "bench-data"))
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(child(args.child, dataset(args.size, args.seed, args.data_dir), args.readers)))
+        return
+    print(f"{'profile':<12} {'reads':>6} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'errors':>6} {'write s':>8}")
+    for profile in args.profile or PROFILES:
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", profile, "--size", args.size, "--seed", str(args.seed),
+             "--readers", str(args.readers), "--data-dir", args.data_dir],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        r = json.loads(output.strip().splitlines()[-1])
+        print(f"{profile:<12} {r['reads']:>6} {r['read_p50_ms']:8.1f} {r['read_p95_ms']:8.1f} "
+              f"{r['read_max_ms']:8.1f} {r['read_errors']:>6} {r['write_seconds']:8.2f}"
+              + (f"  ({r['first_error']})" if r["first_error"] else ""))
+
+
+if __name__ == "__main__":
+    main()
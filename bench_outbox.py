@@ -0,0 +1,155 @@
+"""Drain the outbox through a local stub SMTP server, checking claims, retries and status write-back.
+
+Run with ``python bench_outbox.py [messages]``; needs aiosmtpd and uses a
+throwaway SQLite database. Every seventh recipient is refused with a 451
+once, and one is refused every time, so it fails after OUTBOX_MAX_ATTEMPTS.
+Asserts that:
+
+- concurrent dispatchers claim disjoint batches under their own token,
+  and a claim older than OUTBOX_CLAIM_TIMEOUT can be taken over
+- a 4xx puts the row back to pending with its backoff, the delay doubling
+  per attempt, until it is sent or runs out of attempts
+- outbox rows, Events and MessageLogs end with their final status, the
+  run is completed, and nobody got a message twice
+- retention purges the settled outbox rows older than its cutoff, and
+  keeps newer ones and any still pending
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from smtpstub import StubSMTPServer
+
+BACKOFF = 2.0
+MAX_ATTEMPTS = 3
+DOOMED = "c0@example.com"
+
+
+def reply(recipient: str, attempt: int) -> str:
+    if recipient == DOOMED:
+        return "451 4.3.0 Mailbox busy, try again later"
+    if int(recipient[1:].split("@")[0]) % 7 == 0 and attempt == 1:
+        return "451 4.7.1 Greylisted, try again later"
+    return "250 OK"
+
+
+def main(count: int = 300) -> None:
+    with StubSMTPServer(reply) as server:
+        workdir = tempfile.mkdtemp()
+        for name in ("MAIL_USERNAME", "MAIL_PASSWORD"):
+            os.environ.pop(name, None)
+        # Config reads these at import time.
+        os.environ.update({
+            "DATABASE_URL": "sqlite:///" + os.path.join(workdir, "bench_outbox.db"),
+            "MAIL_SERVER": "127.0.0.1", "MAIL_PORT": str(server.port), "MAIL_USE_TLS": "false",
+            "MAIL_DEFAULT_SENDER": "shop@example.com",
+            "DISPATCH_RATE_LIMITS": "", "OUTBOX_BATCH_SIZE": "50",
+            "OUTBOX_BACKOFF_SECONDS": str(BACKOFF), "OUTBOX_MAX_ATTEMPTS": str(MAX_ATTEMPTS),
+            "EVENT_RUN_ASYNC": "false", "OUTBOX_DISPATCH_IN_APP": "false",
+        })
+        from app import create_app
+        from bulk import BulkWriter
+        from dispatcher import Dispatcher
+        from migrations import init_db
+        from models import db, Customer, Event, EventRun, MessageLog, Outbox
+        from retention import purge_outbox
+        from stats import default_tenant_id
+
+        app = create_app()
+        with app.app_context():
+            init_db()
+            tenant_id = default_tenant_id()
+            customers = [Customer(name=f"Customer {i}", email=f"c{i}@example.com", tenant_id=tenant_id)
+                         for i in range(count)]
+            db.session.add_all(customers)
+            run = EventRun(tenant_id=tenant_id, status="dispatching")
+            db.session.add(run)
+            db.session.commit()
+            writer = BulkWriter(tenant_id, run_id=run.run_id)
+            for customer in customers:
+                writer.add(customer.id, "birthday", f"Happy birthday, {customer.name}!", "email",
+                           recipient=customer.email, subject="Happy birthday")
+            writer.flush()
+            run_id = run.run_id
+            started = datetime.utcnow()
+
+            # Two dispatchers, then a third taking over the first one's claim after it "crashed".
+            first, second, third = Dispatcher(app), Dispatcher(app), Dispatcher(app)
+            claimed = {dispatcher: dispatcher.claim() for dispatcher in (first, second)}
+            ids = {dispatcher: {row.outbox_id for row in rows} for dispatcher, rows in claimed.items()}
+            assert len(ids[first]) == len(ids[second]) == 50 and not ids[first] & ids[second], "claims overlap"
+            for dispatcher, rows in claimed.items():
+                assert all(row.status == "sending" and row.claimed_by == dispatcher.token for row in rows)
+            db.session.execute(Outbox.__table__.update().where(Outbox.outbox_id.in_(ids[first])).values(
+                claimed_at=datetime.utcnow() - third.claim_timeout - timedelta(seconds=1)))
+            db.session.commit()
+            taken_over = third.claim()
+            third_ids = {row.outbox_id for row in taken_over}
+            assert ids[first] <= third_ids, "stale claim not taken over"
+            assert not ids[second] & third_ids, "live claim taken over"
+            for dispatcher, rows in ((second, claimed[second]), (third, taken_over)):
+                dispatcher._record([dispatcher._deliver(row) for row in rows])
+
+            # The rest, without waiting out backoffs: the refused rows go back to pending.
+            tick = time.perf_counter()
+            first_totals = Dispatcher(app).drain(wait_for_retries=False)
+            first_pass = time.perf_counter() - tick
+            finished = datetime.utcnow()
+            refused = db.session.execute(Outbox.__table__.select().where(Outbox.status == "pending")).all()
+            expected = {r for r in server.attempts if r == DOOMED or int(r[1:].split("@")[0]) % 7 == 0}
+            assert {row.recipient for row in refused} == expected, "refused rows not back to pending"
+            for row in refused:
+                assert row.attempts == 1 and row.claimed_by is None and "451" in row.last_error, row
+                assert started + timedelta(seconds=BACKOFF) <= row.next_attempt_at \
+                    <= finished + timedelta(seconds=BACKOFF), "backoff not applied"
+
+            tick = time.perf_counter()
+            totals = Dispatcher(app).drain(wait_for_retries=True, poll_interval=0.05)
+            retries = time.perf_counter() - tick
+
+            outbox = {row.recipient: row for row in db.session.execute(Outbox.__table__.select()).all()}
+            for recipient, row in outbox.items():
+                if recipient == DOOMED:
+                    assert row.status == "failed" and row.attempts == MAX_ATTEMPTS and row.sent_at is None, row
+                else:
+                    assert row.status == "sent" and row.sent_at is not None, row
+                    assert row.attempts == (2 if recipient in expected else 1), row
+                assert row.claimed_by is None and row.claimed_at is None, row
+            gaps = [b - a for a, b in zip(server.attempts[DOOMED], server.attempts[DOOMED][1:])]
+            assert len(gaps) == MAX_ATTEMPTS - 1 and gaps[0] >= BACKOFF and gaps[1] >= 2 * BACKOFF, gaps
+
+            doomed_id = db.session.query(Customer.id).filter_by(email=DOOMED).scalar()
+            events = dict(db.session.query(Event.customer_id, Event.status).filter_by(run_id=run_id).all())
+            logs = dict(db.session.query(MessageLog.customer_id, MessageLog.status).filter_by(run_id=run_id).all())
+            assert events.pop(doomed_id) == "failed" and logs.pop(doomed_id) == "email_failed"
+            assert set(events.values()) == {"sent"} and set(logs.values()) == {"email_sent"}
+            assert db.session.get(EventRun, run_id).status == "completed"
+            assert len(server.delivered) == count - 1 and set(server.delivered.values()) == {1}, "duplicate sends"
+
+            # Retention: age half the settled rows and leave one pending row just as old.
+            aged = sorted(outbox.values(), key=lambda row: row.outbox_id)[::2]
+            aged_ids = {row.outbox_id for row in aged}
+            long_ago = started - timedelta(days=400)
+            db.session.execute(Outbox.__table__.update().where(Outbox.outbox_id.in_(aged_ids))
+                               .values(next_attempt_at=long_ago))
+            stuck = Outbox(customer_id=doomed_id, event_type="birthday", channel="email", recipient=DOOMED,
+                           body="Happy birthday!", next_attempt_at=long_ago)
+            db.session.add(stuck)
+            db.session.commit()
+            stuck_id = stuck.outbox_id
+            assert purge_outbox(started - timedelta(days=365), chunk_size=40) == len(aged_ids)
+            kept = {outbox_id for outbox_id, in db.session.query(Outbox.outbox_id)}
+            assert not kept & aged_ids and stuck_id in kept and len(kept) == count - len(aged_ids) + 1, "purge"
+            assert purge_outbox(started - timedelta(days=365)) == 0
+
+        print(f"{count} messages, {len(expected)} refused with a 451 (one every time), "
+              f"{len(server.sessions)} SMTP sessions")
+        print(f"  first pass   {sum(first_totals.values()) / first_pass:8.1f} messages/s")
+        print(f"  retries      {retries:8.2f} s for {totals['sent']} sent, {totals['failed']} failed")
+        print("claims, backoff, status write-back and outbox purge OK")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300)
@@ -0,0 +1,93 @@
+"""Keyset pages at increasing depth: query plans and latency of /api/reports in both directions.
+
+``python bench_pagination.py --size 100k`` copies the synthetic shop built by
+datagen.py, asserts that the message log query behind ``after=`` (older) and
+``before=`` (newer) cursors is an index range SEARCH rather than a walk from
+one end of the index, then times both directions from cursors at the top,
+the middle and the end of the history. A bounded range read takes about
+the same time at any depth.
+"""
+import argparse
+import os
+import sqlite3
+import time
+from typing import List, Optional, Tuple
+
+from bench import copy_database, dataset
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEPTHS = [0.0, 0.01, 0.3, 0.6, 0.99]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Time keyset pages at increasing depth.")
+    parser.add_argument("--size", default="10k", help="dataset size: 10k, 100k, 1m or a customer count")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=20, help="requests per depth and direction")
+    parser.add_argument("--data-dir", default=os.path.join(HERE, "bench-data"))
+    args = parser.parse_args(argv)
+
+    source = dataset(args.size.lower(), args.seed, args.data_dir)
+    scratch = source.replace(".db", ".pages.db")
+    copy_database(source, scratch)
+    os.environ["DATABASE_URL"] = "sqlite:///" + scratch
+    from sqlalchemy import event
+
+    from app import create_app
+    from models import db, MessageLog
+    from pagination import encode_cursor
+
+    app = create_app()
+    client = app.test_client()
+    response = client.post("/login", data={"email": "admin@example.com", "password": "admin123"})
+    assert response.status_code == 302, "login failed"
+
+    with app.app_context():
+        total = MessageLog.query.count()
+        order = (MessageLog.sent_at.desc(), MessageLog.id.desc())
+        cursors = []
+        for depth in DEPTHS:
+            log = MessageLog.query.order_by(*order).offset(int(depth * (total - 1))).limit(1).one()
+            cursors.append((depth, encode_cursor([log.sent_at, log.id])))
+        engine = db.engine
+
+    statements: List[Tuple[str, tuple]] = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if "FROM message_logs" in statement and "ORDER BY" in statement:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        for direction in ("after", "before"):
+            statements.clear()
+            assert client.get(f"/api/reports?{direction}={cursors[2][1]}").status_code == 200
+            assert statements, f"{direction}: no message log query ran"
+            with sqlite3.connect(scratch) as connection:
+                plan = [row[-1] for row in connection.execute("EXPLAIN QUERY PLAN " + statements[0][0],
+                                                              statements[0][1])]
+            connection.close()
+            logs = [line for line in plan if " message_logs " in f" {line} "]
+            assert logs and all(line.startswith("SEARCH") for line in logs), f"{direction}: {plan}"
+            print(f"{direction}= plan: {logs[0]}")
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    print(f"{total} message logs, {args.repeat} requests per depth")
+    print(f"{'depth':>6} {'after ms':>9} {'before ms':>10}")
+    for depth, cursor in cursors:
+        medians = []
+        for direction in ("after", "before"):
+            url = f"/api/reports?{direction}={cursor}"
+            client.get(url)
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                assert client.get(url).status_code == 200
+                timings.append((time.perf_counter() - started) * 1000)
+            medians.append(sorted(timings)[len(timings) // 2])
+        print(f"{depth:>6.0%} {medians[0]:9.2f} {medians[1]:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Customer search: mobile numbers in any form, and latency of common and rare terms.
+
+Run with ``python bench_search.py [customers]``; uses a throwaway SQLite
+database. Asserts that a customer stored as "+91 ..." is found by the local
+number, the international forms and a prefix of either, and that a number
+stored without the code is found by its international form; then times
+terms that match most customers and terms that match a few.
+"""
+import os
+import sys
+import tempfile
+import time
+
+TERMS = ["900", "9000001234", "+91 90000012", "Customer 12", "c1234@example"]
+
+
+def main(count: int = 20000, repeat: int = 20) -> None:
+    workdir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "bench_search.db")
+    from app import create_app
+    from migrations import init_db
+    from models import db, Customer
+    from search import search_customers
+    from stats import default_tenant_id
+
+    app = create_app()
+    with app.app_context():
+        init_db()
+        tenant_id = default_tenant_id()
+        db.session.add_all([
+            Customer(name="Local Number", mobile="98765 43210", tenant_id=tenant_id),
+            Customer(name="International Number", mobile="+91 91234 56789", tenant_id=tenant_id),
+        ])
+        db.session.add_all([Customer(name=f"Customer {i}", email=f"c{i}@example.com",
+                                     mobile=f"+91 {9000000000 + i}", tenant_id=tenant_id) for i in range(count)])
+        db.session.commit()
+
+        def names(term):
+            return [customer.name for customer in search_customers(term)]
+
+        for term in ("9123456789", "+91 9123456789", "0091 91234 56789", "919123456789", "91234", "+91 912"):
+            assert names(term)[:1] == ["International Number"], (term, names(term))
+        for term in ("9876543210", "+91 98765 43210", "987654"):
+            assert names(term)[:1] == ["Local Number"], (term, names(term))
+        assert names("9000001234")[:1] == ["Customer 1234"], names("9000001234")
+        print("local, international and partial mobile numbers find the customer")
+
+        print(f"{count} customers, {repeat} searches per term")
+        for term in TERMS:
+            search_customers(term)
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                found = search_customers(term)
+                timings.append((time.perf_counter() - started) * 1000)
+            print(f"  {term!r:<18} {sorted(timings)[len(timings) // 2]:8.2f} ms  {len(found):3d} results")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,121 @@
+"""SMTP pool against a local stub server: session reuse, rollover, reconnects and throughput.
+
+Run with ``python bench_smtp.py [messages]``; needs aiosmtpd and no database.
+Asserts that pooled sessions carry many messages each, are replaced after
+``max_messages``, and are reopened when the server drops them (and never
+put back when reopening fails), and that every message arrives exactly once; then times the pool against a fresh
+connection per message.
+"""
+import math
+import smtplib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+from flask_mail import Mail, Message
+
+from smtpstub import StubSMTPServer
+from transport import SMTPPool
+
+
+def mail_app(server: StubSMTPServer) -> Flask:
+    app = Flask(__name__)
+    app.config.update(MAIL_SERVER="127.0.0.1", MAIL_PORT=server.port, MAIL_USE_TLS=False,
+                      MAIL_DEFAULT_SENDER="shop@example.com")
+    Mail(app)
+    return app
+
+
+def messages(count: int):
+    return [Message("Happy birthday", recipients=[f"c{i}@example.com"], body="Happy birthday!") for i in range(count)]
+
+
+def check_rollover() -> None:
+    with StubSMTPServer() as server:
+        app = mail_app(server)
+        pool = SMTPPool(app, size=1, max_messages=10)
+        with app.app_context():
+            for message in messages(25):
+                pool.send(message)
+        assert server.sessions == [10, 10, 5], server.sessions
+        assert pool.handshakes == 3 and pool.messages_sent == 25, pool.stats()
+        assert set(server.delivered.values()) == {1}
+
+
+def check_reconnect() -> None:
+    with StubSMTPServer(drop_every=4) as server:
+        app = mail_app(server)
+        pool = SMTPPool(app, size=1, max_messages=100)
+        with app.app_context():
+            for message in messages(10):
+                pool.send(message)
+        assert server.sessions == [4, 4, 2], server.sessions
+        assert pool.reconnects == 2 and pool.handshakes == 3 and pool.send_errors == 0, pool.stats()
+        assert len(server.delivered) == 10 and set(server.delivered.values()) == {1}
+
+
+def check_failed_reconnect() -> None:
+    with StubSMTPServer(drop_every=1) as server:
+        app = mail_app(server)
+        pool = SMTPPool(app, size=1, max_messages=100)
+        with app.app_context():
+            first, second, third = messages(3)
+            pool.send(first)
+            connect = pool._connect
+
+            def refused():
+                raise smtplib.SMTPAuthenticationError(535, b"5.7.8 Authentication failed")
+
+            pool._connect = refused
+            try:
+                pool.send(second)
+            except smtplib.SMTPAuthenticationError:
+                pass
+            else:
+                raise AssertionError("reconnect did not fail")
+            assert not pool._idle and pool.stats()["open_connections"] == 0, "closed session put back"
+            pool._connect = connect
+            pool.send(third)
+        assert server.sessions == [1, 1], server.sessions
+        assert pool.reconnects == 1 and pool.send_errors == 1 and pool.messages_sent == 2, pool.stats()
+
+
+def throughput(count: int, size: int = 4, max_messages: int = 100) -> None:
+    with StubSMTPServer() as server:
+        app = mail_app(server)
+        mail = app.extensions["mail"]
+        pool = SMTPPool(app, size=size, max_messages=max_messages)
+
+        def pooled(message):
+            with app.app_context():
+                pool.send(message)
+
+        def fresh(message):
+            with app.app_context(), mail.connect() as connection:
+                connection.send(message)
+
+        with app.app_context():
+            batch = messages(count)
+        for name, send in (("connection per message", fresh), ("pool", pooled)):
+            before = len(server.sessions)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=size) as executor:
+                list(executor.map(send, batch))
+            elapsed = time.perf_counter() - started
+            print(f"  {name:<24} {count / elapsed:8.1f} messages/s  {len(server.sessions) - before:4d} handshakes")
+        assert pool.handshakes <= size + math.ceil(count / max_messages), pool.stats()
+        assert set(server.delivered.values()) == {2}
+
+
+def main(count: int = 300) -> None:
+    check_rollover()
+    check_reconnect()
+    check_failed_reconnect()
+    print("session reuse, rollover at max_messages, reconnect after a drop and a failed reconnect OK")
+    print(f"{count} messages over 4 threads")
+    throughput(count)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300)
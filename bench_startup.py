@@ -0,0 +1,128 @@
+"""Worker startup cost: import time, create_app() time, RSS and startup queries, each measured
+in fresh interpreters the way gunicorn boots workers.
+
+``python bench_startup.py`` compares with the "startup" entry of
+bench_baseline.json and exits with status 1 on a regression, or when a
+module that must stay lazy (pandas, openpyxl, ...) is loaded at startup.
+``--save-baseline`` records the run instead.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+from bench import BASELINE_PATH, DEFAULT_TOLERANCE, percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Only imported by the code paths that need them.
+LAZY_MODULES = ("pandas", "numpy", "openpyxl")
+
+# Regressions smaller than these are noise.
+NOISE_FLOOR_MS = 20.0
+NOISE_FLOOR_KIB = 4096
+
+CHILD = """
+import json, resource, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+rss_import = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+from querystats import count_queries
+with count_queries() as counter:
+    app.create_app()
+created = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "rss_import_kib": rss_import,
+    "rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "queries": counter.count,
+    "modules": sorted(name for name in sys.modules if "." not in name),
+}))
+"""
+
+
+def measure(runs: int) -> Dict[str, dict]:
+    env = dict(os.environ, DATABASE_URL="sqlite:///" + os.path.join(tempfile.mkdtemp(), "startup.db"))
+    subprocess.run([sys.executable, "-c", "from app import create_app; from migrations import init_db\n"
+                    "with create_app().app_context(): init_db()"], cwd=HERE, env=env, check=True)
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", CHILD], cwd=HERE, env=env, check=True,
+                                capture_output=True, text=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    heavy = sorted({name for sample in samples for name in sample["modules"] if name in LAZY_MODULES})
+    return {
+        "import_app": {
+            "p50_ms": round(percentile([s["import_ms"] for s in samples], 50), 1),
+            "rss_kib": max(s["rss_import_kib"] for s in samples),
+            "lazy_modules_loaded": heavy,
+        },
+        "create_app": {
+            "p50_ms": round(percentile([s["create_app_ms"] for s in samples], 50), 1),
+            "rss_kib": max(s["rss_kib"] for s in samples),
+            "queries": max(s["queries"] for s in samples),
+        },
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    regressions = [f"{name}: loaded {', '.join(r['lazy_modules_loaded'])} at startup"
+                   for name, r in results.items() if r.get("lazy_modules_loaded")]
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["p50_ms"] > base["p50_ms"] * (1 + tolerance) and result["p50_ms"] - base["p50_ms"] > NOISE_FLOOR_MS:
+            regressions.append(f"{name}: {base['p50_ms']:.0f} -> {result['p50_ms']:.0f} ms")
+        if result["rss_kib"] > base["rss_kib"] * (1 + tolerance) and result["rss_kib"] - base["rss_kib"] > NOISE_FLOOR_KIB:
+            regressions.append(f"{name}: RSS {base['rss_kib']} -> {result['rss_kib']} KiB")
+        if result.get("queries", 0) > base.get("queries", 0):
+            regressions.append(f"{name}: {base.get('queries', 0)} -> {result['queries']} startup queries")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark worker startup.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    results = measure(args.runs)
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as handle:
+            baselines = json.load(handle)
+    baseline = baselines.get("startup", {}).get("cases", {})
+    for name, r in results.items():
+        base = baseline.get(name, {})
+        print(f"{name:<11} {r['p50_ms']:7.1f} ms (baseline {base.get('p50_ms', '-')})  "
+              f"RSS {r['rss_kib'] / 1024:6.1f} MiB (baseline {base.get('rss_kib', 0) / 1024:.1f})"
+              + (f"  {r['queries']} queries" if "queries" in r else ""))
+
+    if args.save_baseline:
+        baselines["startup"] = {
+            "machine": f"{platform.machine()} {os.cpu_count()} cpu, Python {platform.python_version()}",
+            "cases": results,
+        }
+        with open(args.baseline, "w") as handle:
+            json.dump(baselines, handle, indent=2, sort_keys=True)
+            handle.write("\n")
+        print(f"Saved startup baseline to {args.baseline}")
+        return
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print("REGRESSION", line)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
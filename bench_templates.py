@@ -0,0 +1,38 @@
+"""Per-message render cost of compiled templates against the old hard-coded f-strings.
+
+Run with ``python bench_templates.py [rows]``; needs no database.
+"""
+import sys
+import timeit
+from collections import namedtuple
+from datetime import date
+
+from message_templates import CompiledTemplate
+from rules import RULES_BY_KEY
+
+
+Row = namedtuple("Row", "id name model email purchase_date")
+
+
+def main(count: int = 100_000, repeat: int = 5) -> None:
+    rows = [Row(i, f"Customer {i}", "Tissot PRX", f"c{i}@example.com", date(2023, 1, 1)) for i in range(count)]
+    template = CompiledTemplate(RULES_BY_KEY["battery_replacement"].message)
+
+    def fstrings():
+        return [f"Hi {c.name}, it's been 18 months since your {c.model} purchase. Time for a battery check!"
+                for c in rows]
+
+    assert fstrings() == template.render_many(rows)
+    cases = {
+        "f-string": fstrings,
+        "compiled render_many": lambda: template.render_many(rows),
+        "compiled render": lambda: [template.render(c) for c in rows],
+        "compile + render_many": lambda: CompiledTemplate(template.source).render_many(rows),
+    }
+    for name, case in cases.items():
+        best = min(timeit.repeat(case, number=1, repeat=repeat))
+        print(f"{name:<24} {best * 1e9 / count:8.1f} ns/message")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
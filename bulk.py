@@ -0,0 +1,143 @@
+import time
+from collections import Counter
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Event, EventLedger, MessageLog, Outbox
+from pagecache import bump_versions
+from stats import bump_counters
+
+
+DEFAULT_WRITE_CHUNK_SIZE = 500
+
+
+class BulkWriter:
+    """Buffer MessageLog/Event rows and insert them in executemany batches.
+
+    Every flushed chunk is committed on its own so a large run never holds one
+    long write transaction. All rows written by one writer share ``sent_at``.
+    Each message is also queued in the outbox, and messages given a ``period``
+    are recorded in the event ledger, in the same transaction, so a chunk is
+    either fully logged and queued or not at all.
+    """
+
+    def __init__(self, tenant_id: Optional[int] = None, chunk_size: int = DEFAULT_WRITE_CHUNK_SIZE,
+                 sent_at: Optional[datetime] = None, run_id: Optional[int] = None):
+        self.tenant_id = tenant_id
+        self.run_id = run_id
+        self.chunk_size = max(1, chunk_size)
+        self.sent_at = sent_at or datetime.utcnow()
+        self._logs: List[dict] = []
+        self._events: List[dict] = []
+        self._ledger: List[Optional[dict]] = []
+        self._outbox: List[dict] = []
+        self.rows_written = 0
+        self.chunks_written = 0
+        self.write_seconds = 0.0
+        # Messages written per (event_type, channel).
+        self.channel_counts: Counter = Counter()
+
+    def add(self, customer_id: int, event_type: str, message: str, channel: str,
+            period: Optional[str] = None, recipient: Optional[str] = None,
+            subject: Optional[str] = None) -> None:
+        self._logs.append({
+            "customer_id": customer_id,
+            "event_type": event_type,
+            "message": message,
+            "sent_at": self.sent_at,
+            "status": "queued",
+            "run_id": self.run_id,
+        })
+        self._events.append({
+            "tenant_id": self.tenant_id,
+            "customer_id": customer_id,
+            "event_type": event_type,
+            "channel": channel,
+            "sent_at": self.sent_at,
+            "status": "queued",
+            "run_id": self.run_id,
+        })
+        self._outbox.append({
+            "run_id": self.run_id,
+            "customer_id": customer_id,
+            "event_type": event_type,
+            "channel": channel,
+            "recipient": recipient,
+            "subject": subject,
+            "body": message,
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": self.sent_at,
+            "created_at": self.sent_at,
+        })
+        self._ledger.append(None if period is None else {
+            "customer_id": customer_id,
+            "event_type": event_type,
+            "period": period,
+            "run_id": self.run_id,
+            "created_at": self.sent_at,
+        })
+        if len(self._events) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._events:
+            return
+        started = time.perf_counter()
+        try:
+            self._write()
+        except IntegrityError:
+            # Another run claimed some of these ledger periods first; skip those
+            # messages and write the rest.
+            db.session.rollback()
+            self._drop_claimed()
+            self._write()
+        self.write_seconds += time.perf_counter() - started
+        self._logs = []
+        self._events = []
+        self._ledger = []
+        self._outbox = []
+
+    def _write(self) -> None:
+        if not self._events:
+            return
+        ledger = [entry for entry in self._ledger if entry is not None]
+        db.session.execute(MessageLog.__table__.insert(), self._logs)
+        db.session.execute(Event.__table__.insert(), self._events)
+        db.session.execute(Outbox.__table__.insert(), self._outbox)
+        if ledger:
+            db.session.execute(EventLedger.__table__.insert(), ledger)
+        bump_counters(self.tenant_id, events=len(self._events))
+        bump_versions(self.tenant_id, "messages")
+        db.session.commit()
+        self.rows_written += len(self._logs) + len(self._events)
+        self.channel_counts.update((e["event_type"], e["channel"]) for e in self._events)
+        self.chunks_written += 1
+
+    def _drop_claimed(self) -> None:
+        keys = {(e["customer_id"], e["event_type"], e["period"]) for e in self._ledger if e is not None}
+        claimed = {tuple(row) for row in db.session.execute(
+            select(EventLedger.customer_id, EventLedger.event_type, EventLedger.period).where(
+                EventLedger.customer_id.in_(sorted({k[0] for k in keys})),
+                EventLedger.event_type.in_(sorted({k[1] for k in keys})),
+            )
+        )} & keys
+        kept = [
+            i for i, entry in enumerate(self._ledger)
+            if entry is None or (entry["customer_id"], entry["event_type"], entry["period"]) not in claimed
+        ]
+        self._logs = [self._logs[i] for i in kept]
+        self._events = [self._events[i] for i in kept]
+        self._ledger = [self._ledger[i] for i in kept]
+        self._outbox = [self._outbox[i] for i in kept]
+
+    @property
+    def messages_written(self) -> int:
+        return self.rows_written // 2
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows_written / self.write_seconds if self.write_seconds else 0.0
@@ -1,5 +1,27 @@
 import os
 
+
+def engine_options(url: str, profile: str = "auto", pool_size: int = 10, max_overflow: int = 20,
+                   pool_recycle: int = 280, pool_timeout: int = 30, pool_pre_ping: bool = True) -> dict:
+    """SQLAlchemy engine options for the deployment profile of ``url``.
+
+    "auto" picks the profile from the URL's dialect; "none" keeps SQLAlchemy's
+    defaults. SQLite's pragmas are applied per connection by engines.init_engines.
+    """
+    if profile == "auto":
+        profile = url.split(":", 1)[0].split("+", 1)[0]
+    if profile == "mysql":
+        return {
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            # Below MySQL's wait_timeout, so the server never drops a pooled connection first
+            "pool_recycle": pool_recycle,
+            "pool_timeout": pool_timeout,
+            "pool_pre_ping": pool_pre_ping,
+        }
+    return {}
+
+
 class Config:
     SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret-key")
 
@@ -8,6 +30,34 @@ class Config:
         _db_url = _db_url.replace("mysql://", "mysql+pymysql://", 1)
     SQLALCHEMY_DATABASE_URI = _db_url
 
+    # Engine tuning profile: auto (by database URL), sqlite, mysql or none
+    DB_PROFILE = os.environ.get("DB_PROFILE", "auto")
+    # Connection pool (MySQL profile)
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 280))
+    DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+    DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("true", "1", "t", "yes")
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        _db_url, DB_PROFILE, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_TIMEOUT, DB_POOL_PRE_PING,
+    )
+    # Pragmas set on every SQLite connection (SQLite profile): WAL lets readers
+    # run during an event run's writes; cache size is in KiB when negative
+    SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+    SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE = int(os.environ.get("SQLITE_CACHE_SIZE", -64 * 1024))
+
+    # Optional read replica (or a second, read-only SQLite engine on the same
+    # file) for read-only views: dashboard, reports and the export
+    _read_url = os.environ.get("DATABASE_READ_URL")
+    if _read_url and _read_url.startswith("mysql://"):
+        _read_url = _read_url.replace("mysql://", "mysql+pymysql://", 1)
+    SQLALCHEMY_BINDS = {"read": dict(engine_options(
+        _read_url, DB_PROFILE, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_TIMEOUT, DB_POOL_PRE_PING,
+    ), url=_read_url)} if _read_url else {}
+
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
     # Flask-Mail settings (demo uses Gmail SMTP)
@@ -18,3 +68,91 @@ class Config:
     MAIL_USERNAME = os.environ.get("MAIL_USERNAME")
     MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD")
     MAIL_DEFAULT_SENDER = os.environ.get("MAIL_DEFAULT_SENDER", os.environ.get("MAIL_USERNAME"))
+
+    # Rows fetched per chunk when evaluating event rules
+    EVENT_CHUNK_SIZE = int(os.environ.get("EVENT_CHUNK_SIZE", 1000))
+    # Rows per executemany batch (and per commit) when logging event messages
+    EVENT_WRITE_CHUNK_SIZE = int(os.environ.get("EVENT_WRITE_CHUNK_SIZE", 500))
+    # Event runs are sharded by tenant, and large tenants by customer id range
+    # into shards of this many customers, run on EVENT_WORKERS processes
+    # (0 = one per CPU core, 1 = inline in the calling process)
+    EVENT_SHARD_SIZE = int(os.environ.get("EVENT_SHARD_SIZE", 20000))
+    EVENT_WORKERS = int(os.environ.get("EVENT_WORKERS", 0))
+
+    # Event runs execute off the request thread; the outbox they fill is
+    # drained in-process unless a separate `flask dispatch-outbox` worker runs.
+    EVENT_RUN_ASYNC = os.environ.get("EVENT_RUN_ASYNC", "true").lower() in ("true", "1", "t", "yes")
+    OUTBOX_DISPATCH_IN_APP = os.environ.get("OUTBOX_DISPATCH_IN_APP", "true").lower() in ("true", "1", "t", "yes")
+    DISPATCH_CONCURRENCY = int(os.environ.get("DISPATCH_CONCURRENCY", 4))
+    # Messages per second per channel, e.g. "email:5,whatsapp:20"
+    DISPATCH_RATE_LIMITS = os.environ.get("DISPATCH_RATE_LIMITS", "email:5,whatsapp:20")
+    OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 100))
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 5))
+    OUTBOX_BACKOFF_SECONDS = float(os.environ.get("OUTBOX_BACKOFF_SECONDS", 5))
+    OUTBOX_BACKOFF_MAX_SECONDS = float(os.environ.get("OUTBOX_BACKOFF_MAX_SECONDS", 600))
+    # Rows left "sending" longer than this (a crashed dispatcher) are claimed again
+    OUTBOX_CLAIM_TIMEOUT = int(os.environ.get("OUTBOX_CLAIM_TIMEOUT", 300))
+
+    # Long-lived SMTP sessions shared by outbox workers in one process
+    SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", 4))
+    SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.environ.get("SMTP_MAX_MESSAGES_PER_CONNECTION", 100))
+    SMTP_IDLE_TIMEOUT = float(os.environ.get("SMTP_IDLE_TIMEOUT", 60))
+
+    # Keyset pagination for list pages and their /api variants
+    PAGE_SIZE = int(os.environ.get("PAGE_SIZE", 50))
+    MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", 200))
+
+    # Customer search ranks at most this many of the newest full-text matches,
+    # so common terms cost the same as rare ones
+    SEARCH_RANK_CANDIDATES = int(os.environ.get("SEARCH_RANK_CANDIDATES", 1000))
+    # Country code left out of stored mobile digits, so searches and imports
+    # match local and international forms of a number; run `flask db-upgrade`
+    # after changing it
+    MOBILE_COUNTRY_CODE = os.environ.get("MOBILE_COUNTRY_CODE", "91")
+
+    # Seconds dashboard counters are served from the in-process cache
+    STATS_CACHE_TTL = float(os.environ.get("STATS_CACHE_TTL", 30))
+
+    # List pages answer revalidations with 304 while the data versions they
+    # show are unchanged. Versions are re-read every DATA_VERSION_TTL seconds
+    # (writes in this process are seen at once); rendered tables are kept in
+    # an LRU of FRAGMENT_CACHE_SIZE entries. PAGE_CACHE_SALT (default: a
+    # stamp of the source files) is mixed into every ETag; set it to the
+    # release id when several hosts serve the app
+    DATA_VERSION_TTL = float(os.environ.get("DATA_VERSION_TTL", 2))
+    FRAGMENT_CACHE_SIZE = int(os.environ.get("FRAGMENT_CACHE_SIZE", 256))
+    FRAGMENT_CACHE_TTL = float(os.environ.get("FRAGMENT_CACHE_TTL", 300))
+    PAGE_CACHE_SALT = os.environ.get("PAGE_CACHE_SALT")
+
+    # Rows fetched per server-side cursor batch by /reports/download
+    EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 1000))
+
+    # Seconds /api/reports/summary results stay cached; new events for the
+    # tenant invalidate them sooner, delivery status changes don't
+    REPORT_CACHE_TTL = float(os.environ.get("REPORT_CACHE_TTL", 300))
+
+    # `flask apply-retention` moves events and message logs older than this
+    # many days to gzip NDJSON files under ARCHIVE_DIR, RETENTION_CHUNK_SIZE
+    # rows per transaction, keeping daily counts in message_daily_stats
+    RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", 365))
+    ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archive")
+    RETENTION_CHUNK_SIZE = int(os.environ.get("RETENTION_CHUNK_SIZE", 2000))
+
+    # Per-request SQL instrumentation: X-Query-Count/X-Query-Time-Ms headers
+    # (default: on in debug) and hard failures on query budget overruns (tests)
+    QUERY_STATS_HEADERS = os.environ.get("QUERY_STATS_HEADERS", "").lower() in ("true", "1", "t", "yes") or None
+    QUERY_BUDGET_STRICT = os.environ.get("QUERY_BUDGET_STRICT", "false").lower() in ("true", "1", "t", "yes")
+
+    # Prometheus metrics at /metrics. Set METRICS_DIR (local, one per deployment)
+    # when running several worker processes so /metrics sums all of them
+    METRICS_DIR = os.environ.get("METRICS_DIR")
+    METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+    # Bearer token required to scrape /metrics (default: open)
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+    # werkzeug password hashing parameters, e.g. "scrypt:16384:8:1" or
+    # "pbkdf2:sha256:600000"; stored hashes are upgraded on the next login
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    PASSWORD_SALT_LENGTH = int(os.environ.get("PASSWORD_SALT_LENGTH", 16))
+    # Seconds a logged-in user is served from the in-process cache (0 = off)
+    USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 60))
@@ -0,0 +1,226 @@
+"""Deterministic synthetic shops for benchmarking.
+
+``python datagen.py --customers 100000 --db /tmp/shop-100k.db`` builds a
+database with that many customers spread over tenants of skewed sizes,
+about 1.4 watches per customer and the message history a shop of that size
+would have accumulated: battery and warranty reminders for everything that
+fell due before ``--anchor``, last year's birthday wishes and a few weekly
+offers, each as a message log, an event and a ledger entry. The same
+``--customers``, ``--seed`` and ``--anchor`` always produce the same rows.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import func, select
+
+from duedates import battery_due_on, birthday_doy, warranty_due_on
+from message_templates import CompiledTemplate
+from models import db, normalize_mobile, Customer, Event, EventLedger, MessageLog, Tenant, Watch
+from rules import RULES_BY_KEY, iso_week
+from stats import reconcile_stats
+
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# Standard sizes for the benchmark suite.
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+FIRST_NAMES = [
+    "Aarav", "Abbas", "Aisha", "Amit", "Ananya", "Arjun", "Ayesha", "Deepa", "Farhan", "Fatima", "Imran",
+    "Ishaan", "Kabir", "Kavya", "Meera", "Mohammed", "Neha", "Nikhil", "Priya", "Rahul", "Riya", "Rohan",
+    "Sana", "Sara", "Sneha", "Tanvi", "Vikram", "Zara", "Zoya", "Yusuf",
+]
+LAST_NAMES = [
+    "Ahmed", "Bhatt", "Chopra", "Das", "Desai", "Gupta", "Iyer", "Joshi", "Kapoor", "Khan", "Kumar", "Mehta",
+    "Menon", "Nair", "Patel", "Pillai", "Qureshi", "Rao", "Reddy", "Shah", "Sharma", "Shaikh", "Singh", "Verma",
+]
+WATCHES = [
+    ("Tissot", ["PRX", "Gentleman", "Seastar 1000", "Le Locle"]),
+    ("Seiko", ["Presage", "5 Sports", "Prospex", "Astron"]),
+    ("Casio", ["G-Shock GA-2100", "Edifice", "Vintage A168"]),
+    ("Titan", ["Edge", "Raga", "Neo"]),
+    ("Citizen", ["Eco-Drive", "Promaster", "Tsuyosa"]),
+    ("Fossil", ["Grant", "Neutra", "Gen 6"]),
+    ("Omega", ["Seamaster", "Speedmaster"]),
+]
+# Share of customers owning 1, 2 and 3 watches.
+WATCHES_PER_CUSTOMER = ([1, 2, 3], [0.70, 0.22, 0.08])
+EMAIL_SHARE = 0.7
+# Most weekly offers a customer has a log entry for.
+MAX_PAST_OFFERS = 2
+PURCHASE_YEARS = 4
+
+
+def tenant_sizes(customers: int, tenants: int, rng: random.Random) -> List[int]:
+    """Split ``customers`` over ``tenants`` with a long tail: a few big shops, many small ones."""
+    weights = [1 / (rank + 1) for rank in range(tenants)]
+    total = sum(weights)
+    sizes = [int(customers * weight / total) for weight in weights]
+    sizes[0] += customers - sum(sizes)
+    rng.shuffle(sizes)
+    return sizes
+
+
+def _history(customer: dict, anchor: date, rng: random.Random) -> List[tuple]:
+    """(event_type, sent_at, period) for the messages ``customer`` already got before ``anchor``."""
+    history = []
+    cutoff = anchor - timedelta(days=7)
+    for key, due_on in (("battery_replacement", customer["battery_due_on"]),
+                        ("extended_warranty", customer["warranty_due_on"])):
+        if due_on and due_on < cutoff:
+            sent_at = datetime.combine(due_on, datetime.min.time()) + timedelta(hours=rng.randint(8, 20))
+            history.append((key, sent_at, customer["purchase_date"].isoformat()))
+    if customer["dob"] is not None:
+        try:
+            birthday = customer["dob"].replace(year=anchor.year - 1)
+        except ValueError:  # Feb 29
+            birthday = date(anchor.year - 1, 3, 1)
+        history.append(("birthday_wishes", datetime.combine(birthday, datetime.min.time()) + timedelta(hours=9),
+                        str(birthday.year)))
+    for weeks_ago in sorted(rng.sample(range(1, 53), rng.randint(0, MAX_PAST_OFFERS))):
+        sent_on = anchor - timedelta(weeks=weeks_ago)
+        history.append(("bundling_offers", datetime.combine(sent_on, datetime.min.time()) + timedelta(hours=10),
+                        iso_week(sent_on)))
+    return history
+
+
+def generate(customers: int, seed: int = 1, anchor: Optional[date] = None, tenants: Optional[int] = None,
+             chunk_size: int = DEFAULT_CHUNK_SIZE, echo: Callable[[str], None] = print) -> Dict[str, int]:
+    """Insert a synthetic dataset into the (empty) database of the current app context.
+
+    Rows go in with executemany inserts committed every ``chunk_size``
+    customers; derived columns are computed here since Core inserts skip the
+    mapper events. Returns the number of rows written per table.
+    """
+    if db.session.execute(select(func.count()).select_from(Customer)).scalar():
+        raise ValueError("datagen needs a database without customers.")
+    anchor = anchor or date.today()
+    tenants = tenants or max(1, customers // 10_000)
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    # The demo shop the admin user belongs to is the first tenant.
+    shops = [Tenant.query.filter_by(name="Default Watch Shop").first()]
+    if shops[0] is None:
+        shops = []
+    for number in range(len(shops), tenants):
+        shops.append(Tenant(name=f"Watch Shop {number:04d}", email=f"shop{number}@example.com",
+                            mobile=str(8000000000 + number)))
+    db.session.add_all(shops)
+    db.session.commit()
+    owners = [shop.tenant_id for shop, size in zip(shops, tenant_sizes(customers, len(shops), rng))
+              for _ in range(size)]
+
+    templates = {key: CompiledTemplate(rule.message) for key, rule in RULES_BY_KEY.items()}
+    counts = dict.fromkeys(("customers", "watches", "message_logs", "events", "ledger"), 0)
+    watch_id = 0
+    for first in range(0, customers, chunk_size):
+        rows, watches, logs, events, ledger = [], [], [], [], []
+        for customer_id in range(first + 1, min(first + chunk_size, customers) + 1):
+            first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            brand, models = rng.choice(WATCHES)
+            model = f"{brand} {rng.choice(models)}"
+            purchase_date = anchor - timedelta(days=rng.randint(0, 365 * PURCHASE_YEARS))
+            dob = date(1950, 1, 1) + timedelta(days=rng.randint(0, 365 * 55)) if rng.random() < 0.9 else None
+            mobile = f"+91 {9000000000 + customer_id}"
+            tenant_id = owners[customer_id - 1]
+            customer = {
+                "id": customer_id,
+                "name": f"{first_name} {last_name}",
+                "dob": dob,
+                "purchase_date": purchase_date,
+                "model": model,
+                "mobile": mobile,
+                "email": f"{first_name}.{last_name}{customer_id}@example.com".lower() if rng.random() < EMAIL_SHARE
+                else None,
+                "mobile_digits": normalize_mobile(mobile),
+                "battery_due_on": battery_due_on(purchase_date),
+                "warranty_due_on": warranty_due_on(purchase_date),
+                "birthday_doy": birthday_doy(dob),
+                "tenant_id": tenant_id,
+                "created_at": datetime.combine(purchase_date, datetime.min.time()),
+                "updated_at": datetime.combine(purchase_date, datetime.min.time()),
+            }
+            rows.append(customer)
+
+            for number in range(rng.choices(*WATCHES_PER_CUSTOMER)[0]):
+                watch_id += 1
+                bought = purchase_date if number == 0 else purchase_date + timedelta(
+                    days=rng.randint(0, (anchor - purchase_date).days))
+                brand, models = rng.choice(WATCHES) if number else (brand, models)
+                watches.append({
+                    "watch_id": watch_id,
+                    "tenant_id": tenant_id,
+                    "customer_id": customer_id,
+                    "brand": brand,
+                    "model_no": rng.choice(models),
+                    "serial_no": f"SN{tenant_id:04d}{watch_id:09d}",
+                    "purchase_date": bought,
+                    "notes": None,
+                    "battery_due_on": battery_due_on(bought),
+                    "warranty_due_on": warranty_due_on(bought),
+                })
+
+            row = SimpleNamespace(**customer)
+            for event_type, sent_at, period in _history(customer, anchor, rng):
+                channel = "email" if event_type == "birthday_wishes" and customer["email"] else "whatsapp"
+                status = "email_sent" if channel == "email" else "sent"
+                logs.append({"customer_id": customer_id, "event_type": event_type, "sent_at": sent_at,
+                             "message": templates[event_type].render(row), "status": status})
+                events.append({"tenant_id": tenant_id, "customer_id": customer_id, "event_type": event_type,
+                               "channel": channel, "sent_at": sent_at, "status": "sent"})
+                ledger.append({"customer_id": customer_id, "event_type": event_type, "period": period,
+                               "created_at": sent_at})
+
+        db.session.execute(Customer.__table__.insert(), rows)
+        db.session.execute(Watch.__table__.insert(), watches)
+        for model, batch in ((MessageLog, logs), (Event, events), (EventLedger, ledger)):
+            if batch:
+                db.session.execute(model.__table__.insert(), batch)
+        db.session.commit()
+        for name, batch in (("customers", rows), ("watches", watches), ("message_logs", logs),
+                            ("events", events), ("ledger", ledger)):
+            counts[name] += len(batch)
+        echo(f"{counts['customers']}/{customers} customers ({time.perf_counter() - started:.0f}s)")
+
+    # Counters for the dashboard, from the rows just written.
+    reconcile_stats()
+    db.session.commit()
+    echo(", ".join(f"{count} {name}" for name, count in counts.items())
+         + f" in {time.perf_counter() - started:.1f}s (anchor {anchor})")
+    return counts
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--customers", default="10k",
+                        help="number of customers, or one of: " + ", ".join(SIZES))
+    parser.add_argument("--db", required=True, help="SQLite file to create")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--anchor", type=date.fromisoformat, default=None,
+                        help="the dataset's 'today' (default: today)")
+    parser.add_argument("--tenants", type=int, default=None, help="default: one per 10k customers")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    customers = SIZES.get(args.customers.lower()) or int(args.customers)
+    if os.path.exists(args.db):
+        sys.exit(f"{args.db} already exists.")
+    # The app reads its database URL from the environment when config is imported.
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.abspath(args.db)
+    from app import create_app
+    from migrations import init_db
+    app = create_app()
+    with app.app_context():
+        init_db()
+        generate(customers, seed=args.seed, anchor=args.anchor, tenants=args.tenants, chunk_size=args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
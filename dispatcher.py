@@ -0,0 +1,260 @@
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flask import Flask
+from flask_mail import Message
+from sqlalchemy import Row, and_, bindparam, func, or_, select
+
+from metrics import SEND_FAILURES, SEND_OUTCOMES, SEND_SECONDS
+from models import db, Event, EventRun, EventRunShard, MessageLog, Outbox
+from pagecache import bump_versions
+from transport import get_smtp_pool
+
+
+# Final MessageLog status per channel, on success and on giving up.
+LOG_STATUS = {
+    ("email", True): "email_sent",
+    ("email", False): "email_failed",
+}
+
+
+def parse_rate_limits(value: str) -> Dict[str, float]:
+    """Parse ``"email:5,whatsapp:20"`` into messages per second per channel."""
+    limits = {}
+    for item in (value or "").split(","):
+        if ":" in item:
+            channel, rate = item.split(":", 1)
+            limits[channel.strip()] = float(rate)
+    return limits
+
+
+class RateLimiter:
+    """Token bucket shared by every worker thread sending on one channel."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Dispatcher:
+    """Deliver queued outbox messages with bounded concurrency.
+
+    Rows are claimed in batches so several dispatchers (threads or processes)
+    can drain the same outbox. Sends run on a thread pool, each channel behind
+    its own rate limiter; failures are retried with exponential backoff until
+    ``OUTBOX_MAX_ATTEMPTS``. Results are written back to the outbox and to the
+    matching Event and MessageLog rows once per batch.
+    """
+
+    def __init__(self, app: Flask, senders: Optional[Dict[str, Callable[[Row], None]]] = None):
+        config = app.config
+        self.app = app
+        self.concurrency = config.get("DISPATCH_CONCURRENCY", 4)
+        self.batch_size = config.get("OUTBOX_BATCH_SIZE", 100)
+        self.max_attempts = config.get("OUTBOX_MAX_ATTEMPTS", 5)
+        self.backoff_seconds = config.get("OUTBOX_BACKOFF_SECONDS", 5)
+        self.backoff_max_seconds = config.get("OUTBOX_BACKOFF_MAX_SECONDS", 600)
+        self.claim_timeout = timedelta(seconds=config.get("OUTBOX_CLAIM_TIMEOUT", 300))
+        self.limiters = {
+            channel: RateLimiter(rate)
+            for channel, rate in parse_rate_limits(config.get("DISPATCH_RATE_LIMITS", "")).items()
+            if rate > 0
+        }
+        self.senders = {"email": self.send_email, "whatsapp": self.send_whatsapp}
+        self.senders.update(senders or {})
+        self.token = uuid.uuid4().hex
+
+    def send_email(self, row: Row) -> None:
+        with self.app.app_context():
+            msg = Message(row.subject, recipients=[row.recipient])
+            msg.body = row.body
+            get_smtp_pool(self.app).send(msg)
+
+    def send_whatsapp(self, row: Row) -> None:
+        # WhatsApp delivery is mocked; the message only needs recording.
+        pass
+
+    def _claimable(self, now: datetime):
+        return or_(
+            and_(Outbox.status == "pending", Outbox.next_attempt_at <= now),
+            and_(Outbox.status == "sending", Outbox.claimed_at < now - self.claim_timeout),
+        )
+
+    def claim(self) -> list:
+        """Claim up to ``batch_size`` due rows for this dispatcher; returns them as plain rows."""
+        now = datetime.utcnow()
+        ids = db.session.execute(
+            select(Outbox.outbox_id).where(self._claimable(now))
+            .order_by(Outbox.next_attempt_at, Outbox.outbox_id).limit(self.batch_size)
+        ).scalars().all()
+        if not ids:
+            return []
+        db.session.execute(
+            Outbox.__table__.update()
+            .where(Outbox.outbox_id.in_(ids), self._claimable(now))
+            .values(status="sending", claimed_by=self.token, claimed_at=now)
+        )
+        db.session.commit()
+        return db.session.execute(
+            select(*Outbox.__table__.c).where(Outbox.claimed_by == self.token, Outbox.status == "sending")
+        ).all()
+
+    def _deliver(self, row: Row) -> Tuple[Row, Optional[str]]:
+        limiter = self.limiters.get(row.channel)
+        if limiter:
+            limiter.acquire()
+        started = time.perf_counter()
+        try:
+            self.senders[row.channel](row)
+        except Exception as exc:
+            SEND_FAILURES.inc(row.channel)
+            return row, f"{type(exc).__name__}: {exc}"
+        finally:
+            SEND_SECONDS.observe(time.perf_counter() - started, row.channel)
+        return row, None
+
+    def _record(self, results: List[Tuple[Row, Optional[str]]]) -> Dict[str, int]:
+        now = datetime.utcnow()
+        outbox_updates, final_updates = [], []
+        counts = {"sent": 0, "retry": 0, "failed": 0}
+        for row, error in results:
+            attempts = row.attempts + 1
+            if error is None:
+                status, outcome = "sent", "sent"
+            elif attempts >= self.max_attempts:
+                status, outcome = "failed", "failed"
+            else:
+                status, outcome = "pending", "retry"
+            counts[outcome] += 1
+            SEND_OUTCOMES.inc(row.channel, outcome)
+            delay = min(self.backoff_max_seconds, self.backoff_seconds * 2 ** (attempts - 1))
+            outbox_updates.append({
+                "b_id": row.outbox_id,
+                "b_status": status,
+                "b_attempts": attempts,
+                "b_next": now + timedelta(seconds=delay) if status == "pending" else row.next_attempt_at,
+                "b_error": error,
+                "b_sent_at": now if status == "sent" else None,
+            })
+            if status != "pending":
+                ok = status == "sent"
+                final_updates.append({
+                    "b_run": row.run_id,
+                    "b_customer": row.customer_id,
+                    "b_type": row.event_type,
+                    "b_event_status": "sent" if ok else "failed",
+                    "b_log_status": LOG_STATUS.get((row.channel, ok), "sent" if ok else "failed"),
+                    "b_sent_at": now,
+                })
+
+        db.session.execute(
+            Outbox.__table__.update().where(Outbox.outbox_id == bindparam("b_id")).values(
+                status=bindparam("b_status"), attempts=bindparam("b_attempts"),
+                next_attempt_at=bindparam("b_next"), last_error=bindparam("b_error"),
+                sent_at=bindparam("b_sent_at"), claimed_by=None, claimed_at=None,
+            ),
+            outbox_updates,
+        )
+        if final_updates:
+            for model, status_param in ((Event, "b_event_status"), (MessageLog, "b_log_status")):
+                db.session.execute(
+                    model.__table__.update().where(
+                        model.run_id == bindparam("b_run"),
+                        model.customer_id == bindparam("b_customer"),
+                        model.event_type == bindparam("b_type"),
+                    ).values(status=bindparam(status_param), sent_at=bindparam("b_sent_at")),
+                    final_updates,
+                )
+            # Outbox rows don't record their tenant.
+            bump_versions(None, "messages")
+        db.session.commit()
+        return counts
+
+    def drain(self, wait_for_retries: bool = True, poll_interval: float = 1.0) -> Dict[str, int]:
+        """Deliver everything currently due, then finish completed runs.
+
+        With ``wait_for_retries`` the call also waits out backoff delays until
+        no pending rows remain.
+        """
+        totals = {"sent": 0, "retry": 0, "failed": 0}
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="outbox") as pool:
+            while True:
+                rows = self.claim()
+                if rows:
+                    for outcome, count in self._record(list(pool.map(self._deliver, rows))).items():
+                        totals[outcome] += count
+                    continue
+                next_due = db.session.execute(
+                    select(func.min(Outbox.next_attempt_at)).where(Outbox.status == "pending")
+                ).scalar()
+                if not wait_for_retries or next_due is None:
+                    break
+                time.sleep(min(poll_interval, max(0.0, (next_due - datetime.utcnow()).total_seconds())))
+        finish_runs()
+        pool = self.app.extensions.get("smtp_pool")
+        if pool is not None and pool.messages_sent:
+            stats = pool.stats()
+            self.app.logger.info(
+                "SMTP pool: %d emails, %d handshakes, %.1f emails/s",
+                stats["messages_sent"], stats["handshakes"], stats["messages_per_second"],
+            )
+        return totals
+
+    def run_forever(self, poll_interval: float = 1.0) -> None:
+        while True:
+            self.drain(wait_for_retries=False)
+            time.sleep(poll_interval)
+
+
+def finish_runs() -> None:
+    """Mark dispatching runs whose outbox rows have all been delivered or given up on as completed."""
+    open_runs = select(Outbox.run_id).where(Outbox.status.in_(("pending", "sending")), Outbox.run_id.isnot(None))
+    runs = EventRun.query.filter(EventRun.status == "dispatching", EventRun.run_id.notin_(open_runs)).all()
+    for run in runs:
+        run.status = "completed"
+        run.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def run_progress(run: EventRun) -> dict:
+    by_status = dict(db.session.execute(
+        select(Outbox.status, func.count()).where(Outbox.run_id == run.run_id).group_by(Outbox.status)
+    ).all())
+    shards, scanned = Counter(), Counter()
+    for status, shard_scanned in db.session.execute(
+        select(EventRunShard.status, EventRunShard.scanned).where(EventRunShard.run_id == run.run_id)
+    ):
+        shards[status] += 1
+        scanned.update(shard_scanned or {})
+    return {
+        "run_id": run.run_id,
+        "tenant_id": run.tenant_id,
+        "status": run.status,
+        "started_at": run.started_at.isoformat(timespec="seconds"),
+        "finished_at": run.finished_at.isoformat(timespec="seconds") if run.finished_at else None,
+        "messages": run.messages,
+        "shards": {status: shards.get(status, 0) for status in ("pending", "running", "completed", "failed")},
+        # Candidate customers each rule read, summed over the finished shards
+        "scanned": dict(scanned),
+        "outbox": {status: by_status.get(status, 0) for status in ("pending", "sending", "sent", "failed")},
+    }
@@ -0,0 +1,37 @@
+from datetime import date
+from typing import Optional
+
+
+BATTERY_MONTHS = 18
+WARRANTY_MONTHS = 11
+
+
+def add_months(start_date: date, months: int) -> date:
+    if start_date is None:
+        return None
+    month = start_date.month - 1 + months
+    year = start_date.year + month // 12
+    month = month % 12 + 1
+    day = min(start_date.day, [31,
+                               29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28,
+                               31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month - 1])
+    return date(year, month, day)
+
+
+def birthday_doy(day: Optional[date]) -> Optional[int]:
+    """Day-of-year of ``day`` on a leap-year calendar.
+
+    Feb 29 is always 60 and Mar 1 always 61, so a stored birthday compares
+    equal to ``birthday_doy(today)`` only on its actual month and day.
+    """
+    if day is None:
+        return None
+    return date(2000, day.month, day.day).timetuple().tm_yday
+
+
+def battery_due_on(purchase_date: Optional[date]) -> Optional[date]:
+    return add_months(purchase_date, BATTERY_MONTHS)
+
+
+def warranty_due_on(purchase_date: Optional[date]) -> Optional[date]:
+    return add_months(purchase_date, WARRANTY_MONTHS)
@@ -0,0 +1,70 @@
+from flask import Flask, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+# Bind key of the optional read engine (SQLALCHEMY_BINDS["read"]).
+READ_BIND = "read"
+
+
+def read_replica(view):
+    """Mark a view as read-only, so its queries may go to the read engine."""
+    view.read_replica = True
+    return view
+
+
+class RoutingSession(Session):
+    """Sends the queries of ``read_replica`` views to the read engine when one is configured.
+
+    Flushes always go to the primary, so a read-only view that writes after
+    all still writes to the right database.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context() and g.get("read_replica"):
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def sqlite_pragmas(config, read_only: bool = False) -> list:
+    pragmas = [
+        f"PRAGMA journal_mode={config.get('SQLITE_JOURNAL_MODE', 'WAL')}",
+        f"PRAGMA synchronous={config.get('SQLITE_SYNCHRONOUS', 'NORMAL')}",
+        f"PRAGMA busy_timeout={int(config.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}",
+        f"PRAGMA mmap_size={int(config.get('SQLITE_MMAP_SIZE', 0))}",
+        f"PRAGMA cache_size={int(config.get('SQLITE_CACHE_SIZE', -2000))}",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only=1")
+    return pragmas
+
+
+def init_engines(app: Flask) -> None:
+    """Route ``read_replica`` views to the read engine, and apply the SQLite
+    profile's pragmas to every new connection of the app's SQLite engines.
+
+    Call after ``db.init_app`` and before the first query.
+    """
+
+    @app.before_request
+    def _route_reads():
+        view = app.view_functions.get(request.endpoint)
+        g.read_replica = getattr(view, "read_replica", False)
+
+    if app.config.get("DB_PROFILE", "auto") not in ("auto", "sqlite"):
+        return
+    with app.app_context():
+        engines = dict(app.extensions["sqlalchemy"].engines)
+    for bind_key, engine in engines.items():
+        if engine.dialect.name != "sqlite":
+            continue
+        pragmas = sqlite_pragmas(app.config, read_only=bind_key == READ_BIND)
+
+        def set_pragmas(dbapi_connection, connection_record, pragmas=pragmas):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
+
+        event.listen(engine, "connect", set_pragmas)
@@ -0,0 +1,96 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator
+
+from flask import abort
+from sqlalchemy import select
+
+from models import db, Customer, MessageLog
+
+
+EXPORT_COLUMNS = ["id", "customer_id", "customer_name", "event_type", "message", "sent_at", "status"]
+
+DEFAULT_EXPORT_BATCH_SIZE = 1000
+
+
+def _parse_day(value: str, name: str) -> datetime:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        abort(400, f"{name} must be a YYYY-MM-DD date.")
+
+
+def export_query(args):
+    """Message logs joined with their customer's name, filtered by request ``args``.
+
+    Supported filters: ``start`` and ``end`` (inclusive days), ``event_type``
+    and ``status``. All filtering happens in SQL.
+    """
+    stmt = (
+        select(
+            MessageLog.id, MessageLog.customer_id, Customer.name.label("customer_name"),
+            MessageLog.event_type, MessageLog.message, MessageLog.sent_at, MessageLog.status,
+        )
+        .outerjoin(Customer, MessageLog.customer_id == Customer.id)
+    )
+    if args.get("start"):
+        stmt = stmt.where(MessageLog.sent_at >= _parse_day(args["start"], "start"))
+    if args.get("end"):
+        stmt = stmt.where(MessageLog.sent_at < _parse_day(args["end"], "end") + timedelta(days=1))
+    if args.get("event_type"):
+        stmt = stmt.where(MessageLog.event_type == args["event_type"])
+    if args.get("status"):
+        stmt = stmt.where(MessageLog.status == args["status"])
+    return stmt
+
+
+def has_rows(stmt) -> bool:
+    return db.session.execute(stmt.limit(1)).first() is not None
+
+
+def iter_rows(stmt, batch_size: int = DEFAULT_EXPORT_BATCH_SIZE) -> Iterator[dict]:
+    """Stream rows from a server-side cursor, ``batch_size`` at a time."""
+    result = db.session.execute(
+        stmt.order_by(MessageLog.sent_at.desc(), MessageLog.id.desc())
+        .execution_options(stream_results=True, yield_per=batch_size)
+    )
+    for row in result.mappings():
+        row = dict(row)
+        row["sent_at"] = row["sent_at"].isoformat(timespec="seconds")
+        yield row
+
+
+def csv_chunks(rows: Iterable[dict], rows_per_chunk: int = 500) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, lineterminator="\n")
+    writer.writeheader()
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(rows: Iterable[dict], rows_per_chunk: int = 500) -> Iterator[str]:
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, ensure_ascii=False))
+        if len(lines) >= rows_per_chunk:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def gzip_chunks(chunks: Iterable[str]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
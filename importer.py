@@ -0,0 +1,342 @@
+import csv
+import os
+import time
+from datetime import date, datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, insert, or_, select
+
+from duedates import battery_due_on, birthday_doy, warranty_due_on
+from models import db, normalize_mobile, Customer, ImportJob, Watch
+from pagecache import bump_versions
+from stats import bump_counters, default_tenant_id
+
+
+DEFAULT_IMPORT_CHUNK_SIZE = 5000
+
+CUSTOMER_FIELDS = ("name", "dob", "purchase_date", "model", "mobile", "email")
+WATCH_FIELDS = ("serial_no", "brand", "model_no", "purchase_date", "notes", "customer_mobile", "customer_email")
+DATE_FIELDS = ("dob", "purchase_date")
+
+
+class ImportFileError(ValueError):
+    pass
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))  # spreadsheet numbers such as mobiles
+    return str(value)
+
+
+def _xlsx_chunks(path: str, chunk_size: int, skip_rows: int) -> Iterator:
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportFileError("Reading .xlsx files needs openpyxl (pip install openpyxl).") from None
+    import pandas as pd
+
+    book = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = book.active.iter_rows(values_only=True)
+        header = [_cell(value).strip() for value in next(rows, ())]
+        buffer: List[list] = []
+        for i, row in enumerate(rows):
+            if i < skip_rows:
+                continue
+            values = [_cell(value) for value in row[:len(header)]]
+            buffer.append(values + [""] * (len(header) - len(values)))
+            if len(buffer) >= chunk_size:
+                yield pd.DataFrame(buffer, columns=header)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=header)
+    finally:
+        book.close()
+
+
+def read_chunks(path: str, chunk_size: int = DEFAULT_IMPORT_CHUNK_SIZE, skip_rows: int = 0) -> Iterator:
+    """Stream a CSV or XLSX file as DataFrames of at most ``chunk_size`` string-typed rows.
+
+    The first ``skip_rows`` data rows are skipped, for resuming.
+    """
+    if os.path.splitext(path)[1].lower() in (".xlsx", ".xlsm"):
+        yield from _xlsx_chunks(path, chunk_size, skip_rows)
+        return
+    import pandas as pd
+
+    yield from pd.read_csv(
+        path, dtype=str, keep_default_na=False, encoding="utf-8-sig", chunksize=chunk_size,
+        skiprows=(lambda i: 0 < i <= skip_rows) if skip_rows else None,
+    )
+
+
+def _prepare(chunk, fields, required, one_of, date_format: str):
+    """Normalize a raw chunk: trimmed string columns, parsed dates, and an ``error`` column."""
+    import pandas as pd
+
+    chunk.columns = [str(column).strip().lower() for column in chunk.columns]
+    missing = [field for field in required if field not in chunk.columns]
+    if missing:
+        raise ImportFileError(f"Missing required columns: {', '.join(missing)}")
+    if one_of and not any(field in chunk.columns for field in one_of):
+        raise ImportFileError(f"Needs one of the columns: {', '.join(one_of)}")
+    df = pd.DataFrame(index=chunk.index)
+    for field in fields:
+        df[field] = chunk[field].astype(str).str.strip() if field in chunk.columns else ""
+    df["error"] = ""
+    for field in required:
+        df.loc[df[field] == "", "error"] += f"{field} is required; "
+    for field in DATE_FIELDS:
+        if field not in df:
+            continue
+        raw = df[field]
+        parsed = pd.to_datetime(raw, format=date_format, errors="coerce")
+        df.loc[(raw != "") & parsed.isna(), "error"] += f"{field} is not a {date_format} date; "
+        df[field] = pd.Series(parsed.dt.date, index=df.index, dtype=object).where(parsed.notna(), None)
+    return df
+
+
+def _dedupe(df, key: str):
+    """Keep the last row for each non-empty ``key``; rows without one are all kept."""
+    keyed = df[df[key] != ""]
+    return df[(df[key] == "") | df.index.isin(keyed.drop_duplicates(subset=[key], keep="last").index)]
+
+
+def _none_if_blank(value):
+    return value if value not in ("", None) else None
+
+
+def _tenant_customers(tenant_id: int):
+    scope = Customer.tenant_id == tenant_id
+    if tenant_id == default_tenant_id():
+        scope = or_(scope, Customer.tenant_id.is_(None))
+    return scope
+
+
+def _customer_ids(tenant_id: int, mobiles, emails) -> Dict[str, int]:
+    """Lookup pass: ``{"m:<digits>" | "e:<email>": customer id}`` for the given keys."""
+    mobiles, emails = sorted(set(mobiles) - {""}), sorted(set(emails) - {""})
+    if not mobiles and not emails:
+        return {}
+    rows = db.session.execute(
+        select(Customer.id, Customer.mobile_digits, Customer.email)
+        .where(_tenant_customers(tenant_id), or_(Customer.mobile_digits.in_(mobiles), Customer.email.in_(emails)))
+        .order_by(Customer.id)
+    ).all()
+    ids = {}
+    for customer_id, digits, email in rows:
+        if digits:
+            ids[f"m:{digits}"] = customer_id
+        if email:
+            ids[f"e:{email}"] = customer_id
+    return ids
+
+
+def _match(df, ids: Dict[str, int], mobile_key: str, email_key: str):
+    by_mobile = ("m:" + df[mobile_key]).map(ids)
+    by_email = ("e:" + df[email_key]).map(ids)
+    return by_mobile.where(by_mobile.notna(), by_email)
+
+
+def _upsert_values(table, replace, keep) -> dict:
+    """SET clause for executemany updates from ``p_<column>`` parameters.
+
+    Columns in ``keep`` keep their stored value when the import cell is blank.
+    """
+    values = {column: bindparam(f"p_{column}") for column in replace}
+    values.update({column: func.coalesce(bindparam(f"p_{column}"), table.c[column]) for column in keep})
+    return values
+
+
+def _params(record: dict) -> dict:
+    return {f"p_{key}": value for key, value in record.items()}
+
+
+def _import_customers(df, tenant_id: int, now: datetime) -> Tuple[Dict[str, int], object]:
+    import pandas as pd
+
+    digits = df["mobile"].map(normalize_mobile).fillna("")
+    key = ("m:" + digits).where(digits != "", ("e:" + df["email"]).where(df["email"] != "", ""))
+    df = _dedupe(df.assign(mobile_digits=digits, key=key), "key")
+    df = df.assign(customer_id=_match(df, _customer_ids(tenant_id, df["mobile_digits"], df["email"]),
+                                      "mobile_digits", "email"))
+
+    new, existing = [], []
+    for row in df.itertuples(index=False):
+        record = {
+            "name": row.name,
+            "dob": row.dob,
+            "purchase_date": row.purchase_date,
+            "model": _none_if_blank(row.model),
+            "mobile": _none_if_blank(row.mobile),
+            "email": _none_if_blank(row.email),
+            "mobile_digits": _none_if_blank(row.mobile_digits),
+            "battery_due_on": battery_due_on(row.purchase_date),
+            "warranty_due_on": warranty_due_on(row.purchase_date),
+            "birthday_doy": birthday_doy(row.dob),
+            "updated_at": now,
+        }
+        if pd.isna(row.customer_id):
+            new.append(dict(record, tenant_id=tenant_id, created_at=now))
+        else:
+            existing.append(_params(dict(record, id=int(row.customer_id))))
+    table = Customer.__table__
+    if new:
+        db.session.execute(insert(table), new)
+        bump_counters(tenant_id, customers=len(new))
+    if existing:
+        keep = ["dob", "purchase_date", "model", "mobile", "email", "mobile_digits",
+                "battery_due_on", "warranty_due_on", "birthday_doy"]
+        db.session.execute(
+            table.update().where(table.c.id == bindparam("p_id"))
+            .values(_upsert_values(table, ["name", "updated_at"], keep)),
+            existing,
+        )
+    if new or existing:
+        bump_versions(tenant_id, "customers")
+    return {"inserted": len(new), "updated": len(existing)}, df.iloc[0:0]
+
+
+def _import_watches(df, tenant_id: int, now: datetime) -> Tuple[Dict[str, int], object]:
+    digits = df["customer_mobile"].map(normalize_mobile).fillna("")
+    ids = _customer_ids(tenant_id, digits, df["customer_email"])
+    df = df.assign(customer_id=_match(df.assign(customer_mobile=digits), ids, "customer_mobile", "customer_email"))
+    unmatched = df["customer_id"].isna()
+    rejected = df[unmatched].assign(error="no customer with this customer_mobile/customer_email; ")
+    df = _dedupe(df[~unmatched], "serial_no")
+
+    serials = sorted(set(df["serial_no"]) - {""})
+    existing_ids = dict(db.session.execute(
+        select(Watch.serial_no, Watch.watch_id).where(Watch.tenant_id == tenant_id, Watch.serial_no.in_(serials))
+    ).all()) if serials else {}
+
+    new, existing = [], []
+    for row in df.itertuples(index=False):
+        record = {
+            "customer_id": int(row.customer_id),
+            "brand": _none_if_blank(row.brand),
+            "model_no": _none_if_blank(row.model_no),
+            "serial_no": _none_if_blank(row.serial_no),
+            "purchase_date": row.purchase_date,
+            "notes": _none_if_blank(row.notes),
+            "battery_due_on": battery_due_on(row.purchase_date),
+            "warranty_due_on": warranty_due_on(row.purchase_date),
+        }
+        watch_id = existing_ids.get(row.serial_no) if row.serial_no else None
+        if watch_id is None:
+            new.append(dict(record, tenant_id=tenant_id))
+        else:
+            existing.append(_params(dict(record, watch_id=watch_id)))
+    table = Watch.__table__
+    if new:
+        db.session.execute(insert(table), new)
+        bump_counters(tenant_id, watches=len(new))
+    if existing:
+        keep = ["brand", "model_no", "purchase_date", "notes", "battery_due_on", "warranty_due_on"]
+        db.session.execute(
+            table.update().where(table.c.watch_id == bindparam("p_watch_id"))
+            .values(_upsert_values(table, ["customer_id", "serial_no"], keep)),
+            existing,
+        )
+    if new or existing:
+        bump_versions(tenant_id, "watches")
+    return {"inserted": len(new), "updated": len(existing)}, rejected
+
+
+# kind -> (columns read, required columns, at least one of these columns, importer)
+IMPORTERS = {
+    "customers": (CUSTOMER_FIELDS, ("name",), (), _import_customers),
+    "watches": (WATCH_FIELDS, ("serial_no",), ("customer_mobile", "customer_email"), _import_watches),
+}
+
+
+def _fingerprint(path: str) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_size}-{int(stat.st_mtime)}"
+
+
+def start_job(kind: str, path: str, tenant_id: int, resume: bool = True) -> ImportJob:
+    """The unfinished job for this file to resume, or a new one."""
+    source, fingerprint = os.path.abspath(path), _fingerprint(path)
+    job = None
+    if resume:
+        job = (ImportJob.query
+               .filter_by(kind=kind, source=source, fingerprint=fingerprint, tenant_id=tenant_id)
+               .filter(ImportJob.status != "completed")
+               .order_by(ImportJob.job_id.desc()).first())
+    if job is None:
+        job = ImportJob(kind=kind, source=source, fingerprint=fingerprint, tenant_id=tenant_id)
+        db.session.add(job)
+    job.status = "running"
+    job.error = None
+    db.session.commit()
+    return job
+
+
+def _write_rejects(path: str, chunk, errors, fields) -> None:
+    """Append rejected rows as they appeared in the file, with line numbers and reasons."""
+    new_file = not os.path.exists(path)
+    with open(path, "a", newline="") as handle:
+        writer = csv.writer(handle)
+        if new_file:
+            writer.writerow(["line", "error", *fields])
+        for line, error in errors.items():
+            raw = [chunk.at[line, field] if field in chunk.columns else "" for field in fields]
+            writer.writerow([line, error.rstrip("; "), *raw])
+
+
+def run_import(job: ImportJob, chunk_size: int = DEFAULT_IMPORT_CHUNK_SIZE, date_format: str = "%Y-%m-%d",
+               rejects_path: Optional[str] = None,
+               progress: Optional[Callable[[ImportJob, float], None]] = None) -> ImportJob:
+    """Import ``job``'s file from its checkpoint onwards, one committed chunk at a time.
+
+    Each chunk is validated, matched against existing rows with one lookup
+    query, and upserted with executemany statements. The job's counters are
+    updated in the same transaction, so after a failure the import resumes
+    at the first chunk that wasn't committed. ``progress(job, rows_per_second)``
+    is called after every chunk.
+    """
+    import pandas as pd
+
+    fields, required, one_of, importer = IMPORTERS[job.kind]
+    job_id, tenant_id = job.job_id, job.tenant_id
+    started, processed = time.perf_counter(), 0
+    try:
+        for chunk in read_chunks(job.source, chunk_size, skip_rows=job.rows_done):
+            chunk_started = time.perf_counter()
+            first_line = job.rows_done + 2  # 1-based, after the header row
+            chunk.index = range(first_line, first_line + len(chunk))
+            df = _prepare(chunk, fields, required, one_of, date_format)
+            counts, unmatched = importer(df[df["error"] == ""], tenant_id, datetime.utcnow())
+            rejects = pd.concat([df[df["error"] != ""], unmatched]).sort_index()
+
+            job = db.session.get(ImportJob, job_id)
+            job.rows_done += len(chunk)
+            job.inserted += counts["inserted"]
+            job.updated += counts["updated"]
+            job.rejected += len(rejects)
+            job.seconds += time.perf_counter() - chunk_started
+            db.session.commit()
+            if rejects_path and len(rejects):
+                _write_rejects(rejects_path, chunk, rejects["error"], fields)
+            processed += len(chunk)
+            if progress:
+                progress(job, processed / max(time.perf_counter() - started, 1e-9))
+    except Exception as exc:
+        db.session.rollback()
+        job = db.session.get(ImportJob, job_id)
+        job.status = "failed"
+        job.error = f"{type(exc).__name__}: {exc}"
+        db.session.commit()
+        raise
+    job = db.session.get(ImportJob, job_id)
+    job.status = "completed"
+    db.session.commit()
+    return job
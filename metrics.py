@@ -0,0 +1,351 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: files of exited processes are left in place
+    fcntl = None
+
+from flask import Flask, Response, abort, current_app, g, request
+
+from models import db
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_INF = 'le="+Inf"'
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+
+class Counter(_Metric):
+    """A monotonic count; ``name`` is the sample name, so it ends in ``_total``."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        if not name.endswith("_total"):
+            raise ValueError(f"counter {name!r} must be named with its _total suffix")
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values, amount: float = 1.0) -> None:
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(labels), value] for labels, value in self.values.items()]
+
+    def restore(self, samples: list) -> None:
+        for labels, value in samples:
+            self.values[tuple(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, seconds: float, *label_values) -> None:
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += seconds
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(labels), list(counts), total] for labels, (counts, total) in self.values.items()]
+
+    def restore(self, samples: list) -> None:
+        for labels, counts, total in samples:
+            self.values[tuple(labels)] = [list(counts), total]
+
+
+REGISTRY: Dict[str, _Metric] = {}
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time spent handling a request.", ("endpoint", "method", "status"))
+EVENT_RUN_SECONDS = Histogram(
+    "event_run_duration_seconds", "Wall time of an event run, from planning to merged results.", ("status",),
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800))
+EVENT_SHARD_SECONDS = Histogram(
+    "event_shard_duration_seconds", "Wall time of one event run shard.", ("status",),
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+EVENT_CUSTOMERS_SCANNED = Counter(
+    "event_customers_scanned_total", "Customers matched by a rule's query, before the ledger check.", ("rule",))
+EVENT_MESSAGES = Counter(
+    "event_messages_total", "Messages queued by event runs.", ("rule", "channel"))
+SEND_SECONDS = Histogram(
+    "outbound_send_duration_seconds", "Time to hand one message to its channel.", ("channel",))
+SEND_FAILURES = Counter(
+    "outbound_send_failures_total", "Send attempts that raised.", ("channel",))
+SEND_OUTCOMES = Counter(
+    "outbound_messages_total", "Delivery outcomes recorded by the dispatcher.", ("channel", "outcome"))
+DB_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_duration_seconds", "Time waiting for a database connection from the pool.",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def merge(snapshots: List[dict]) -> dict:
+    """One snapshot holding the sum of ``snapshots`` (one per process)."""
+    merged = {}
+    for name, metric in REGISTRY.items():
+        if isinstance(metric, Counter):
+            totals: Dict[tuple, float] = {}
+            for snapshot in snapshots:
+                for labels, value in snapshot.get(name, []):
+                    totals[tuple(labels)] = totals.get(tuple(labels), 0.0) + value
+            merged[name] = [[list(labels), value] for labels, value in totals.items()]
+        else:
+            sums: Dict[tuple, list] = {}
+            for snapshot in snapshots:
+                for labels, counts, total in snapshot.get(name, []):
+                    entry = sums.setdefault(tuple(labels), [[0] * len(counts), 0.0])
+                    entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                    entry[1] += total
+            merged[name] = [[list(labels), counts, total] for labels, (counts, total) in sums.items()]
+    return merged
+
+
+def render(snapshots: List[dict]) -> str:
+    """Prometheus text exposition of the sum of ``snapshots`` (one per process)."""
+    merged = merge(snapshots)
+    lines = []
+    for name, metric in REGISTRY.items():
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        if isinstance(metric, Counter):
+            for labels, value in sorted(merged[name]):
+                lines.append(f"{name}{_labels(metric.labels, labels)} {_number(value)}")
+        else:
+            for labels, counts, total in sorted(merged[name]):
+                cumulative = 0
+                for bound, count in zip(metric.buckets, counts):
+                    cumulative += count
+                    le = 'le="%s"' % float(bound)
+                    lines.append(f"{name}_bucket{_labels(metric.labels, labels, le)} {cumulative}")
+                cumulative += counts[-1]
+                lines.append(f"{name}_bucket{_labels(metric.labels, labels, _INF)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(metric.labels, labels)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(metric.labels, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> dict:
+    return {name: metric.snapshot() for name, metric in REGISTRY.items()}
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # another user's process
+    return True
+
+
+class _ProcessFiles:
+    """Each process periodically writes its metrics to ``<dir>/metrics-<pid>.json``;
+    /metrics in any process sums every file, so gunicorn workers are
+    aggregated. Scrapes fold the files of exited processes into
+    ``metrics-retired.json``, so counters never go back and the directory
+    doesn't grow with every worker restart.
+    """
+
+    RETIRED = "metrics-retired.json"
+
+    def __init__(self):
+        self.directory: Optional[str] = None
+        self.interval = 5.0
+        self.pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+
+    def configure(self, directory: Optional[str], interval: float) -> None:
+        self.directory, self.interval = directory, interval
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.start()
+
+    def start(self) -> None:
+        """Start the flush thread in this process."""
+        with self._lock:
+            if not self.directory or self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            with self._directory_lock():
+                # A process that reuses an exited one's pid carries its values forward.
+                previous = self._load(self.path) if os.path.exists(self.path) else {}
+            for name, samples in previous.items():
+                if name in REGISTRY:
+                    REGISTRY[name].restore(samples)
+        threading.Thread(target=self._flush_forever, name="metrics-flush", daemon=True).start()
+        atexit.register(self.flush)
+
+    def after_fork(self) -> None:
+        """Start again in a forked child, e.g. a gunicorn worker under --preload.
+
+        The child inherits the parent's values, which the parent's file
+        already counts, and its flush thread doesn't survive the fork.
+        """
+        if not self.directory:
+            return
+        self._lock = threading.Lock()
+        self.pid = None
+        for metric in REGISTRY.values():
+            metric._lock = threading.Lock()
+            metric.values.clear()
+        self.start()
+
+    def _flush_forever(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.directory or self.pid != os.getpid():
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as handle:
+            json.dump(snapshot(), handle)
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def _load(path: str) -> dict:
+        try:
+            with open(path) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return {}
+
+    @contextmanager
+    def _directory_lock(self):
+        if fcntl is None:
+            yield False
+            return
+        with open(os.path.join(self.directory, "metrics.lock"), "w") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            yield True
+
+    def _retire_exited(self) -> None:
+        # Called with the directory lock held.
+        exited = []
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+            pid = os.path.basename(path)[len("metrics-"):-len(".json")]
+            if pid.isdigit() and not _alive(int(pid)):
+                exited.append(path)
+        if not exited:
+            return
+        retired = os.path.join(self.directory, self.RETIRED)
+        merged = merge([self._load(retired)] + [self._load(path) for path in exited])
+        with open(f"{retired}.tmp", "w") as handle:
+            json.dump(merged, handle)
+        os.replace(f"{retired}.tmp", retired)
+        for path in exited:
+            for leftover in (path, f"{path}.tmp"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    def collect(self) -> List[dict]:
+        if not self.directory:
+            return [snapshot()]
+        self.flush()
+        # Read under the lock, so no scrape sees a file both retired and still in place.
+        with self._directory_lock() as locked:
+            if locked:
+                self._retire_exited()
+            return [self._load(path) for path in glob.glob(os.path.join(self.directory, "metrics-*.json"))]
+
+
+process_files = _ProcessFiles()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=process_files.after_fork)
+
+
+def time_pool_checkouts(pool) -> None:
+    """Record how long every ``pool.connect()`` waits, including opening new connections."""
+    connect = pool.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            DB_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+    pool.connect = timed_connect
+
+
+def init_metrics(app: Flask) -> None:
+    """Time every request, and serve all metrics at /metrics.
+
+    With METRICS_DIR set, processes share their metrics through files in
+    that directory (use one per deployment, on local disk); set METRICS_TOKEN
+    to require ``Authorization: Bearer <token>`` on scrapes.
+    """
+    process_files.configure(app.config.get("METRICS_DIR"), app.config.get("METRICS_FLUSH_INTERVAL", 5.0))
+    with app.app_context():
+        for engine in db.engines.values():
+            time_pool_checkouts(engine.pool)
+
+    @app.before_request
+    def _start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.get("request_started")
+        if started is not None:
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                         request.endpoint or "<unmatched>", request.method, str(response.status_code))
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        token = current_app.config.get("METRICS_TOKEN")
+        if token and request.headers.get("Authorization") != f"Bearer {token}":
+            abort(401)
+        return Response(render(process_files.collect()), mimetype="text/plain; version=0.0.4")
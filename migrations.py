@@ -0,0 +1,243 @@
+import time
+from datetime import datetime
+from typing import Callable, List, NamedTuple, Optional
+
+from sqlalchemy import bindparam, func, inspect, select, text
+from sqlalchemy.exc import DBAPIError
+
+from duedates import battery_due_on, birthday_doy, warranty_due_on
+from models import db, Customer, RuleWatermark, SchemaMigration, Template, Tenant, User, Watch, normalize_mobile
+from search import ensure_search_index
+from stats import DEFAULT_TENANT_NAME
+
+
+def create_tables() -> List[str]:
+    """Create tables the database doesn't have yet, with their indexes."""
+    existing = set(inspect(db.engine).get_table_names())
+    db.create_all()
+    return [f"created table {table.name}" for table in db.metadata.sorted_tables if table.name not in existing]
+
+
+def add_missing_columns() -> List[str]:
+    """Add model columns that an existing database is missing.
+
+    ``db.create_all()`` only creates whole tables, so columns added to a model
+    later never reach a database created before them. New columns are added
+    as nullable; returns a description of every change made.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    changes = []
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+                changes.append(f"added column {table.name}.{column.name}")
+    return changes
+
+
+def create_missing_indexes() -> List[str]:
+    """Create every index declared on the models that the database lacks.
+
+    Tables the database doesn't have yet are left to ``create_tables``.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    changes = []
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+                    changes.append(f"created index {index.name}")
+    return changes
+
+
+def _backfill(model, key, columns, derive, chunk_size: int) -> int:
+    # Parameters not bound in the WHERE clause become the SET clause.
+    stmt = model.__table__.update().where(key == bindparam("_key"))
+    updated = 0
+    last_key = None
+    while True:
+        query = select(key, *columns).order_by(key).limit(chunk_size)
+        if last_key is not None:
+            query = query.where(key > last_key)
+        rows = db.session.execute(query).all()
+        if not rows:
+            return updated
+        db.session.execute(stmt, [dict(derive(row), _key=row[0]) for row in rows])
+        db.session.commit()
+        updated += len(rows)
+        last_key = rows[-1][0]
+
+
+def backfill_derived_columns(chunk_size: int = 1000) -> int:
+    """Recompute derived columns for every customer and watch, one chunk per commit."""
+    updated = _backfill(
+        Customer, Customer.id, (Customer.purchase_date, Customer.dob, Customer.mobile, Customer.updated_at),
+        lambda row: {
+            # Pass updated_at through so the backfill doesn't count as an edit.
+            "updated_at": row.updated_at,
+            "battery_due_on": battery_due_on(row.purchase_date),
+            "warranty_due_on": warranty_due_on(row.purchase_date),
+            "birthday_doy": birthday_doy(row.dob),
+            "mobile_digits": normalize_mobile(row.mobile),
+        },
+        chunk_size,
+    )
+    updated += _backfill(
+        Watch, Watch.watch_id, (Watch.purchase_date,),
+        lambda row: {
+            "battery_due_on": battery_due_on(row.purchase_date),
+            "warranty_due_on": warranty_due_on(row.purchase_date),
+        },
+        chunk_size,
+    )
+    return updated
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[], List[str]]
+
+
+def _backfill_step() -> List[str]:
+    return [f"backfilled derived columns for {backfill_derived_columns()} rows"]
+
+
+def _template_versions_step() -> List[str]:
+    changes = add_missing_columns()
+    updated = db.session.execute(
+        Template.__table__.update().where(Template.version.is_(None)).values(version=1)
+    ).rowcount
+    db.session.commit()
+    return changes + ([f"set version 1 on {updated} templates"] if updated else [])
+
+
+def _shard_tables_step() -> List[str]:
+    # Watermarks became per tenant. They only let a run skip customers that
+    # can't be newly due, so dropping the old ones just makes the next run
+    # a full evaluation; the ledger still keeps it from sending repeats.
+    changes = []
+    columns = {col["name"] for col in inspect(db.engine).get_columns(RuleWatermark.__tablename__)}
+    if "tenant_id" not in columns:
+        RuleWatermark.__table__.drop(db.engine)
+        changes.append(f"dropped table {RuleWatermark.__tablename__} (watermarks are now per tenant)")
+    return changes + create_tables()
+
+
+def _search_index_step() -> List[str]:
+    return ["customer search index ready"] if ensure_search_index() else []
+
+
+# Append only: a database records the versions it has applied, and every step
+# must be safe to run against a schema that already has its changes, because
+# databases created before versioning start from version 0.
+MIGRATIONS = [
+    Migration(1, "create tables", create_tables),
+    Migration(2, "derived columns and event run ids", add_missing_columns),
+    Migration(3, "backfill derived columns", _backfill_step),
+    Migration(4, "hot-path and derived-column indexes", create_missing_indexes),
+    Migration(5, "customer full-text search index", _search_index_step),
+    Migration(6, "template rule and version columns", _template_versions_step),
+    Migration(7, "per-tenant watermarks and event run shards", _shard_tables_step),
+    Migration(8, "import jobs and import lookup indexes", lambda: create_tables() + create_missing_indexes()),
+    Migration(9, "daily message rollups", create_tables),
+    Migration(10, "reporting index on events", create_missing_indexes),
+    Migration(11, "data versions for page caching", create_tables),
+    Migration(12, "mobile digits without the country code", _backfill_step),
+    Migration(13, "tenant-scoped indexes for event rule candidates", create_missing_indexes),
+    Migration(14, "scanned counts per event run shard", add_missing_columns),
+]
+
+
+def applied_versions() -> List[int]:
+    if not inspect(db.engine).has_table(SchemaMigration.__tablename__):
+        return []
+    return list(db.session.execute(select(SchemaMigration.version).order_by(SchemaMigration.version)).scalars())
+
+
+def schema_version() -> int:
+    return max(applied_versions(), default=0)
+
+
+def pending_migrations() -> List[Migration]:
+    applied = set(applied_versions())
+    return [migration for migration in MIGRATIONS if migration.version not in applied]
+
+
+def upgrade(target: Optional[int] = None, echo: Optional[Callable[[str], None]] = None) -> List[Migration]:
+    """Apply pending migrations in version order, up to ``target`` if given.
+
+    Each version is recorded in ``schema_migrations`` once its step finishes,
+    so an interrupted upgrade resumes from the step that failed.
+    """
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    applied = []
+    for migration in pending_migrations():
+        if target is not None and migration.version > target:
+            break
+        started = time.perf_counter()
+        changes = migration.apply()
+        db.session.add(SchemaMigration(
+            version=migration.version, name=migration.name,
+            applied_at=datetime.utcnow(), seconds=time.perf_counter() - started,
+        ))
+        db.session.commit()
+        applied.append(migration)
+        if echo:
+            echo(f"{migration.version}: {migration.name}")
+            for change in changes:
+                echo(f"    {change}")
+    return applied
+
+
+def check_schema() -> Optional[str]:
+    """Startup check in a single query: a warning if the database is behind the code, else None."""
+    try:
+        current = db.session.execute(select(func.max(SchemaMigration.version))).scalar() or 0
+    except DBAPIError:
+        db.session.rollback()
+        current = 0
+    latest = MIGRATIONS[-1].version
+    if current >= latest:
+        return None
+    return f"Database schema is at version {current}, this code needs {latest}; run `flask init-db`."
+
+
+def bootstrap(admin_email: str = "admin@example.com", admin_password: str = "admin123",
+              echo: Optional[Callable[[str], None]] = None) -> None:
+    """Create the demo shop and its admin user if they don't exist yet."""
+    tenant = Tenant.query.filter_by(name=DEFAULT_TENANT_NAME).first()
+    if not tenant:
+        tenant = Tenant(name=DEFAULT_TENANT_NAME, email="owner@example.com", mobile="9999999999")
+        db.session.add(tenant)
+        db.session.commit()
+        if echo:
+            echo(f"Created tenant {tenant.name!r}")
+    if not User.query.filter_by(email=admin_email).first():
+        admin = User(tenant_id=tenant.tenant_id, email=admin_email, role="owner")
+        admin.set_password(admin_password)
+        db.session.add(admin)
+        db.session.commit()
+        if echo:
+            echo(f"Created admin user {admin_email}")
+
+
+def init_db(echo: Optional[Callable[[str], None]] = None, **bootstrap_options) -> List[Migration]:
+    """Bring the schema up to date and create the demo shop; safe to run on every deploy."""
+    applied = upgrade(echo=echo)
+    bootstrap(echo=echo, **bootstrap_options)
+    return applied
@@ -1,10 +1,40 @@
+import re
 from datetime import date, datetime
+from functools import lru_cache
+from typing import Optional
+
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from duedates import battery_due_on, birthday_doy, warranty_due_on
+from engines import RoutingSession
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+# werkzeug's defaults; override with PASSWORD_HASH_METHOD / PASSWORD_SALT_LENGTH.
+DEFAULT_PASSWORD_HASH_METHOD = "scrypt:32768:8:1"
+DEFAULT_PASSWORD_SALT_LENGTH = 16
+
+# Stored mobile digits leave out this country code; override with MOBILE_COUNTRY_CODE.
+DEFAULT_MOBILE_COUNTRY_CODE = "91"
+NATIONAL_MOBILE_LENGTH = 10
+
+
+def _hash_settings():
+    config = current_app.config if has_app_context() else {}
+    return (config.get("PASSWORD_HASH_METHOD") or DEFAULT_PASSWORD_HASH_METHOD,
+            config.get("PASSWORD_SALT_LENGTH") or DEFAULT_PASSWORD_SALT_LENGTH)
 
-db = SQLAlchemy()
+
+@lru_cache(maxsize=None)
+def _hash_prefix(method: str) -> str:
+    """The parameters werkzeug writes in front of a hash made with ``method``
+    (it fills in defaults, e.g. "pbkdf2" becomes "pbkdf2:sha256:600000")."""
+    return generate_password_hash("", method=method, salt_length=1).split("$", 1)[0]
 
 
 class Tenant(db.Model):
@@ -37,17 +67,32 @@ class User(UserMixin, db.Model):
         return str(self.user_id)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        method, salt_length = _hash_settings()
+        self.password_hash = generate_password_hash(password, method=method, salt_length=salt_length)
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def password_needs_rehash(self) -> bool:
+        """Whether the stored hash was made with other parameters than the configured ones."""
+        method, salt_length = _hash_settings()
+        prefix, _, rest = self.password_hash.partition("$")
+        return prefix != _hash_prefix(method) or len(rest.partition("$")[0]) != salt_length
+
     def __repr__(self) -> str:
         return f"<User {self.user_id} {self.email}>"
 
 
 class Customer(db.Model):
     __tablename__ = "customers"
+    __table_args__ = (
+        # Event rules read a tenant's newly due or recently edited customers
+        # as one range of these, in index order.
+        db.Index("ix_customers_tenant_battery", "tenant_id", "battery_due_on"),
+        db.Index("ix_customers_tenant_warranty", "tenant_id", "warranty_due_on"),
+        db.Index("ix_customers_tenant_birthday", "tenant_id", "birthday_doy"),
+        db.Index("ix_customers_tenant_updated", "tenant_id", "updated_at"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
@@ -55,10 +100,18 @@ class Customer(db.Model):
     purchase_date = db.Column(db.Date, nullable=True)
     model = db.Column(db.String(120), nullable=True)
     mobile = db.Column(db.String(50), nullable=True)
-    email = db.Column(db.String(120), nullable=True)
+    email = db.Column(db.String(120), nullable=True, index=True)
+    # National digits of ``mobile`` (see normalize_mobile), for index-backed prefix search
+    mobile_digits = db.Column(db.String(50), nullable=True, index=True)
+
+    # Derived from dob/purchase_date on every insert/update so reminder rules
+    # can find due customers with an index range scan.
+    battery_due_on = db.Column(db.Date, nullable=True, index=True)
+    warranty_due_on = db.Column(db.Date, nullable=True, index=True)
+    birthday_doy = db.Column(db.SmallInteger, nullable=True, index=True)
 
     # Multi-tenant support (optional for backward compatibility)
-    tenant_id = db.Column(db.Integer, db.ForeignKey("tenants.tenant_id"), nullable=True)
+    tenant_id = db.Column(db.Integer, db.ForeignKey("tenants.tenant_id"), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
@@ -70,16 +123,22 @@ class Customer(db.Model):
 
 class Watch(db.Model):
     __tablename__ = "watches"
+    __table_args__ = (
+        db.Index("ix_watches_tenant_serial", "tenant_id", "serial_no"),
+    )
 
     watch_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     tenant_id = db.Column(db.Integer, db.ForeignKey("tenants.tenant_id"), nullable=False)
-    customer_id = db.Column(db.Integer, db.ForeignKey("customers.id"), nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey("customers.id"), nullable=False, index=True)
     brand = db.Column(db.String(255), nullable=True)
     model_no = db.Column(db.String(255), nullable=True)
     serial_no = db.Column(db.String(255), nullable=True)
     purchase_date = db.Column(db.Date, nullable=True)
     notes = db.Column(db.Text, nullable=True)
 
+    battery_due_on = db.Column(db.Date, nullable=True, index=True)
+    warranty_due_on = db.Column(db.Date, nullable=True, index=True)
+
     tenant = db.relationship("Tenant", backref=db.backref("watches", lazy=True))
     customer = db.relationship("Customer", backref=db.backref("watches", lazy=True))
 
@@ -87,6 +146,42 @@ class Watch(db.Model):
         return f"<Watch {self.watch_id} {self.brand} {self.model_no}>"
 
 
+def normalize_mobile(mobile: Optional[str]) -> Optional[str]:
+    """The national digits of ``mobile``, without the shop's country code.
+
+    "+91 90000 00001", "0091 9000000001", "919000000001" and "9000000001" all
+    give "9000000001", so a search for the local number finds every form.
+    The code is dropped when the number is written internationally ("+" or
+    "00"), or when it leads a number too long to be national.
+    """
+    mobile = (mobile or "").strip()
+    digits = re.sub(r"\D", "", mobile)
+    international = mobile.startswith("+")
+    if digits.startswith("00"):
+        digits, international = digits[2:], True
+    config = current_app.config if has_app_context() else {}
+    code = config.get("MOBILE_COUNTRY_CODE", DEFAULT_MOBILE_COUNTRY_CODE)
+    if code and digits.startswith(code) and (international or len(digits) - len(code) >= NATIONAL_MOBILE_LENGTH):
+        digits = digits[len(code):]
+    return digits or None
+
+
+@event.listens_for(Customer, "before_insert")
+@event.listens_for(Customer, "before_update")
+def _set_customer_derived_columns(mapper, connection, customer):
+    customer.mobile_digits = normalize_mobile(customer.mobile)
+    customer.battery_due_on = battery_due_on(customer.purchase_date)
+    customer.warranty_due_on = warranty_due_on(customer.purchase_date)
+    customer.birthday_doy = birthday_doy(customer.dob)
+
+
+@event.listens_for(Watch, "before_insert")
+@event.listens_for(Watch, "before_update")
+def _set_watch_due_dates(mapper, connection, watch):
+    watch.battery_due_on = battery_due_on(watch.purchase_date)
+    watch.warranty_due_on = warranty_due_on(watch.purchase_date)
+
+
 class Service(db.Model):
     __tablename__ = "services"
 
@@ -108,9 +203,13 @@ class Template(db.Model):
     __tablename__ = "templates"
 
     template_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    tenant_id = db.Column(db.Integer, db.ForeignKey("tenants.tenant_id"), nullable=False)
+    tenant_id = db.Column(db.Integer, db.ForeignKey("tenants.tenant_id"), nullable=False, index=True)
     name = db.Column(db.String(255), nullable=False)
     content = db.Column(db.Text, nullable=False)
+    # Rule whose messages this template replaces; None for templates kept for reference only.
+    event_type = db.Column(db.String(50), nullable=True)
+    # Bumped on every content change; compiled templates are cached per version.
+    version = db.Column(db.Integer, default=1, nullable=False)
 
     tenant = db.relationship("Tenant", backref=db.backref("templates", lazy=True))
 
@@ -120,6 +219,13 @@ class Template(db.Model):
 
 class Event(db.Model):
     __tablename__ = "events"
+    __table_args__ = (
+        db.Index("ix_events_run_customer", "run_id", "customer_id"),
+        db.Index("ix_events_customer_type", "customer_id", "event_type"),
+        db.Index("ix_events_sent_at", "sent_at"),
+        # Covers the reporting API's GROUP BY queries, which then never read the table.
+        db.Index("ix_events_tenant_report", "tenant_id", "sent_at", "event_type", "channel", "status"),
+    )
 
     event_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     tenant_id = db.Column(db.Integer, db.ForeignKey("tenants.tenant_id"), nullable=True)
@@ -130,6 +236,7 @@ class Event(db.Model):
     scheduled_at = db.Column(db.DateTime, nullable=True)
     sent_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=True)
     status = db.Column(db.String(20), default="sent", nullable=False)
+    run_id = db.Column(db.Integer, db.ForeignKey("event_runs.run_id"), nullable=True)
 
     tenant = db.relationship("Tenant")
     customer = db.relationship("Customer")
@@ -141,6 +248,12 @@ class Event(db.Model):
 
 class MessageLog(db.Model):
     __tablename__ = "message_logs"
+    __table_args__ = (
+        db.Index("ix_message_logs_run_customer", "run_id", "customer_id"),
+        # Reports page and export order by (sent_at, id) newest first.
+        db.Index("ix_message_logs_sent_at_id", "sent_at", "id"),
+        db.Index("ix_message_logs_customer_id", "customer_id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, db.ForeignKey("customers.id"), nullable=False)
@@ -148,8 +261,220 @@ class MessageLog(db.Model):
     message = db.Column(db.Text, nullable=False)
     sent_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     status = db.Column(db.String(40), default="sent", nullable=False)
+    run_id = db.Column(db.Integer, db.ForeignKey("event_runs.run_id"), nullable=True)
 
     customer = db.relationship("Customer", backref=db.backref("messages", lazy=True))
 
     def __repr__(self) -> str:
         return f"<MessageLog {self.id} customer={self.customer_id} event={self.event_type}>"
+
+
+class EventRun(db.Model):
+    __tablename__ = "event_runs"
+
+    run_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    tenant_id = db.Column(db.Integer, db.ForeignKey("tenants.tenant_id"), nullable=True)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # pending -> running (evaluating rules) -> dispatching (draining the outbox) -> completed
+    status = db.Column(db.String(20), default="pending", nullable=False)
+    messages = db.Column(db.Integer, default=0, nullable=False)
+    rows_written = db.Column(db.Integer, default=0, nullable=False)
+    write_seconds = db.Column(db.Float, default=0.0, nullable=False)
+
+    tenant = db.relationship("Tenant")
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows_written / self.write_seconds if self.write_seconds else 0.0
+
+    def __repr__(self) -> str:
+        return f"<EventRun {self.run_id} {self.status} messages={self.messages}>"
+
+
+class EventRunShard(db.Model):
+    """One slice of an event run: a tenant's customers, or an id range of them."""
+
+    __tablename__ = "event_run_shards"
+
+    shard_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    run_id = db.Column(db.Integer, db.ForeignKey("event_runs.run_id"), nullable=False, index=True)
+    tenant_id = db.Column(db.Integer, db.ForeignKey("tenants.tenant_id"), nullable=False)
+    # Customer ids in [first_id, end_id); None leaves that end open.
+    first_id = db.Column(db.Integer, nullable=True)
+    end_id = db.Column(db.Integer, nullable=True)
+    # Also covers customers created before tenants were stamped on them.
+    include_untenanted = db.Column(db.Boolean, default=False, nullable=False)
+    # pending -> running -> completed | failed
+    status = db.Column(db.String(20), default="pending", nullable=False)
+    messages = db.Column(db.Integer, default=0, nullable=False)
+    rows_written = db.Column(db.Integer, default=0, nullable=False)
+    write_seconds = db.Column(db.Float, default=0.0, nullable=False)
+    seconds = db.Column(db.Float, default=0.0, nullable=False)
+    # Candidate customers read per rule, {rule key: count}
+    scanned = db.Column(db.JSON, nullable=True)
+    worker_pid = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+
+    run = db.relationship("EventRun", backref=db.backref("shards", lazy=True))
+
+    def __repr__(self) -> str:
+        return f"<EventRunShard {self.shard_id} run={self.run_id} tenant={self.tenant_id} {self.status}>"
+
+
+class EventLedger(db.Model):
+    """One row per message that has been issued, so a rule never fires twice for the same period."""
+
+    __tablename__ = "event_ledger"
+    __table_args__ = (
+        db.UniqueConstraint("customer_id", "event_type", "period", name="uq_event_ledger_customer_type_period"),
+    )
+
+    ledger_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey("customers.id"), nullable=False)
+    event_type = db.Column(db.String(50), nullable=False)
+    period = db.Column(db.String(20), nullable=False)
+    run_id = db.Column(db.Integer, db.ForeignKey("event_runs.run_id"), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<EventLedger {self.customer_id} {self.event_type} {self.period}>"
+
+
+class RuleWatermark(db.Model):
+    """Start of the last successful evaluation of each rule for each tenant."""
+
+    __tablename__ = "rule_watermarks"
+
+    tenant_id = db.Column(db.Integer, db.ForeignKey("tenants.tenant_id"), primary_key=True)
+    event_type = db.Column(db.String(50), primary_key=True)
+    last_run_on = db.Column(db.Date, nullable=False)
+    last_started_at = db.Column(db.DateTime, nullable=False)
+    run_id = db.Column(db.Integer, db.ForeignKey("event_runs.run_id"), nullable=True)
+
+    def __repr__(self) -> str:
+        return f"<RuleWatermark {self.tenant_id} {self.event_type} {self.last_run_on}>"
+
+
+class Outbox(db.Model):
+    """Messages queued by an event run, delivered by the dispatcher.
+
+    Rows are written in the same transaction as their Event/MessageLog, which
+    start out "queued" and get their final status once delivery succeeds or
+    runs out of attempts.
+    """
+
+    __tablename__ = "outbox"
+    __table_args__ = (
+        db.Index("ix_outbox_status_next_attempt", "status", "next_attempt_at"),
+        db.Index("ix_outbox_run_status", "run_id", "status"),
+    )
+
+    outbox_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    run_id = db.Column(db.Integer, db.ForeignKey("event_runs.run_id"), nullable=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey("customers.id"), nullable=False)
+    event_type = db.Column(db.String(50), nullable=False)
+    channel = db.Column(db.String(20), nullable=False)
+    recipient = db.Column(db.String(255), nullable=True)
+    subject = db.Column(db.String(255), nullable=True)
+    body = db.Column(db.Text, nullable=False)
+    # pending -> sending -> sent | failed; failed attempts go back to pending until max attempts
+    status = db.Column(db.String(20), default="pending", nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    claimed_by = db.Column(db.String(64), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self) -> str:
+        return f"<Outbox {self.outbox_id} {self.channel} {self.status}>"
+
+
+class TenantStats(db.Model):
+    """Running row counts per tenant, maintained alongside the inserts they count."""
+
+    __tablename__ = "tenant_stats"
+
+    tenant_id = db.Column(db.Integer, db.ForeignKey("tenants.tenant_id"), primary_key=True)
+    customers = db.Column(db.Integer, default=0, nullable=False)
+    watches = db.Column(db.Integer, default=0, nullable=False)
+    events = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<TenantStats {self.tenant_id} customers={self.customers} watches={self.watches} events={self.events}>"
+
+
+class DataVersion(db.Model):
+    """Bumped with every write to a kind of row ("customers", "watches", "templates", "messages") of a tenant.
+
+    Pages derive their ETags and fragment cache keys from these.
+    """
+
+    __tablename__ = "data_versions"
+
+    tenant_id = db.Column(db.Integer, db.ForeignKey("tenants.tenant_id"), primary_key=True)
+    scope = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<DataVersion {self.tenant_id} {self.scope} v{self.version}>"
+
+
+class MessageDailyStats(db.Model):
+    """Messages per tenant and day, rolled up from events before they are archived."""
+
+    __tablename__ = "message_daily_stats"
+
+    tenant_id = db.Column(db.Integer, db.ForeignKey("tenants.tenant_id"), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    event_type = db.Column(db.String(50), primary_key=True)
+    channel = db.Column(db.String(20), primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    messages = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<MessageDailyStats {self.tenant_id} {self.day} {self.event_type} {self.channel} {self.status}>"
+
+
+class ImportJob(db.Model):
+    """Progress of a bulk import, checkpointed with every committed chunk."""
+
+    __tablename__ = "import_jobs"
+
+    job_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(20), nullable=False)  # customers | watches
+    tenant_id = db.Column(db.Integer, db.ForeignKey("tenants.tenant_id"), nullable=False)
+    source = db.Column(db.String(1024), nullable=False)
+    # Size and mtime of the source, so a changed file is never resumed into
+    fingerprint = db.Column(db.String(64), nullable=False)
+    # running -> completed | failed
+    status = db.Column(db.String(20), default="running", nullable=False)
+    rows_done = db.Column(db.Integer, default=0, nullable=False)
+    inserted = db.Column(db.Integer, default=0, nullable=False)
+    updated = db.Column(db.Integer, default=0, nullable=False)
+    rejected = db.Column(db.Integer, default=0, nullable=False)
+    seconds = db.Column(db.Float, default=0.0, nullable=False)
+    error = db.Column(db.Text, nullable=True)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<ImportJob {self.job_id} {self.kind} {self.status} rows={self.rows_done}>"
+
+
+class SchemaMigration(db.Model):
+    """Versions applied by ``migrations.upgrade()``."""
+
+    __tablename__ = "schema_migrations"
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(255), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    seconds = db.Column(db.Float, default=0.0, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<SchemaMigration {self.version} {self.name}>"
@@ -0,0 +1,171 @@
+"""Conditional GETs and rendered-fragment caching for the list pages.
+
+Every write to customers, watches, templates or message logs bumps its
+tenant's version of that scope in ``data_versions``, in the same
+transaction. Pages derive an ETag from the versions of the scopes they
+show, so a client revalidating an unchanged page gets a 304 before the
+view runs, and their tables are rendered once per (tenant, versions,
+request args) into a bounded LRU cache.
+
+Versions are read through a per-process cache for DATA_VERSION_TTL
+seconds. Commits in this process drop it at once; writes in other
+processes (event runs, imports, the dispatcher) show within the TTL.
+"""
+import glob
+import hashlib
+import os
+from datetime import datetime
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import Flask, Response, current_app, make_response, request, session
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy import event, func, select
+
+from cache import LRUCache, TTLCache
+from engines import RoutingSession
+from models import db, Customer, DataVersion, MessageLog, Template, Tenant, Watch
+from stats import DEFAULT_TENANT_NAME
+
+
+SCOPES = {Customer: "customers", Watch: "watches", Template: "templates", MessageLog: "messages"}
+
+version_cache = TTLCache()
+fragment_cache = LRUCache(maxsize=256)
+
+
+def bump_versions(tenant_id: Optional[int], *scopes: str, connection=None) -> None:
+    """Bump ``tenant_id``'s version of ``scopes`` inside the caller's transaction.
+
+    None bumps every tenant, for writes that don't know whose rows they
+    touched. Runs on ``connection`` if given (mapper events), else on the session.
+    """
+    executor = connection if connection is not None else db.session
+    table = DataVersion.__table__
+    now = datetime.utcnow()
+    bump = table.update().where(table.c.scope.in_(scopes)).values(version=table.c.version + 1, changed_at=now)
+    db.session.info.setdefault("bumped_versions", set()).add(tenant_id)
+    if tenant_id is None:
+        if executor.execute(bump).rowcount:
+            return
+        # Nothing to bump yet: start the demo shop's versions.
+        tenant_id = executor.execute(select(Tenant.tenant_id).where(Tenant.name == DEFAULT_TENANT_NAME)).scalar()
+        if tenant_id is None:
+            return
+    if executor.execute(bump.where(table.c.tenant_id == tenant_id)).rowcount < len(scopes):
+        present = set(executor.execute(
+            select(table.c.scope).where(table.c.tenant_id == tenant_id, table.c.scope.in_(scopes))
+        ).scalars())
+        executor.execute(table.insert(), [
+            {"tenant_id": tenant_id, "scope": scope, "version": 1, "changed_at": now}
+            for scope in scopes if scope not in present
+        ])
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _drop_committed_versions(session):
+    if session.info.pop("bumped_versions", None):
+        # Other tenants' writes also move the all-tenant sums.
+        version_cache.invalidate()
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _forget_rolled_back_versions(session):
+    session.info.pop("bumped_versions", None)
+
+
+def _bump_for_row(mapper, connection, target):
+    bump_versions(getattr(target, "tenant_id", None), SCOPES[mapper.class_], connection=connection)
+
+
+for _model in SCOPES:
+    for _event in ("after_insert", "after_update", "after_delete"):
+        event.listen(_model, _event, _bump_for_row)
+
+
+def data_versions(tenant_id: Optional[int] = None) -> Dict[str, Tuple[int, Optional[datetime]]]:
+    """``{scope: (version, changed_at)}`` for ``tenant_id``, or summed over every tenant for None."""
+
+    def load():
+        if tenant_id is None:
+            stmt = select(DataVersion.scope, func.sum(DataVersion.version), func.max(DataVersion.changed_at)) \
+                .group_by(DataVersion.scope)
+        else:
+            stmt = select(DataVersion.scope, DataVersion.version, DataVersion.changed_at) \
+                .where(DataVersion.tenant_id == tenant_id)
+        return {scope: (int(version), changed_at) for scope, version, changed_at in db.session.execute(stmt)}
+
+    return version_cache.get(tenant_id, load, ttl=current_app.config.get("DATA_VERSION_TTL", 2))
+
+
+def _stamp(scopes: Tuple[str, ...], per_tenant: bool) -> Tuple[Tuple[int, ...], Optional[datetime]]:
+    versions = data_versions(current_user.tenant_id if per_tenant else None)
+    stamps = [versions.get(scope, (0, None)) for scope in scopes]
+    return tuple(version for version, _ in stamps), max((at for _, at in stamps if at), default=None)
+
+
+def page_versions(*scopes: str, per_tenant: bool = False) -> Tuple[int, ...]:
+    """The versions of ``scopes`` that ``conditional_page`` derives the ETag from."""
+    return _stamp(scopes, per_tenant)[0]
+
+
+def _args_key() -> tuple:
+    return tuple(sorted(request.args.items(multi=True)))
+
+
+def conditional_page(*scopes: str, per_tenant: bool = False):
+    """Give a page an ETag and Last-Modified from the versions of ``scopes``, and answer
+    a matching If-None-Match with 304 without running the view.
+
+    ``per_tenant`` pages only show the current shop's rows; the others list
+    every shop's, so any tenant's write changes them. Requests with flash
+    messages waiting are always rendered, so the messages aren't lost.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not current_user.is_authenticated or "_flashes" in session:
+                return view(*args, **kwargs)
+            versions, modified = _stamp(scopes, per_tenant)
+            key = repr((current_app.config.get("PAGE_CACHE_SALT"), request.endpoint, current_user.get_id(),
+                        _args_key(), versions))
+            etag = hashlib.sha1(key.encode()).hexdigest()[:24]
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # Revalidation goes by the ETag: Last-Modified only has whole seconds.
+            response.last_modified = modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add("Cookie")
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def cached_fragment(name: str, scopes: Tuple[str, ...], render: Callable[[], str], per_tenant: bool = False) -> Markup:
+    """``render()``'s HTML from the fragment cache, keyed by tenant, the versions of ``scopes`` and the request args."""
+    versions, _ = _stamp(scopes, per_tenant)
+    key = (current_user.tenant_id, name, versions, _args_key())
+    return fragment_cache.get(key, lambda: Markup(render()), ttl=current_app.config.get("FRAGMENT_CACHE_TTL", 300))
+
+
+def _source_stamp(root: str) -> str:
+    # Changes with every deploy of new code or templates, and matches across workers.
+    files = sorted(glob.glob(os.path.join(root, "*.py")) + glob.glob(os.path.join(root, "*.html")))
+    return hashlib.sha1(repr([(os.path.basename(f), os.path.getmtime(f)) for f in files]).encode()).hexdigest()[:12]
+
+
+def init_page_cache(app: Flask) -> None:
+    """Size the fragment cache and salt ETags, so a deploy invalidates pages cached by browsers."""
+    fragment_cache.maxsize = app.config.get("FRAGMENT_CACHE_SIZE", 256)
+    if not app.config.get("PAGE_CACHE_SALT"):
+        app.config["PAGE_CACHE_SALT"] = _source_stamp(app.root_path)
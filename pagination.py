@@ -0,0 +1,114 @@
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from flask import abort, current_app, request, url_for
+from sqlalchemy import and_, or_
+
+
+@dataclass
+class Page:
+    items: list
+    page_size: int
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+    def urls(self, endpoint: str, **args) -> Tuple[Optional[str], Optional[str]]:
+        """``(next_url, prev_url)`` for ``endpoint``, keeping ``args`` such as the search term."""
+        args = {key: value for key, value in args.items() if value}
+        if self.page_size != current_app.config.get("PAGE_SIZE", 50):
+            args["per_page"] = self.page_size
+        next_url = url_for(endpoint, after=self.next_cursor, **args) if self.next_cursor else None
+        prev_url = url_for(endpoint, before=self.prev_cursor, **args) if self.prev_cursor else None
+        return next_url, prev_url
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"d": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.fromisoformat(value["dt"])
+        if "d" in value:
+            return date.fromisoformat(value["d"])
+    return value
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps([_encode_value(value) for value in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str, size: int) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = [_decode_value(value) for value in json.loads(raw)]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        abort(400, "Invalid page cursor.")
+    if len(values) != size:
+        abort(400, "Invalid page cursor.")
+    return values
+
+
+def keyset_filter(columns, values, descending: bool):
+    """Rows strictly after ``values`` in ``(columns...)`` order.
+
+    The OR of ANDs alone makes SQLite scan the index from one end, so the
+    first column also gets a plain range bound that it can seek to.
+    """
+    clauses = []
+    for i, column in enumerate(columns):
+        tail = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*[columns[j] == values[j] for j in range(i)], tail))
+    if len(columns) == 1:
+        return clauses[0]
+    lead = columns[0] <= values[0] if descending else columns[0] >= values[0]
+    return and_(lead, or_(*clauses))
+
+
+def page_size_arg() -> int:
+    default = current_app.config.get("PAGE_SIZE", 50)
+    maximum = current_app.config.get("MAX_PAGE_SIZE", 200)
+    size = request.args.get("per_page", default, type=int)
+    return max(1, min(size, maximum))
+
+
+def keyset_page(query, columns: Sequence, key: Callable[[Any], Sequence[Any]],
+                page_size: Optional[int] = None) -> Page:
+    """Fetch one page of ``query`` ordered newest first by ``columns``.
+
+    ``columns`` must identify rows uniquely (end with the primary key) and
+    ``key(item)`` returns an item's values for them. The page position comes
+    from the ``after``/``before`` cursors in the request, so each page is a
+    bounded index range read however deep it is.
+    """
+    page_size = page_size or page_size_arg()
+    after, before = request.args.get("after"), request.args.get("before")
+    if before:
+        values = decode_cursor(before, len(columns))
+        rows = (query.filter(keyset_filter(columns, values, descending=False))
+                .order_by(*[column.asc() for column in columns]).limit(page_size + 1).all())
+        has_more = len(rows) > page_size
+        items: List[Any] = list(reversed(rows[:page_size]))
+        has_next, has_prev = True, has_more
+    else:
+        if after:
+            query = query.filter(keyset_filter(columns, decode_cursor(after, len(columns)), descending=True))
+        rows = query.order_by(*[column.desc() for column in columns]).limit(page_size + 1).all()
+        items = rows[:page_size]
+        has_next, has_prev = len(rows) > page_size, bool(after)
+    return Page(
+        items=items,
+        page_size=page_size,
+        next_cursor=encode_cursor(key(items[-1])) if items and has_next else None,
+        prev_cursor=encode_cursor(key(items[0])) if items and has_prev else None,
+    )
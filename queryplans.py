@@ -0,0 +1,107 @@
+import re
+from datetime import date, datetime
+from typing import Dict, List, Tuple
+
+from sqlalchemy import and_, select
+
+from export import export_query
+from models import db, Customer, Event, EventLedger, MessageLog, Outbox, RuleWatermark, Template, Watch
+from pagination import keyset_filter
+from reporting import ReportQuery, report_statements
+from retention import outbox_purge_query, retention_query
+from rules import RULES, candidate_passes, chunk_statement
+
+
+# "SCAN t" without "USING ... INDEX" reads the whole table.
+FULL_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW)(\S+)(?!.*USING)")
+# Any "SCAN t", even "USING INDEX", walks t from one end of the index.
+ANY_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW)")
+
+# Queries filtered to a key range; reading it must be a SEARCH whose cost
+# doesn't grow with the rows outside the range.
+RANGE_QUERIES = {"reports next page", "reports previous page", "reports export by date", "watches next page"}
+
+# Reading every customer of a tenant through the tenant_id index alone; the
+# "rule ..." queries must range over a (tenant_id, due column) index instead.
+TENANT_SCAN = re.compile(r"INDEX ix_customers_tenant_id \(tenant_id=\?")
+
+
+def hot_queries() -> Dict[str, object]:
+    """The statements behind the list views, the event run and the dispatcher.
+
+    Parameter values are placeholders; SQLite plans don't depend on them.
+    """
+    today = date(2024, 1, 1)
+    moment = datetime(2024, 1, 1, 12, 0)
+    log_key = [MessageLog.sent_at, MessageLog.id]
+    queries = {
+        "reports page": select(MessageLog).order_by(MessageLog.sent_at.desc(), MessageLog.id.desc()).limit(51),
+        "reports next page": (
+            select(MessageLog).where(keyset_filter(log_key, [moment, 100], descending=True))
+            .order_by(MessageLog.sent_at.desc(), MessageLog.id.desc()).limit(51)
+        ),
+        "reports previous page": (
+            select(MessageLog).where(keyset_filter(log_key, [moment, 100], descending=False))
+            .order_by(MessageLog.sent_at, MessageLog.id).limit(51)
+        ),
+        "reports export by date": export_query({"start": "2024-01-01", "end": "2024-01-31"})
+        .order_by(MessageLog.sent_at.desc(), MessageLog.id.desc()),
+        "customer messages": select(MessageLog).where(MessageLog.customer_id == 1),
+        "recent events": select(Event).order_by(Event.sent_at.desc()).limit(5),
+        "customer events by type": select(Event).where(Event.customer_id == 1, Event.event_type == "battery"),
+        "customer watches": select(Watch).where(Watch.customer_id == 1),
+        "watches next page": (
+            select(Watch).join(Customer).where(Watch.watch_id < 100).order_by(Watch.watch_id.desc()).limit(51)
+        ),
+        "tenant customers": select(Customer).where(Customer.tenant_id == 1),
+        "tenant templates": select(Template).where(Template.tenant_id == 1),
+        "ledger lookup": select(EventLedger.customer_id, EventLedger.period).where(
+            EventLedger.event_type == "battery", EventLedger.customer_id.in_([1, 2, 3]),
+            EventLedger.period.in_(["2024-01-01"]),
+        ),
+        "outbox due": (
+            select(Outbox.outbox_id).where(Outbox.status == "pending", Outbox.next_attempt_at <= moment)
+            .order_by(Outbox.next_attempt_at, Outbox.outbox_id).limit(100)
+        ),
+        "report by type and day": report_statements(
+            1, ReportQuery(today, today, ("event_type", "status", "channel"), "day"), include_untenanted=True)[0],
+        "retention events chunk": retention_query(Event, moment, (moment, 100)),
+        "retention logs chunk": retention_query(MessageLog, moment, (moment, 100)),
+        "retention outbox chunk": outbox_purge_query(moment),
+    }
+    # Each rule's candidate queries on a re-run of one tenant the day after
+    # the last one, in the same week, past the first chunk.
+    rerun_day = date(2024, 1, 2)
+    watermark = RuleWatermark(last_run_on=today, last_started_at=moment)
+    placeholders = {"id": 100, "updated_at": moment, "battery_due_on": today, "warranty_due_on": today}
+    for rule in RULES:
+        for where, order in candidate_passes(rule, rerun_day, watermark):
+            kind = "edited" if order[0] is Customer.updated_at else "newly due"
+            after = [placeholders[column.key] for column in order]
+            queries[f"rule {rule.key} {kind}"] = chunk_statement(and_(Customer.tenant_id == 1, where), order, after)
+    return queries
+
+
+def explain(stmt) -> List[str]:
+    """SQLite's EXPLAIN QUERY PLAN for ``stmt``, one line per plan step."""
+    compiled = stmt.compile(dialect=db.engine.dialect, compile_kwargs={"render_postcompile": True})
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params).all()
+    return [row[-1] for row in rows]
+
+
+def check_query_plans() -> List[Tuple[str, List[str], List[str]]]:
+    """Plan every hot query; returns ``(name, plan, bad_scans)`` for each.
+
+    Bad scans are full table scans, for RANGE_QUERIES any index scan too,
+    and for the rule queries a walk of the tenant's customers.
+    """
+    results = []
+    for name, stmt in hot_queries().items():
+        plan = explain(stmt)
+        pattern = ANY_SCAN if name in RANGE_QUERIES else FULL_SCAN
+        scans = [line for line in plan if pattern.match(line)
+                 or (name.startswith("rule ") and TENANT_SCAN.search(line))]
+        results.append((name, plan, scans))
+    return results
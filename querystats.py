@@ -0,0 +1,115 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+from flask import Flask, current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class _Counter:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: List[str] = []
+
+
+# Counters opened by count_queries(); every statement is added to each of them.
+_active_counters: List[_Counter] = []
+_counters_lock = threading.Lock()
+
+# Per-endpoint totals since process start.
+endpoint_stats: Dict[str, Dict[str, float]] = {}
+_endpoint_lock = threading.Lock()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    if has_app_context():
+        g.query_count = g.get("query_count", 0) + 1
+        g.query_seconds = g.get("query_seconds", 0.0) + elapsed
+    if _active_counters:
+        with _counters_lock:
+            for counter in _active_counters:
+                counter.count += 1
+                counter.seconds += elapsed
+                counter.statements.append(statement)
+
+
+def query_budget(max_queries: int):
+    """Declare the most SQL statements one request to this view may run."""
+
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+
+    return decorator
+
+
+@contextmanager
+def count_queries() -> Iterator[_Counter]:
+    """Count the statements executed (by any thread) inside the block."""
+    counter = _Counter()
+    with _counters_lock:
+        _active_counters.append(counter)
+    try:
+        yield counter
+    finally:
+        with _counters_lock:
+            _active_counters.remove(counter)
+
+
+def init_query_stats(app: Flask) -> None:
+    """Record query count and SQL time per request and per endpoint.
+
+    With QUERY_STATS_HEADERS (on by default in debug) every response carries
+    X-Query-Count and X-Query-Time-Ms. A request that goes over its view's
+    ``query_budget`` is logged, and raises QueryBudgetExceeded when
+    QUERY_BUDGET_STRICT is set, as bench.py does for every budgeted view.
+    """
+
+    @app.before_request
+    def _reset_query_stats():
+        g.query_count = 0
+        g.query_seconds = 0.0
+
+    @app.after_request
+    def _record_query_stats(response):
+        count = g.get("query_count", 0)
+        seconds = g.get("query_seconds", 0.0)
+        endpoint = request.endpoint or "<unmatched>"
+        with _endpoint_lock:
+            stats = endpoint_stats.setdefault(
+                endpoint, {"requests": 0, "queries": 0, "seconds": 0.0, "max_queries": 0}
+            )
+            stats["requests"] += 1
+            stats["queries"] += count
+            stats["seconds"] += seconds
+            stats["max_queries"] = max(stats["max_queries"], count)
+
+        show_headers = current_app.config.get("QUERY_STATS_HEADERS")
+        if show_headers is None:
+            show_headers = current_app.debug
+        if show_headers:
+            response.headers["X-Query-Count"] = str(count)
+            response.headers["X-Query-Time-Ms"] = f"{seconds * 1000:.2f}"
+
+        view = current_app.view_functions.get(request.endpoint)
+        budget = getattr(view, "query_budget", None)
+        if budget is not None and count > budget:
+            message = f"{endpoint} ran {count} queries, over its budget of {budget}"
+            if current_app.config.get("QUERY_BUDGET_STRICT"):
+                raise QueryBudgetExceeded(message)
+            current_app.logger.warning(message)
+        return response
@@ -0,0 +1,145 @@
+"""Message counts by rule, status, channel and day or week, for the reporting API.
+
+Counts come from GROUP BY queries over the live events plus the daily
+rollups of archived ones (see retention.py), so a report covers the whole
+history whatever has been archived. Results are cached per tenant and
+parameters, stamped with the tenant's event counter: writing new events
+bumps it, so the next request recomputes, in whichever process it lands.
+"""
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from flask import abort, current_app
+from sqlalchemy import func, or_, select
+
+from cache import LRUCache
+from models import db, Event, MessageDailyStats, TenantStats
+from stats import default_tenant_id
+
+
+DIMENSIONS = ("event_type", "status", "channel")
+PERIODS = ("day", "week")
+
+DEFAULT_REPORT_DAYS = 30
+
+report_cache = LRUCache(maxsize=512)
+
+
+class ReportQuery(NamedTuple):
+    start: date
+    end: date
+    group_by: Tuple[str, ...]
+    period: Optional[str]
+
+
+def _parse_day(value: str, name: str) -> date:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        abort(400, f"{name} must be a YYYY-MM-DD date.")
+
+
+def report_query(args, today: Optional[date] = None) -> ReportQuery:
+    """Parse and validate request ``args``: ``start``/``end`` (inclusive days, default
+    the last 30), ``group_by`` (comma-separated dimensions) and ``period``."""
+    end = _parse_day(args["end"], "end") if args.get("end") else today or date.today()
+    start = _parse_day(args["start"], "start") if args.get("start") else end - timedelta(days=DEFAULT_REPORT_DAYS - 1)
+    if start > end:
+        abort(400, "start must not be after end.")
+    group_by = tuple(name for name in (args.get("group_by") or "").split(",") if name)
+    unknown = [name for name in group_by if name not in DIMENSIONS]
+    if unknown:
+        abort(400, f"group_by accepts {', '.join(DIMENSIONS)}; got {', '.join(unknown)}.")
+    period = args.get("period") or None
+    if period is not None and period not in PERIODS:
+        abort(400, f"period must be one of {', '.join(PERIODS)}.")
+    # Same report, same cache key, whatever order the dimensions came in.
+    return ReportQuery(start, end, tuple(name for name in DIMENSIONS if name in group_by), period)
+
+
+def _bucket(day, period: str) -> str:
+    day = day if isinstance(day, date) else date.fromisoformat(str(day)[:10])
+    if period == "week":
+        day -= timedelta(days=day.weekday())
+    return day.isoformat()
+
+
+def report_statements(tenant_id: int, query: ReportQuery, include_untenanted: bool = False):
+    """The GROUP BY statements over live events and over the archived events' rollups."""
+    live_dims = [getattr(Event, name) for name in query.group_by]
+    rollup_dims = [getattr(MessageDailyStats, name) for name in query.group_by]
+    if query.period:
+        live_dims.append(func.date(Event.sent_at))
+        rollup_dims.append(MessageDailyStats.day)
+
+    owner = Event.tenant_id == tenant_id
+    if include_untenanted:
+        owner = or_(owner, Event.tenant_id.is_(None))
+    live = (
+        select(*live_dims, func.count())
+        .where(owner, Event.sent_at >= datetime.combine(query.start, datetime.min.time()),
+               Event.sent_at < datetime.combine(query.end + timedelta(days=1), datetime.min.time()))
+        .group_by(*live_dims)
+    )
+    archived = (
+        select(*rollup_dims, func.sum(MessageDailyStats.messages))
+        .where(MessageDailyStats.tenant_id == tenant_id,
+               MessageDailyStats.day >= query.start, MessageDailyStats.day <= query.end)
+        .group_by(*rollup_dims)
+    )
+    return live, archived
+
+
+def message_counts(tenant_id: int, query: ReportQuery) -> List[dict]:
+    """Messages per combination of ``query.group_by`` values, and per period if asked:
+    in period order, or largest groups first without one."""
+    # Events written before tenants were stamped on them belong to the demo shop.
+    statements = report_statements(tenant_id, query, include_untenanted=tenant_id == default_tenant_id())
+
+    counts: Counter = Counter()
+    for stmt in statements:
+        for *key, count in db.session.execute(stmt):
+            if query.period:
+                key[-1] = _bucket(key[-1], query.period)
+            counts[tuple(key)] += int(count or 0)
+
+    names = list(query.group_by) + ([query.period] if query.period else [])
+    rows = [dict(zip(names, key), messages=count) for key, count in counts.items()]
+    if query.period:
+        rows.sort(key=lambda row: (row[query.period],) + tuple(str(row[name]) for name in query.group_by))
+    else:
+        rows.sort(key=lambda row: (-row["messages"],) + tuple(str(row[name]) for name in query.group_by))
+    return rows
+
+
+def data_stamp(tenant_id: int) -> Tuple[int, Optional[datetime]]:
+    """The tenant's event counter and its last change, bumped with every chunk of events written."""
+    row = db.session.execute(
+        select(TenantStats.events, TenantStats.updated_at).where(TenantStats.tenant_id == tenant_id)
+    ).first()
+    return tuple(row) if row else (0, None)
+
+
+def cached_message_counts(tenant_id: int, query: ReportQuery) -> Dict[str, object]:
+    """``message_counts`` from the report cache, for REPORT_CACHE_TTL seconds at most.
+
+    Costs one primary-key lookup on a hit. Status changes made by the
+    dispatcher don't move the stamp, so they show up within the TTL.
+    """
+    stamp = data_stamp(tenant_id)
+
+    def load():
+        # Reports computed before these events were written are dead now.
+        invalidate_reports(tenant_id, keep_stamp=stamp)
+        rows = message_counts(tenant_id, query)
+        return {"rows": rows, "total": sum(row["messages"] for row in rows)}
+
+    return report_cache.get((tenant_id, stamp, query), load, ttl=current_app.config.get("REPORT_CACHE_TTL", 300))
+
+
+def invalidate_reports(tenant_id: Optional[int] = None, keep_stamp=None) -> None:
+    """Drop the cached reports of ``tenant_id`` (every tenant if None), except those for ``keep_stamp``."""
+    report_cache.invalidate_matching(
+        lambda key: (tenant_id is None or key[0] == tenant_id) and (keep_stamp is None or key[1] != keep_stamp)
+    )
@@ -0,0 +1,225 @@
+"""Retention for the append-only message tables.
+
+Events and message logs older than the retention period move out of the
+database into gzip NDJSON files, one per table and day:
+
+    <ARCHIVE_DIR>/<table>/<YYYY-MM>/<YYYY-MM-DD>.ndjson.gz
+
+Events are rolled up into ``message_daily_stats`` as they go, so counts by
+tenant, day, rule, channel and status survive the archive. Rows are moved
+in keyset-ordered chunks, each archived, rolled up and deleted in its own
+short transaction. Messages still queued in the outbox stay put until the
+dispatcher settles them.
+
+Settled outbox rows (sent, or failed for good) from before the cutoff are
+deleted outright: their message is already kept in ``message_logs``.
+"""
+import glob
+import gzip
+import json
+import os
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import and_, select, tuple_
+
+from models import db, Customer, Event, MessageDailyStats, MessageLog, Outbox
+from pagecache import bump_versions
+from stats import default_tenant_id
+
+
+DEFAULT_RETENTION_CHUNK_SIZE = 2000
+
+TABLES = {model.__tablename__: model for model in (Event, MessageLog)}
+
+# The dispatcher never touches outbox rows in these states again.
+SETTLED_OUTBOX_STATUSES = ("sent", "failed")
+
+
+def _key(model):
+    return model.__table__.primary_key.columns.values()[0]
+
+
+def partition_path(archive_dir: str, table: str, day: date) -> str:
+    return os.path.join(archive_dir, table, day.strftime("%Y-%m"), day.isoformat() + ".ndjson.gz")
+
+
+def partitions(archive_dir: str, table: str, start: Optional[date] = None,
+               end: Optional[date] = None) -> List[date]:
+    """Days with an archive file for ``table`` in ``[start, end]``, newest first."""
+    days = []
+    for path in glob.glob(os.path.join(archive_dir, table, "*", "*.ndjson.gz")):
+        day = date.fromisoformat(os.path.basename(path)[:-len(".ndjson.gz")])
+        if (start is None or day >= start) and (end is None or day <= end):
+            days.append(day)
+    return sorted(days, reverse=True)
+
+
+def retention_query(model, cutoff: datetime, after: Optional[tuple] = None, limit: int = DEFAULT_RETENTION_CHUNK_SIZE):
+    """The next chunk of ``model`` rows sent before ``cutoff``, in (sent_at, id) order after ``after``."""
+    key = _key(model)
+    stmt = select(*model.__table__.c).where(model.sent_at < cutoff)
+    if after is not None:
+        stmt = stmt.where(tuple_(model.sent_at, key) > tuple_(*after))
+    return stmt.order_by(model.sent_at, key).limit(limit)
+
+
+def outbox_purge_query(cutoff: datetime, limit: int = DEFAULT_RETENTION_CHUNK_SIZE):
+    """Ids of the next chunk of settled outbox rows last attempted before ``cutoff``."""
+    return (select(Outbox.outbox_id)
+            .where(Outbox.status.in_(SETTLED_OUTBOX_STATUSES), Outbox.next_attempt_at < cutoff)
+            .limit(limit))
+
+
+def _serialize(row: dict) -> str:
+    return json.dumps({k: v.isoformat() if isinstance(v, (date, datetime)) else v for k, v in row.items()},
+                      ensure_ascii=False)
+
+
+def _append(archive_dir: str, table: str, day: date, rows: List[dict]) -> None:
+    path = partition_path(archive_dir, table, day)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Every append is its own gzip member; readers see one stream.
+    with gzip.open(path, "at", encoding="utf-8") as handle:
+        handle.write("".join(_serialize(row) + "\n" for row in rows))
+
+
+def _roll_up(rows: List[dict], default_id: Optional[int]) -> None:
+    counts = Counter(
+        (row["tenant_id"] or default_id, row["sent_at"].date(), row["event_type"], row["channel"], row["status"])
+        for row in rows
+    )
+    table = MessageDailyStats.__table__
+    for (tenant_id, day, event_type, channel, status), count in counts.items():
+        if tenant_id is None:
+            continue
+        key = and_(table.c.tenant_id == tenant_id, table.c.day == day, table.c.event_type == event_type,
+                   table.c.channel == channel, table.c.status == status)
+        result = db.session.execute(table.update().where(key).values(messages=table.c.messages + count))
+        if result.rowcount == 0:
+            db.session.execute(table.insert(), [{
+                "tenant_id": tenant_id, "day": day, "event_type": event_type,
+                "channel": channel, "status": status, "messages": count,
+            }])
+
+
+def archive_table(model, cutoff: datetime, archive_dir: str, chunk_size: int = DEFAULT_RETENTION_CHUNK_SIZE,
+                  echo: Optional[Callable[[str], None]] = None) -> int:
+    """Move ``model`` rows sent before ``cutoff`` to the archive; returns the number moved.
+
+    A chunk whose transaction fails after its files were written is archived
+    again by the next run; ``read_archive`` skips the repeated ids.
+    """
+    table = model.__tablename__
+    key = _key(model)
+    default_id = default_tenant_id() if model is Event else None
+    moved = 0
+    after = None
+    while True:
+        rows = [dict(row) for row in db.session.execute(retention_query(model, cutoff, after, chunk_size)).mappings()]
+        if not rows:
+            return moved
+        after = (rows[-1]["sent_at"], rows[-1][key.name])
+        rows = [row for row in rows if row["status"] != "queued"]
+        if not rows:
+            db.session.rollback()
+            continue
+        by_day: Dict[date, List[dict]] = defaultdict(list)
+        for row in rows:
+            by_day[row["sent_at"].date()].append(row)
+        for day, day_rows in by_day.items():
+            _append(archive_dir, table, day, day_rows)
+        if model is Event:
+            _roll_up(rows, default_id)
+        db.session.execute(model.__table__.delete().where(key.in_([row[key.name] for row in rows])))
+        bump_versions(None, "messages")
+        db.session.commit()
+        moved += len(rows)
+        if echo:
+            echo(f"{table}: archived {moved} rows (through {after[0]:%Y-%m-%d})")
+
+
+def purge_outbox(cutoff: datetime, chunk_size: int = DEFAULT_RETENTION_CHUNK_SIZE,
+                 echo: Optional[Callable[[str], None]] = None) -> int:
+    """Delete settled outbox rows last attempted before ``cutoff``; returns the number deleted.
+
+    Pending and in-flight rows are kept however old they are.
+    """
+    purged = 0
+    while True:
+        ids = db.session.execute(outbox_purge_query(cutoff, chunk_size)).scalars().all()
+        if not ids:
+            db.session.rollback()
+            return purged
+        db.session.execute(Outbox.__table__.delete().where(Outbox.outbox_id.in_(ids)))
+        db.session.commit()
+        purged += len(ids)
+        if echo:
+            echo(f"outbox: purged {purged} settled rows")
+
+
+def apply_retention(days: int, archive_dir: str, chunk_size: int = DEFAULT_RETENTION_CHUNK_SIZE,
+                    today: Optional[date] = None, echo: Optional[Callable[[str], None]] = None) -> Dict[str, int]:
+    """Archive events and message logs from before the last ``days`` days and purge settled
+    outbox rows as old; returns rows removed per table."""
+    cutoff = datetime.combine((today or date.today()) - timedelta(days=days), datetime.min.time())
+    moved = {table: archive_table(model, cutoff, archive_dir, chunk_size, echo) for table, model in TABLES.items()}
+    moved[Outbox.__tablename__] = purge_outbox(cutoff, chunk_size, echo)
+    return moved
+
+
+def read_archive(archive_dir: str, table: str, start: Optional[date] = None, end: Optional[date] = None,
+                 **filters) -> Iterator[dict]:
+    """Archived ``table`` rows from days in ``[start, end]``, newest first.
+
+    ``filters`` keep rows whose columns equal the given values, e.g.
+    ``event_type="battery"``. Each day's file is read on its own, so memory
+    is bounded by the busiest day.
+    """
+    key = _key(TABLES[table]).name
+    filters = {name: value for name, value in filters.items() if value}
+    for day in partitions(archive_dir, table, start, end):
+        rows = {}
+        with gzip.open(partition_path(archive_dir, table, day), "rt", encoding="utf-8") as handle:
+            for line in handle:
+                row = json.loads(line)
+                if all(row.get(name) == value for name, value in filters.items()):
+                    rows[row[key]] = row
+        yield from sorted(rows.values(), key=lambda row: (row["sent_at"], row[key]), reverse=True)
+
+
+def archived_export_rows(archive_dir: str, args) -> Iterator[dict]:
+    """Archived message logs shaped like ``export.iter_rows``, for the same request ``args``."""
+    rows = read_archive(
+        archive_dir, MessageLog.__tablename__,
+        date.fromisoformat(args["start"]) if args.get("start") else None,
+        date.fromisoformat(args["end"]) if args.get("end") else None,
+        event_type=args.get("event_type"), status=args.get("status"),
+    )
+    for batch in _batches(rows, 500):
+        ids = sorted({row["customer_id"] for row in batch})
+        names = dict(db.session.execute(
+            select(Customer.id, Customer.name).where(Customer.id.in_(ids))
+        ).all())
+        for row in batch:
+            yield {
+                "id": row["id"],
+                "customer_id": row["customer_id"],
+                "customer_name": names.get(row["customer_id"]),
+                "event_type": row["event_type"],
+                "message": row["message"],
+                "sent_at": datetime.fromisoformat(row["sent_at"]).isoformat(timespec="seconds"),
+                "status": row["status"],
+            }
+
+
+def _batches(rows: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
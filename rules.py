@@ -0,0 +1,189 @@
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, false, not_, select, true
+from sqlalchemy.sql.elements import False_, True_
+
+from duedates import birthday_doy
+from models import db, Customer, EventLedger, RuleWatermark
+from pagination import keyset_filter
+
+
+# Columns the rules need to build a message; selecting plain tuples keeps
+# ORM identity-map overhead out of large runs.
+MATCH_COLUMNS = (Customer.id, Customer.name, Customer.model, Customer.email, Customer.purchase_date)
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def iso_week(day: date) -> str:
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+@dataclass(frozen=True)
+class Rule:
+    """An event rule.
+
+    ``condition(today)`` selects every customer the rule applies to today.
+    ``newly_due(since, today)`` narrows that to customers who became due after
+    the rule last ran on ``since``; customers edited since then are always
+    reconsidered. ``period(row, today)`` names the occurrence a message
+    belongs to, which the ledger uses to send it at most once. ``message`` is
+    the default message template, used unless the tenant has a Template for
+    the rule. ``due_column`` is the indexed column ``condition`` ranges over;
+    candidates are read in its order, so the tenant's (tenant_id, column)
+    index serves both the filter and the order. Rules matching one value
+    (or everyone) leave it None and are read in id order.
+    """
+
+    key: str
+    description: str
+    channel: str
+    condition: Callable[[date], object]
+    newly_due: Callable[[date, date], object]
+    period: Callable[[tuple, date], str]
+    message: str
+    # Rules with an email subject go out by email when the customer has an address.
+    email_subject: Optional[str] = None
+    due_column: object = field(default=None, compare=False)
+
+
+RULES: List[Rule] = [
+    Rule(
+        key="battery_replacement",
+        description="Battery replacement reminder (18 months after purchase)",
+        channel="whatsapp",
+        condition=lambda today: Customer.battery_due_on <= today,
+        newly_due=lambda since, today: Customer.battery_due_on > since,
+        period=lambda c, today: c.purchase_date.isoformat(),
+        message="Hi {customer_name}, it's been 18 months since your {model} purchase. Time for a battery check!",
+        due_column=Customer.battery_due_on,
+    ),
+    Rule(
+        key="birthday_wishes",
+        description="Birthday wishes",
+        channel="whatsapp",
+        condition=lambda today: Customer.birthday_doy == birthday_doy(today),
+        newly_due=lambda since, today: true() if since != today else false(),
+        period=lambda c, today: str(today.year),
+        message="Happy Birthday, {customer_name}! Wishing you a wonderful year ahead. – Your Watch Retailer",
+        email_subject="Happy Birthday!",
+    ),
+    Rule(
+        key="extended_warranty",
+        description="Extended warranty upsell",
+        channel="whatsapp",
+        condition=lambda today: Customer.warranty_due_on <= today,
+        newly_due=lambda since, today: Customer.warranty_due_on > since,
+        period=lambda c, today: c.purchase_date.isoformat(),
+        message="Hi {customer_name}, extend your warranty for {model} before it expires!",
+        due_column=Customer.warranty_due_on,
+    ),
+    Rule(
+        key="bundling_offers",
+        description="Bundling offers",
+        channel="whatsapp",
+        condition=lambda today: true(),
+        newly_due=lambda since, today: true() if iso_week(since) != iso_week(today) else false(),
+        period=lambda c, today: iso_week(today),
+        message="Exclusive offer for you, {customer_name}: Save on straps and accessories when you visit us this week!",
+    ),
+]
+
+RULES_BY_KEY = {rule.key: rule for rule in RULES}
+
+
+def rules_description() -> List[Tuple[str, str]]:
+    return [(rule.key, rule.description) for rule in RULES]
+
+
+def load_watermarks(tenant_id: int) -> Dict[str, RuleWatermark]:
+    return {mark.event_type: mark for mark in RuleWatermark.query.filter_by(tenant_id=tenant_id)}
+
+
+def candidate_passes(rule: Rule, today: date,
+                     watermark: Optional[RuleWatermark] = None) -> List[Tuple[object, Sequence]]:
+    """``(where, order_columns)`` for each query ``rule`` reads its candidates with on this run.
+
+    Without a usable watermark that is every customer the rule applies to.
+    With one it is two disjoint index ranges: the customers newly due since
+    the last run, and those edited since it started that aren't newly due.
+    An OR of the two could use neither index and would read the whole tenant.
+    """
+    condition = rule.condition(today)
+    due_order = [rule.due_column, Customer.id] if rule.due_column is not None else [Customer.id]
+    if watermark is None or watermark.last_run_on > today:
+        return [(condition, due_order)]
+    newly_due = rule.newly_due(watermark.last_run_on, today)
+    passes = []
+    if not isinstance(newly_due, False_):
+        passes.append((and_(condition, newly_due), due_order))
+    if not isinstance(newly_due, True_):
+        edited = Customer.updated_at >= watermark.last_started_at
+        passes.append((and_(condition, edited, not_(newly_due)), [Customer.updated_at, Customer.id]))
+    return passes
+
+
+def chunk_statement(where, order: Sequence, after: Optional[Sequence] = None, limit: int = DEFAULT_CHUNK_SIZE):
+    """The chunk of candidates matching ``where`` that follows ``after`` in ``order``.
+
+    Rows carry ``order``'s columns after MATCH_COLUMNS, for the next chunk's ``after``.
+    """
+    stmt = select(*MATCH_COLUMNS, *order[:-1]).where(where)
+    if after is not None:
+        stmt = stmt.where(keyset_filter(order, after, descending=False))
+    return stmt.order_by(*order).limit(limit)
+
+
+def iter_matches(rule: Rule, today: date, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 watermark: Optional[RuleWatermark] = None, scope=None) -> Iterator[list]:
+    """Yield the customers matching ``rule`` in chunks of at most ``chunk_size`` rows.
+
+    Chunks are fetched by keyset (see ``candidate_passes`` for the order)
+    rather than by holding a cursor open, so callers may commit between
+    chunks and memory stays bounded by ``chunk_size`` regardless of table
+    size. With a ``watermark`` only customers that became due or were edited
+    since the previous run are returned; ``scope`` is an extra WHERE clause,
+    e.g. one shard's tenant and id range.
+    """
+    for where, order in candidate_passes(rule, today, watermark):
+        if scope is not None:
+            where = and_(scope, where)
+        after = None
+        while True:
+            rows = db.session.execute(chunk_statement(where, order, after, chunk_size)).all()
+            if not rows:
+                break
+            yield rows
+            if len(rows) < chunk_size:
+                break
+            last = rows[-1]
+            after = [*last[len(MATCH_COLUMNS):], last.id]
+
+
+def unsent(rule: Rule, rows: list, today: date) -> List[Tuple[tuple, str]]:
+    """Drop rows the ledger already has a message for; return ``(row, period)`` pairs."""
+    pairs = [(row, rule.period(row, today)) for row in rows]
+    if not pairs:
+        return pairs
+    sent = {tuple(row) for row in db.session.execute(
+        select(EventLedger.customer_id, EventLedger.period).where(
+            EventLedger.event_type == rule.key,
+            EventLedger.customer_id.in_([row.id for row, _ in pairs]),
+            EventLedger.period.in_(sorted({period for _, period in pairs})),
+        )
+    )}
+    return [(row, period) for row, period in pairs if (row.id, period) not in sent]
+
+
+def advance_watermark(rule: Rule, tenant_id: int, today: date, started_at, run_id: Optional[int] = None) -> None:
+    mark = db.session.get(RuleWatermark, (tenant_id, rule.key))
+    if mark is None:
+        mark = RuleWatermark(tenant_id=tenant_id, event_type=rule.key)
+        db.session.add(mark)
+    mark.last_run_on = today
+    mark.last_started_at = started_at
+    mark.run_id = run_id
+    db.session.commit()
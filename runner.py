@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+from multiprocessing import get_context
+from typing import Dict, List, Optional
+
+from flask import Flask, current_app
+
+from dispatcher import Dispatcher
+from metrics import EVENT_CUSTOMERS_SCANNED, EVENT_MESSAGES, EVENT_RUN_SECONDS, EVENT_SHARD_SECONDS
+from models import db, EventRun, EventRunShard
+from rules import RULES, advance_watermark
+from shards import DEFAULT_SHARD_SIZE, execute_shard, init_worker, plan_shards, run_shard_in_worker, worker_config
+from stats import bump_counters
+
+
+def start_run(tenant_id: Optional[int]) -> EventRun:
+    run = EventRun(tenant_id=tenant_id, status="pending")
+    db.session.add(run)
+    db.session.commit()
+    return run
+
+
+def _execute_shards(app: Flask, shard_ids: List[int], today: date, workers: int) -> Dict[int, object]:
+    """Run shards on a process pool (or inline for one worker); returns each shard's results or exception."""
+    results: Dict[int, object] = {}
+    if workers <= 1 or len(shard_ids) <= 1:
+        for shard_id in shard_ids:
+            try:
+                results[shard_id] = execute_shard(shard_id, today)
+            except Exception as exc:
+                results[shard_id] = exc
+        return results
+
+    # Spawned rather than forked: the parent has open connections and threads.
+    with ProcessPoolExecutor(max_workers=min(workers, len(shard_ids)), mp_context=get_context("spawn"),
+                             initializer=init_worker, initargs=(worker_config(app),)) as pool:
+        futures = {pool.submit(run_shard_in_worker, shard_id, today): shard_id for shard_id in shard_ids}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as exc:
+                results[futures[future]] = exc
+    return results
+
+
+def execute_run(run_id: int, today: Optional[date] = None, workers: Optional[int] = None) -> Dict[str, int]:
+    """Evaluate every rule for ``run_id`` and queue the resulting messages.
+
+    The run is split into shards by tenant and, within large tenants, by
+    customer id range (see ``shards.plan_shards``), which execute on
+    ``workers`` processes (EVENT_WORKERS, default one per core). The shards'
+    counts and timings are merged onto the run. A tenant's watermarks only
+    advance once all of its shards have succeeded.
+
+    Returns the number of messages queued per rule. Delivery happens later,
+    when the dispatcher drains the outbox.
+    """
+    app = current_app._get_current_object()
+    config = app.config
+    today = today or date.today()
+    workers = workers or config.get("EVENT_WORKERS") or os.cpu_count() or 1
+    started = time.perf_counter()
+    run = db.session.get(EventRun, run_id)
+    run.status = "running"
+    shards = plan_shards(run, config.get("EVENT_SHARD_SIZE", DEFAULT_SHARD_SIZE))
+    # Seed counter rows up front so concurrent shards only ever update them.
+    for tenant_id in {shard.tenant_id for shard in shards}:
+        bump_counters(tenant_id, events=0)
+    db.session.commit()
+    shard_ids = [shard.shard_id for shard in shards]
+
+    results = _execute_shards(app, shard_ids, today, workers)
+
+    db.session.expire_all()
+    shards = EventRunShard.query.filter_by(run_id=run_id).all()
+    counts = dict.fromkeys((rule.key for rule in RULES), 0)
+    scanned = 0
+    failed_tenants = set()
+    for shard in shards:
+        result = results.get(shard.shard_id)
+        EVENT_SHARD_SECONDS.observe(shard.seconds or 0.0, shard.status)
+        if isinstance(result, dict):
+            for key, count in result["messages"].items():
+                counts[key] += count
+            for key, count in result["scanned"].items():
+                EVENT_CUSTOMERS_SCANNED.inc(key, amount=count)
+                scanned += count
+            for (key, channel), count in result["channels"].items():
+                EVENT_MESSAGES.inc(key, channel, amount=count)
+        else:
+            failed_tenants.add(shard.tenant_id)
+            app.logger.error("Event run %s shard %s (tenant %s) failed: %s",
+                             run_id, shard.shard_id, shard.tenant_id, shard.error or result)
+    for tenant_id in {shard.tenant_id for shard in shards} - failed_tenants:
+        for rule in RULES:
+            advance_watermark(rule, tenant_id, today, run.started_at, run_id)
+
+    run = db.session.get(EventRun, run_id)
+    run.messages = sum(shard.messages for shard in shards)
+    run.rows_written = sum(shard.rows_written for shard in shards)
+    run.write_seconds = sum(shard.write_seconds for shard in shards)
+    if failed_tenants:
+        run.status = "failed"
+        run.finished_at = datetime.utcnow()
+    elif run.messages:
+        run.status = "dispatching"
+    else:
+        run.status = "completed"
+        run.finished_at = datetime.utcnow()
+    db.session.commit()
+
+    elapsed = time.perf_counter() - started
+    EVENT_RUN_SECONDS.observe(elapsed, "failed" if failed_tenants else "completed")
+    shard_seconds = sum(shard.seconds for shard in shards)
+    app.logger.info(
+        "Event run %s: %d messages from %d candidates in %d shards on %d workers in %.2fs (%.2fs of shard time)",
+        run_id, run.messages, scanned, len(shards), min(workers, max(len(shards), 1)), elapsed, shard_seconds,
+    )
+    return counts
+
+
+def _run_in_background(app: Flask, run_id: int) -> None:
+    with app.app_context():
+        try:
+            execute_run(run_id)
+        except Exception:
+            db.session.rollback()
+            run = db.session.get(EventRun, run_id)
+            run.status = "failed"
+            run.finished_at = datetime.utcnow()
+            db.session.commit()
+            app.logger.exception("Event run %s failed", run_id)
+            return
+        if app.config.get("OUTBOX_DISPATCH_IN_APP"):
+            Dispatcher(app).drain()
+
+
+def launch_run(app: Flask, run_id: int) -> None:
+    """Execute ``run_id`` (and, if configured, deliver its messages) off the request thread."""
+    if not app.config.get("EVENT_RUN_ASYNC", True):
+        _run_in_background(app, run_id)
+        return
+    threading.Thread(target=_run_in_background, args=(app, run_id), name=f"event-run-{run_id}",
+                     daemon=True).start()
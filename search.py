@@ -0,0 +1,124 @@
+import re
+from typing import List
+
+from flask import current_app
+from sqlalchemy import inspect, or_, text
+
+from models import db, normalize_mobile, Customer
+
+
+DEFAULT_SEARCH_LIMIT = 50
+
+# Trigram tokens need at least three characters; shorter terms use LIKE.
+MIN_TRIGRAM_LENGTH = 3
+
+DEFAULT_RANK_CANDIDATES = 1000
+
+# External-content FTS5 index over customers, kept in sync by triggers so
+# every write path (ORM, bulk inserts, raw SQL) is covered.
+SQLITE_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE customers_fts USING fts5(
+        name, email, mobile, content='customers', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER customers_fts_ai AFTER INSERT ON customers BEGIN
+        INSERT INTO customers_fts(rowid, name, email, mobile) VALUES (new.id, new.name, new.email, new.mobile);
+    END""",
+    """CREATE TRIGGER customers_fts_ad AFTER DELETE ON customers BEGIN
+        INSERT INTO customers_fts(customers_fts, rowid, name, email, mobile)
+        VALUES ('delete', old.id, old.name, old.email, old.mobile);
+    END""",
+    """CREATE TRIGGER customers_fts_au AFTER UPDATE OF name, email, mobile ON customers BEGIN
+        INSERT INTO customers_fts(customers_fts, rowid, name, email, mobile)
+        VALUES ('delete', old.id, old.name, old.email, old.mobile);
+        INSERT INTO customers_fts(rowid, name, email, mobile) VALUES (new.id, new.name, new.email, new.mobile);
+    END""",
+    "INSERT INTO customers_fts(customers_fts) VALUES ('rebuild')",
+]
+
+
+def fts_available() -> bool:
+    available = current_app.extensions.get("customer_fts")
+    if available is None:
+        available = current_app.extensions["customer_fts"] = (
+            db.engine.dialect.name == "sqlite" and inspect(db.engine).has_table("customers_fts")
+        )
+    return available
+
+
+def ensure_search_index() -> bool:
+    """Create and populate the SQLite full-text index if it is missing.
+
+    Returns whether the index is available; other databases, and SQLite builds
+    without the trigram tokenizer, fall back to LIKE matching.
+    """
+    current_app.extensions.pop("customer_fts", None)
+    if db.engine.dialect.name != "sqlite" or fts_available():
+        return fts_available()
+    try:
+        with db.engine.begin() as conn:
+            for statement in SQLITE_SEARCH_DDL:
+                conn.execute(text(statement))
+    except Exception:
+        return False
+    current_app.extensions["customer_fts"] = True
+    return True
+
+
+def _mobile_prefix_ids(digits: str, limit: int) -> List[int]:
+    # A range rather than LIKE 'x%' so the index is used under any collation.
+    upper = digits[:-1] + chr(ord(digits[-1]) + 1)
+    return list(db.session.execute(
+        db.select(Customer.id)
+        .where(Customer.mobile_digits >= digits, Customer.mobile_digits < upper)
+        .order_by(Customer.mobile_digits, Customer.id).limit(limit)
+    ).scalars())
+
+
+def _fts_ids(term: str, limit: int) -> List[int]:
+    phrase = '"' + term.replace('"', '""') + '"'
+    # ORDER BY rank on the match itself scores every match; a common term
+    # like "900" matches most customers, so only the newest candidates are ranked.
+    candidates = current_app.config.get("SEARCH_RANK_CANDIDATES", DEFAULT_RANK_CANDIDATES)
+    return list(db.session.execute(
+        text("SELECT rowid FROM ("
+             " SELECT rowid, rank FROM customers_fts WHERE customers_fts MATCH :q ORDER BY rowid DESC LIMIT :candidates"
+             ") ORDER BY rank LIMIT :limit"),
+        {"q": phrase, "candidates": max(candidates, limit), "limit": limit},
+    ).scalars())
+
+
+def _like_ids(term: str, limit: int) -> List[int]:
+    return list(db.session.execute(
+        db.select(Customer.id).where(or_(
+            Customer.name.contains(term),
+            Customer.email.contains(term),
+            Customer.mobile.contains(term),
+        )).order_by(Customer.id.desc()).limit(limit)
+    ).scalars())
+
+
+def search_customers(term: str, limit: int = DEFAULT_SEARCH_LIMIT) -> List[Customer]:
+    """Customers matching ``term`` in name, email or mobile, best matches first.
+
+    Phone-number-like terms are first matched as a prefix of the normalized
+    mobile number. Everything else goes through the FTS5 trigram index
+    (the newest SEARCH_RANK_CANDIDATES matches, ranked by bm25) when
+    available, otherwise through a bounded LIKE scan.
+    """
+    term = term.strip()
+    if not term:
+        return []
+    ids: List[int] = []
+    digits = normalize_mobile(term)
+    if digits and re.fullmatch(r"[\d\s()+.-]+", term):
+        ids.extend(_mobile_prefix_ids(digits, limit))
+    if len(ids) < limit:
+        if len(term) >= MIN_TRIGRAM_LENGTH and fts_available():
+            more = _fts_ids(term, limit)
+        else:
+            more = _like_ids(term, limit)
+        seen = set(ids)
+        ids.extend(i for i in more if i not in seen)
+    ids = ids[:limit]
+    customers = {c.id: c for c in Customer.query.filter(Customer.id.in_(ids))} if ids else {}
+    return [customers[i] for i in ids if i in customers]
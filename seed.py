@@ -1,12 +1,14 @@
 from datetime import date
 
 from app import create_app
+from migrations import init_db
 from models import db, Customer
 
 
 if __name__ == "__main__":
     app = create_app()
     with app.app_context():
+        init_db()
         # Example customer: Abbas, purchased Tissot 2023-01-01
         existing = Customer.query.filter_by(name="Abbas").first()
         if not existing:
@@ -0,0 +1,179 @@
+import math
+import os
+import time
+from datetime import date
+from typing import List, Optional
+
+from flask import Flask, current_app
+from sqlalchemy import and_, func, or_, select
+
+from bulk import BulkWriter, DEFAULT_WRITE_CHUNK_SIZE
+from config import Config
+from engines import init_engines
+from message_templates import templates_for_run
+from models import db, Customer, EventRun, EventRunShard
+from rules import RULES, DEFAULT_CHUNK_SIZE, iter_matches, load_watermarks, unsent
+from stats import default_tenant_id
+
+
+DEFAULT_SHARD_SIZE = 20000
+
+# Settings a worker process needs from the app that started the run.
+WORKER_CONFIG_KEYS = (
+    "SQLALCHEMY_DATABASE_URI", "SQLALCHEMY_ENGINE_OPTIONS", "MAIL_USERNAME",
+    "EVENT_CHUNK_SIZE", "EVENT_WRITE_CHUNK_SIZE",
+)
+
+
+def customer_scopes(shard: EventRunShard) -> list:
+    """WHERE clauses that together select the customers in ``shard``, one per tenant_id value.
+
+    The demo shop's shard also covers untenanted customers. Reading them
+    apart keeps each query on a (tenant_id, ...) index range, which an OR
+    over tenant_id would turn into a merge of both ranges and a sort.
+    """
+    ids = []
+    if shard.first_id is not None:
+        ids.append(Customer.id >= shard.first_id)
+    if shard.end_id is not None:
+        ids.append(Customer.id < shard.end_id)
+    tenants = [Customer.tenant_id == shard.tenant_id]
+    if shard.include_untenanted:
+        tenants.append(Customer.tenant_id.is_(None))
+    return [and_(tenant, *ids) for tenant in tenants]
+
+
+def customer_scope(shard: EventRunShard):
+    """WHERE clause for the customers in ``shard``."""
+    return or_(*customer_scopes(shard))
+
+
+def plan_shards(run: EventRun, shard_size: int = DEFAULT_SHARD_SIZE) -> List[EventRunShard]:
+    """Split ``run`` into one shard per tenant, and tenants larger than
+    ``shard_size`` customers into equal-sized customer id ranges.
+
+    Runs without a tenant cover every tenant. Shards are added to the session
+    but not committed.
+    """
+    default_id = default_tenant_id()
+    owner = func.coalesce(Customer.tenant_id, default_id)
+    query = select(owner, func.count()).group_by(owner)
+    if run.tenant_id is not None:
+        query = query.where(owner == run.tenant_id)
+
+    shards = []
+    for tenant_id, count in db.session.execute(query).all():
+        if tenant_id is None:
+            continue
+        base = EventRunShard(run_id=run.run_id, tenant_id=tenant_id, include_untenanted=tenant_id == default_id)
+        # Boundaries at every shard_size-th customer id, so ranges hold equal
+        # numbers of customers however sparse the ids are.
+        boundaries = [None]
+        for i in range(1, math.ceil(count / shard_size)):
+            boundaries.append(db.session.execute(
+                select(Customer.id).where(customer_scope(base)).order_by(Customer.id)
+                .offset(i * shard_size).limit(1)
+            ).scalar())
+        boundaries.append(None)
+        for first_id, end_id in zip(boundaries, boundaries[1:]):
+            shards.append(EventRunShard(
+                run_id=run.run_id, tenant_id=tenant_id, first_id=first_id, end_id=end_id,
+                include_untenanted=base.include_untenanted, status="pending",
+            ))
+    db.session.add_all(shards)
+    return shards
+
+
+def execute_shard(shard_id: int, today: date) -> dict:
+    """Evaluate every rule over one shard's customers and queue the messages.
+
+    Runs in the current app context, in a pool worker or inline. Returns the
+    messages queued per rule, customers scanned per rule and messages per
+    (rule, channel); totals, scanned counts and timings are also stored on
+    the shard row for the coordinator.
+    """
+    config = current_app.config
+    started = time.perf_counter()
+    shard = db.session.get(EventRunShard, shard_id)
+    run = db.session.get(EventRun, shard.run_id)
+    shard.status = "running"
+    shard.worker_pid = os.getpid()
+    db.session.commit()
+
+    try:
+        email_enabled = bool(config.get("MAIL_USERNAME"))
+        scopes = customer_scopes(shard)
+        writer = BulkWriter(
+            tenant_id=shard.tenant_id,
+            chunk_size=config.get("EVENT_WRITE_CHUNK_SIZE", DEFAULT_WRITE_CHUNK_SIZE),
+            sent_at=run.started_at,
+            run_id=run.run_id,
+        )
+        watermarks = load_watermarks(shard.tenant_id)
+        templates = templates_for_run(shard.tenant_id)
+        counts, scanned = {}, {}
+        for rule in RULES:
+            written_before = writer.messages_written
+            template = templates[rule.key]
+            chunks = (chunk for scope in scopes
+                      for chunk in iter_matches(rule, today, config.get("EVENT_CHUNK_SIZE", DEFAULT_CHUNK_SIZE),
+                                                watermark=watermarks.get(rule.key), scope=scope))
+            scanned[rule.key] = 0
+            for chunk in chunks:
+                scanned[rule.key] += len(chunk)
+                pairs = unsent(rule, chunk, today)
+                bodies = template.render_many(customer for customer, _ in pairs)
+                for (customer, period), body in zip(pairs, bodies):
+                    if rule.email_subject and email_enabled and customer.email:
+                        writer.add(customer.id, rule.key, body, "email", period=period,
+                                   recipient=customer.email, subject=rule.email_subject)
+                    else:
+                        writer.add(customer.id, rule.key, body, rule.channel, period=period)
+            writer.flush()
+            counts[rule.key] = writer.messages_written - written_before
+    except Exception as exc:
+        db.session.rollback()
+        shard = db.session.get(EventRunShard, shard_id)
+        shard.status = "failed"
+        shard.error = f"{type(exc).__name__}: {exc}"
+        shard.seconds = time.perf_counter() - started
+        db.session.commit()
+        raise
+
+    shard = db.session.get(EventRunShard, shard_id)
+    shard.status = "completed"
+    shard.messages = writer.messages_written
+    shard.rows_written = writer.rows_written
+    shard.write_seconds = writer.write_seconds
+    shard.seconds = time.perf_counter() - started
+    shard.scanned = scanned
+    db.session.commit()
+    return {"messages": counts, "scanned": scanned, "channels": dict(writer.channel_counts)}
+
+
+# Set in each pool worker by init_worker.
+_worker_app: Optional[Flask] = None
+
+
+def worker_config(app: Flask) -> dict:
+    return {key: app.config[key] for key in WORKER_CONFIG_KEYS if key in app.config}
+
+
+def init_worker(config: dict) -> None:
+    """Pool initializer: a bare app with its own engine, so every worker
+    process opens its own database connections."""
+    global _worker_app
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config.update(config)
+    db.init_app(app)
+    init_engines(app)
+    _worker_app = app
+
+
+def run_shard_in_worker(shard_id: int, today: date) -> dict:
+    with _worker_app.app_context():
+        try:
+            return execute_shard(shard_id, today)
+        finally:
+            db.session.remove()
@@ -0,0 +1,92 @@
+"""A local SMTP server that records what it receives, for checking the outbox
+dispatcher and the SMTP pool without sending real mail.
+
+Needs aiosmtpd (pip install aiosmtpd), which the app itself doesn't.
+"""
+import asyncio
+import socket
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import SMTP
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class _SessionSMTP(SMTP):
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self.session_number = self.event_handler.stub._session_started()
+
+
+class _Handler:
+    def __init__(self, stub: "StubSMTPServer"):
+        self.stub = stub
+
+    async def handle_DATA(self, server, session, envelope):
+        return self.stub._data(server, envelope)
+
+
+class _Controller(Controller):
+    def factory(self):
+        return _SessionSMTP(self.handler, **self.SMTP_kwargs)
+
+
+class StubSMTPServer:
+    """Accept mail on localhost and record every session and message.
+
+    ``reply(recipient, attempt)`` gives the DATA reply for a recipient's
+    ``attempt``-th message (default "250 OK"); a 4xx or 5xx reply rejects
+    it. With ``drop_every`` the server closes a session after that many
+    accepted messages, like a server timing out its clients. Use it as a
+    context manager.
+    """
+
+    def __init__(self, reply: Optional[Callable[[str, int], str]] = None, drop_every: int = 0):
+        self.reply = reply
+        self.drop_every = drop_every
+        self.port = free_port()
+        # Messages accepted per session, in the order sessions were opened.
+        self.sessions: List[int] = []
+        # Recipient -> times of every DATA attempt, and of accepted messages.
+        self.attempts: Dict[str, List[float]] = defaultdict(list)
+        self.delivered: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._controller = _Controller(_Handler(self), hostname="127.0.0.1", port=self.port)
+
+    def _session_started(self) -> int:
+        with self._lock:
+            self.sessions.append(0)
+            return len(self.sessions) - 1
+
+    def _data(self, server: _SessionSMTP, envelope) -> str:
+        recipient = envelope.rcpt_tos[0]
+        with self._lock:
+            self.attempts[recipient].append(time.monotonic())
+            reply = self.reply(recipient, len(self.attempts[recipient])) if self.reply else "250 OK"
+            if not reply.startswith("250"):
+                return reply
+            self.delivered[recipient] += 1
+            self.sessions[server.session_number] += 1
+            drop = self.drop_every and self.sessions[server.session_number] % self.drop_every == 0
+        if drop:
+            # After the reply is written.
+            asyncio.get_running_loop().call_soon(server.transport.close)
+        return reply
+
+    def __enter__(self) -> "StubSMTPServer":
+        self._controller.start()
+        with self._lock:
+            # start() connects once to check the server is up.
+            self.sessions.clear()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._controller.stop()
@@ -0,0 +1,96 @@
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from cache import LRUCache
+from models import db, Customer, Event, MessageDailyStats, Tenant, TenantStats, Watch
+
+
+COUNTERS = ("customers", "watches", "events")
+
+# Customers created before tenants were stamped on them belong to the demo shop.
+DEFAULT_TENANT_NAME = "Default Watch Shop"
+
+stats_cache = LRUCache(maxsize=1024)
+
+
+def default_tenant_id() -> Optional[int]:
+    return db.session.execute(select(Tenant.tenant_id).where(Tenant.name == DEFAULT_TENANT_NAME)).scalar()
+
+
+def _count_by_tenant() -> Dict[int, Dict[str, int]]:
+    default_id = default_tenant_id()
+    counts: Dict[int, Dict[str, int]] = {}
+    owner = func.coalesce(Customer.tenant_id, default_id)
+    queries = {
+        "customers": select(owner, func.count()).group_by(owner),
+        "watches": select(Watch.tenant_id, func.count()).group_by(Watch.tenant_id),
+        "events": select(Event.tenant_id, func.count()).where(Event.tenant_id.isnot(None)).group_by(Event.tenant_id),
+    }
+    for counter, query in queries.items():
+        for tenant_id, count in db.session.execute(query):
+            if tenant_id is not None:
+                counts.setdefault(tenant_id, dict.fromkeys(COUNTERS, 0))[counter] = count
+    # Archived events still count, through their daily rollups.
+    archived = select(MessageDailyStats.tenant_id, func.sum(MessageDailyStats.messages)).group_by(
+        MessageDailyStats.tenant_id)
+    for tenant_id, count in db.session.execute(archived):
+        counts.setdefault(tenant_id, dict.fromkeys(COUNTERS, 0))["events"] += count or 0
+    return counts
+
+
+def bump_counters(tenant_id: Optional[int], **deltas: int) -> None:
+    """Add ``deltas`` to a tenant's counters inside the caller's transaction.
+
+    Call it before committing the rows being counted. The first bump for a
+    tenant without a counter row seeds one from full counts instead.
+    """
+    if tenant_id is None:
+        return
+    values = {name: getattr(TenantStats, name) + delta for name, delta in deltas.items()}
+    result = db.session.execute(
+        TenantStats.__table__.update().where(TenantStats.tenant_id == tenant_id).values(values)
+    )
+    if result.rowcount == 0:
+        db.session.flush()
+        counts = _count_by_tenant().get(tenant_id, dict.fromkeys(COUNTERS, 0))
+        db.session.execute(TenantStats.__table__.insert(), [dict(counts, tenant_id=tenant_id)])
+    stats_cache.invalidate_matching(lambda key: key[0] == tenant_id)
+
+
+def tenant_stats(tenant_id: int, version: Hashable = None) -> Dict[str, int]:
+    """Counters for the dashboard, served from the in-process cache for STATS_CACHE_TTL seconds.
+
+    ``version`` is part of the cache key: pass the data versions the page's
+    ETag comes from, so counters written by other processes are re-read as
+    soon as the page's ETag changes.
+    """
+
+    def load():
+        row = db.session.get(TenantStats, tenant_id)
+        if row is None:
+            return _count_by_tenant().get(tenant_id, dict.fromkeys(COUNTERS, 0))
+        return {name: getattr(row, name) for name in COUNTERS}
+
+    return stats_cache.get((tenant_id, version), load, ttl=current_app.config.get("STATS_CACHE_TTL", 30))
+
+
+def reconcile_stats() -> List[Tuple[int, str, int, int]]:
+    """Recount every tenant and overwrite its counters; returns ``(tenant, counter, stored, actual)`` drifts."""
+    actual = _count_by_tenant()
+    stored = {row.tenant_id: row for row in TenantStats.query.all()}
+    drift = []
+    for tenant_id in sorted(set(actual) | set(stored) | {t for (t,) in db.session.execute(select(Tenant.tenant_id))}):
+        counts = actual.get(tenant_id, dict.fromkeys(COUNTERS, 0))
+        row = stored.get(tenant_id)
+        if row is None:
+            row = TenantStats(tenant_id=tenant_id, **dict.fromkeys(COUNTERS, 0))
+            db.session.add(row)
+        for name in COUNTERS:
+            if (getattr(row, name) or 0) != counts[name]:
+                drift.append((tenant_id, name, getattr(row, name) or 0, counts[name]))
+                setattr(row, name, counts[name])
+    db.session.commit()
+    stats_cache.invalidate()
+    return drift
@@ -0,0 +1,175 @@
+import smtplib
+import threading
+import time
+from typing import List, Optional
+
+from flask import Flask
+from flask_mail import Connection, Message
+
+
+# Errors after which a session can no longer be trusted. Other SMTP errors
+# (a refused recipient, a 4xx on DATA) leave it usable; note every
+# SMTPException is also an OSError, so these must be checked first.
+BROKEN_SESSION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)
+
+
+class _PooledConnection:
+    def __init__(self, connection: Connection):
+        self.connection = connection
+        self.messages = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPPool:
+    """A bounded pool of long-lived, authenticated SMTP sessions.
+
+    Connections are opened through Flask-Mail's ``connect()`` context, so they
+    honour the app's MAIL_* settings, and are reused for up to
+    ``max_messages`` messages before being replaced. Connections idle for
+    longer than ``idle_timeout`` are replaced instead of reused, and a session
+    the server dropped is reopened once before the send is retried.
+
+    ``send`` must be called inside an application context.
+    """
+
+    def __init__(self, app: Flask, size: int = 4, max_messages: int = 100, idle_timeout: float = 60.0):
+        self.app = app
+        self.size = max(1, size)
+        self.max_messages = max(1, max_messages)
+        self.idle_timeout = idle_timeout
+        self._idle: List[_PooledConnection] = []
+        self._open = 0
+        self._cond = threading.Condition()
+        self.handshakes = 0
+        self.reconnects = 0
+        self.messages_sent = 0
+        self.send_errors = 0
+        self._first_send: Optional[float] = None
+        self._last_send: Optional[float] = None
+
+    def _connect(self) -> _PooledConnection:
+        connection = self.app.extensions["mail"].connect()
+        connection.__enter__()
+        with self._cond:
+            self.handshakes += 1
+        return _PooledConnection(connection)
+
+    def _close(self, pooled: _PooledConnection) -> None:
+        try:
+            pooled.connection.__exit__(None, None, None)
+        except Exception:
+            pass
+
+    def _acquire(self) -> _PooledConnection:
+        stale = []
+        pooled = None
+        with self._cond:
+            while pooled is None:
+                if self._idle:
+                    candidate = self._idle.pop()
+                    if time.monotonic() - candidate.last_used > self.idle_timeout:
+                        stale.append(candidate)
+                        self._open -= 1
+                        continue
+                    pooled = candidate
+                elif self._open < self.size:
+                    # Reserve a slot, then handshake outside the lock.
+                    self._open += 1
+                    break
+                else:
+                    self._cond.wait()
+        for old in stale:
+            self._close(old)
+        if pooled is not None:
+            return pooled
+        try:
+            return self._connect()
+        except Exception:
+            self._release(None)
+            raise
+
+    def _release(self, pooled: Optional[_PooledConnection]) -> None:
+        with self._cond:
+            if pooled is None:
+                self._open -= 1
+            else:
+                pooled.last_used = time.monotonic()
+                self._idle.append(pooled)
+            self._cond.notify()
+
+    def send(self, message: Message) -> None:
+        pooled = self._acquire()
+        try:
+            try:
+                pooled.connection.send(message)
+            except smtplib.SMTPServerDisconnected:
+                self._close(pooled)
+                # Closed: if reconnecting fails, there is no session to put back.
+                pooled = None
+                with self._cond:
+                    self.reconnects += 1
+                pooled = self._connect()
+                pooled.connection.send(message)
+        except Exception as exc:
+            broken = isinstance(exc, BROKEN_SESSION_ERRORS) or (
+                isinstance(exc, OSError) and not isinstance(exc, smtplib.SMTPException)
+            )
+            if pooled is None:
+                self._release(None)
+            elif broken:
+                self._close(pooled)
+                self._release(None)
+            else:
+                self._release(pooled)
+            with self._cond:
+                self.send_errors += 1
+            raise
+        pooled.messages += 1
+        if pooled.messages >= self.max_messages:
+            self._close(pooled)
+            self._release(None)
+        else:
+            self._release(pooled)
+        now = time.monotonic()
+        with self._cond:
+            self.messages_sent += 1
+            if self._first_send is None:
+                self._first_send = now
+            self._last_send = now
+
+    def close(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for pooled in idle:
+            self._close(pooled)
+
+    def stats(self) -> dict:
+        with self._cond:
+            elapsed = (self._last_send - self._first_send) if self._first_send is not None else 0.0
+            return {
+                "messages_sent": self.messages_sent,
+                "send_errors": self.send_errors,
+                "handshakes": self.handshakes,
+                "reconnects": self.reconnects,
+                "open_connections": self._open,
+                "messages_per_second": self.messages_sent / elapsed if elapsed else 0.0,
+                "messages_per_handshake": self.messages_sent / self.handshakes if self.handshakes else 0.0,
+            }
+
+
+_pool_lock = threading.Lock()
+
+
+def get_smtp_pool(app: Flask) -> SMTPPool:
+    """The process-wide SMTP pool for ``app``, created on first use."""
+    with _pool_lock:
+        pool = app.extensions.get("smtp_pool")
+        if pool is None:
+            pool = app.extensions["smtp_pool"] = SMTPPool(
+                app,
+                size=app.config.get("SMTP_POOL_SIZE", 4),
+                max_messages=app.config.get("SMTP_MAX_MESSAGES_PER_CONNECTION", 100),
+                idle_timeout=app.config.get("SMTP_IDLE_TIMEOUT", 60),
+            )
+        return pool